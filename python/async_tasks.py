@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+import asyncio
+import functools
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from task_waiter import FINAL_STATES, MISSING, fetch_states
+
+
+class AsyncConnection:
+    '''Drive the create bucket / upload / submit / monitor / download lifecycle
+    of many tasks concurrently, from a single asyncio event loop.
+
+    The qarnot SDK is blocking, so every SDK call is run in a thread pool of at
+    most max_workers threads: this bounds the number of simultaneous requests
+    to the API, whatever the number of tasks. The states of all the monitored
+    tasks are fetched at once by a single background poller, every poll_delay
+    seconds, from the tasks of job or carrying all the tags, the same way as
+    task_waiter.TaskWaiter does (see task_waiter.fetch_states).'''
+    def __init__(self, conn, max_workers=16, poll_delay=2., job=None, tags=None):
+        self.conn = conn
+        self.poll_delay = poll_delay
+        self.job = job
+        self.tags = tags
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._states = {}
+        self._tick = None
+        self._poller = None
+        self._poll_error = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    async def call(self, func, *args, **kwargs):
+        '''Run the blocking call func(*args, **kwargs) in the thread pool and return its result'''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def create_bucket(self, name):
+        return await self.call(self.conn.create_bucket, name)
+
+    async def upload(self, bucket, local, remote=None):
+        '''Upload the local file to bucket, under the name remote if given'''
+        await self.call(bucket.add_file, local, remote)
+
+    async def submit(self, task):
+        await self.call(task.submit)
+
+    async def download_results(self, task, output_dir):
+        await self.call(task.download_results, output_dir)
+
+    async def delete(self, task):
+        await self.call(task.delete, purge_resources=True, purge_results=True)
+
+    def _ensure_poller(self):
+        if self._poller is None:
+            self._tick = asyncio.Event()
+            self._poll_error = None
+            self._poller = asyncio.ensure_future(self._poll())
+
+    async def _poll(self):
+        '''Fetch the states of all the monitored tasks at once, and wake up their monitors'''
+        try:
+            while self._states:
+                states = await self.call(fetch_states, self.conn, list(self._states), self.job, self.tags)
+                for uuid, state in states.items():
+                    if uuid in self._states:
+                        self._states[uuid] = state
+                tick, self._tick = self._tick, asyncio.Event()
+                tick.set()
+                await asyncio.sleep(self.poll_delay)
+        except Exception as error:
+            # Hand the error over to every waiting monitor
+            self._poll_error = error
+            self._tick.set()
+        finally:
+            self._poller = None
+
+    async def monitor(self, task, on_state_change=None, on_poll=None):
+        '''Wait for a submitted task to reach a final state, and return this state,
+        task_waiter.MISSING if the task was deleted meanwhile.
+
+        on_state_change(task, state) is called on each state change.
+        on_poll(task) is called after each poll, in the thread pool, so that it
+        can make blocking SDK calls such as task.fresh_stdout().'''
+        self._states[task.uuid] = None
+        self._ensure_poller()
+        last_state = None
+        try:
+            while True:
+                await self._tick.wait()
+                if self._poll_error is not None:
+                    raise self._poll_error
+                state = self._states[task.uuid]
+                if on_poll is not None:
+                    await self.call(on_poll, task)
+                if state is None or state == last_state:
+                    continue
+                last_state = state
+                if on_state_change is not None:
+                    on_state_change(task, state)
+                if state in FINAL_STATES:
+                    if state != MISSING:
+                        # Refresh the whole task once, to get its errors, times and so on
+                        await self.call(task.update, flushcache=True)
+                    return state
+        finally:
+            del self._states[task.uuid]
+
+    async def run_task(self, task, output_dir=None, on_state_change=None, on_poll=None):
+        '''Submit task, wait for it to be finished and, on success, download its
+        results into output_dir. Return the final state of the task'''
+        await self.submit(task)
+        state = await self.monitor(task, on_state_change, on_poll)
+        if output_dir is not None and state == 'Success':
+            await self.download_results(task, output_dir)
+        return state
+
+
+def print_output(task):
+    '''on_poll callback displaying the fresh stdout / stderr of a task'''
+    sys.stdout.write(task.fresh_stdout())
+    sys.stderr.write(task.fresh_stderr())
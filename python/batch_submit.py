@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Outcome of the submission of one task: error is None on success. elapsed is
+# the time taken by the submission of its whole batch
+SubmitResult = namedtuple('SubmitResult', ['task', 'error', 'elapsed'])
+
+
+def submit_batch(conn, tasks):
+    '''Submit tasks with one request to the bulk endpoint of the API
+    (Connection.submit_tasks), and return their SubmitResult. The SDK then
+    refreshes every created task with a request of its own, so a batch of n
+    tasks costs n + 1 requests, against 2n with Task.submit.
+
+    The SDK raises one error for the whole batch, listing the tasks it could
+    not create: the tasks left without uuid are given this error, the others
+    were submitted.'''
+    start = time.perf_counter()
+    error = None
+    try:
+        conn.submit_tasks(tasks)
+    except Exception as e:
+        error = e
+    elapsed = time.perf_counter() - start
+    return [SubmitResult(task, error if task.uuid is None else None, elapsed) for task in tasks]
+
+
+def submit_tasks(conn, tasks, batch_size=50, max_concurrency=4):
+    '''Submit many configured tasks in batches of at most batch_size tasks, each
+    one through the bulk endpoint (see submit_batch), with at most max_concurrency
+    batches in flight at a time.
+
+    Submission errors do not stop the other submissions: a list of SubmitResult
+    is returned, in the same order as tasks.'''
+    tasks = list(tasks)
+    batches = [tasks[i:i + batch_size] for i in range(0, len(tasks), batch_size)]
+    with ThreadPoolExecutor(max_concurrency) as executor:
+        return [result for results in executor.map(lambda batch: submit_batch(conn, batch), batches)
+                for result in results]
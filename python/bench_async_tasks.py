@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+'''Compare the sequential sample lifecycle with async_tasks on a fake connection.
+
+Every fake API call sleeps for --latency seconds, and every fake task runs for
+--run-time seconds once submitted, so that the benchmark runs without any
+Qarnot account:
+
+    python bench_async_tasks.py -n 50 --latency 0.05 --run-time 1'''
+
+import argparse
+import asyncio
+import itertools
+import time
+import uuid
+
+from async_tasks import AsyncConnection
+
+
+class FakeBucket:
+    def __init__(self, conn, name):
+        self._conn = conn
+        self.name = name
+
+    def add_file(self, local, remote=None):
+        self._conn.request()
+
+
+class FakeTask:
+    def __init__(self, conn, name):
+        self._conn = conn
+        self.name = name
+        self.uuid = str(uuid.uuid4())
+        self.auto_update = True
+        self.resources = []
+        self.results = None
+        self.constants = {}
+        self.errors = []
+        self._submitted_at = None
+
+    @property
+    def state(self):
+        if self._submitted_at is None:
+            return 'UnSubmitted'
+        if time.monotonic() - self._submitted_at < self._conn.run_time:
+            return 'FullyExecuting'
+        return 'Success'
+
+    def submit(self):
+        self._conn.request()
+        self._submitted_at = time.monotonic()
+        self._conn.submitted.append(self)
+
+    def update(self, flushcache=False):
+        self._conn.request()
+
+    def wait(self, timeout=None):
+        self._conn.request()
+        remaining = self._submitted_at + self._conn.run_time - time.monotonic()
+        time.sleep(max(0, min(remaining, timeout)))
+        return self.state == 'Success'
+
+    def fresh_stdout(self):
+        self._conn.request()
+        return ''
+
+    def fresh_stderr(self):
+        self._conn.request()
+        return ''
+
+    def download_results(self, output_dir):
+        self._conn.request()
+
+
+class FakeConnection:
+    '''Mimics the part of qarnot.Connection used by the samples'''
+    def __init__(self, latency, run_time):
+        self.latency = latency
+        self.run_time = run_time
+        self.requests = 0
+        self.submitted = []
+
+    def request(self):
+        self.requests += 1
+        time.sleep(self.latency)
+
+    def create_bucket(self, name):
+        self.request()
+        return FakeBucket(self, name)
+
+    def create_task(self, name, profile, instance_count):
+        return FakeTask(self, name)
+
+    def all_tasks(self, summary=True, tags=None, tags_intersect=None):
+        self.request()
+        return list(self.submitted)
+
+
+def sequential(conn, count, poll_delay):
+    '''The lifecycle of sample2_files.py before async_tasks, one task after the other'''
+    for i in range(count):
+        task = conn.create_task(f'bench-{i}', 'docker-batch', 1)
+        input_bucket = conn.create_bucket(f'bench-{i}-input')
+        input_bucket.add_file('input/lorem.txt')
+        task.resources.append(input_bucket)
+        task.results = conn.create_bucket(f'bench-{i}-output')
+        task.submit()
+        done = False
+        while not done:
+            done = task.wait(poll_delay)
+            task.fresh_stdout()
+            task.fresh_stderr()
+        task.download_results('output')
+
+
+async def concurrent(conn, count, poll_delay, max_workers):
+    '''The same lifecycle, for all the tasks at once through async_tasks'''
+    async def run(aconn, i):
+        task = conn.create_task(f'bench-{i}', 'docker-batch', 1)
+        task.tags = ['bench']
+        input_bucket, output_bucket = await asyncio.gather(aconn.create_bucket(f'bench-{i}-input'),
+                                                           aconn.create_bucket(f'bench-{i}-output'))
+        await aconn.upload(input_bucket, 'input/lorem.txt')
+        task.resources.append(input_bucket)
+        task.results = output_bucket
+        await aconn.run_task(task, 'output', on_poll=lambda t: (t.fresh_stdout(), t.fresh_stderr()))
+
+    async with AsyncConnection(conn, max_workers=max_workers, poll_delay=poll_delay,
+                               tags=['bench']) as aconn:
+        await asyncio.gather(*[run(aconn, i) for i in range(count)])
+
+
+def report(name, conn, count, elapsed):
+    print(f'{name:<12} {count:>6} tasks  {elapsed:8.2f} s  {count / elapsed:8.2f} tasks/s  '
+          f'{conn.requests:>7} requests')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--count', type=int, nargs='+', default=[10, 50])
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per fake API call')
+    parser.add_argument('--run-time', type=float, default=0.5, help='seconds of execution per fake task')
+    parser.add_argument('--poll-delay', type=float, default=0.1)
+    parser.add_argument('--max-workers', type=int, default=32)
+    parser.add_argument('--skip-sequential', action='store_true')
+    args = parser.parse_args()
+
+    modes = ['async'] if args.skip_sequential else ['sequential', 'async']
+    for count, mode in itertools.product(args.count, modes):
+        conn = FakeConnection(args.latency, args.run_time)
+        start = time.perf_counter()
+        if mode == 'sequential':
+            sequential(conn, count, args.poll_delay)
+        else:
+            asyncio.run(concurrent(conn, count, args.poll_delay, args.max_workers))
+        report(mode, conn, count, time.perf_counter() - start)
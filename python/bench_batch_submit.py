@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+'''Measure the submission time of many tasks through the qarnot SDK, against a
+local HTTP stub of the API.
+
+The stub answers every request after --latency seconds. Tasks are submitted one
+by one with Task.submit, as sample3_dockerhub.py used to, then by batches with
+batch_submit.submit_tasks:
+
+    python bench_batch_submit.py -n 10 100 1000 --latency 0.05'''
+
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import qarnot
+
+from batch_submit import submit_tasks
+
+
+def make_stub_server(latency):
+    '''Stub of the few endpoints used to create a connection and submit tasks.
+    The number of requests it served is counted in server.requests'''
+    tasks = {}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def reply(self, payload):
+            with lock:
+                server.requests += 1
+            time.sleep(latency)
+            body = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/settings':
+                # No storage: the connection does not need S3
+                self.reply({'storage': None})
+            else:
+                self.reply(tasks[self.path.rsplit('/', 1)[1]])
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+
+            def create(task):
+                task = dict(task, uuid=str(uuid.uuid4()), state='Submitted',
+                            creationDate=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()))
+                tasks[task['uuid']] = task
+                return task['uuid']
+
+            if isinstance(payload, list):
+                self.reply([{'statusCode': 200, 'uuid': create(task)} for task in payload])
+            else:
+                self.reply({'uuid': create(payload)})
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--count', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per stub request')
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=4, help='batches submitted at a time')
+    args = parser.parse_args()
+
+    server = make_stub_server(args.latency)
+    conn = qarnot.Connection(client_token='bench', cluster_url='http://127.0.0.1:%d' % server.server_address[1])
+    print(f'{"tasks":>6}  {"sequential":>12} {"requests":>8}  {"batch":>12} {"requests":>8}  {"speedup":>8}')
+    for count in args.count:
+        tasks = [conn.create_task(f'bench-{i}', 'docker-batch', 1) for i in range(count)]
+        server.requests = 0
+        start = time.perf_counter()
+        for task in tasks:
+            task.submit()
+        sequential = time.perf_counter() - start
+        sequential_requests = server.requests
+
+        tasks = [conn.create_task(f'bench-{i}', 'docker-batch', 1) for i in range(count)]
+        server.requests = 0
+        start = time.perf_counter()
+        results = submit_tasks(conn, tasks, args.batch_size, args.concurrency)
+        batch = time.perf_counter() - start
+        errors = sum(result.error is not None for result in results)
+        print(f'{count:>6}  {sequential:>10.2f} s {sequential_requests:>8}  {batch:>10.2f} s {server.requests:>8}  '
+              f'{sequential / batch:>7.1f}x' + (f'  ({errors} errors)' if errors else ''))
+    server.shutdown()
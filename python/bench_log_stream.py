@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+'''Compare polling the output of every task after each poll with log_stream, on a fake connection.
+
+Every fake API call sleeps for --latency seconds. The fake tasks run for
+--run-time seconds: --chatty of them print a line every 0.1 second, the other
+ones only print when they start and end, and --flood of them print 1 MB every
+0.1 second. The sink sleeps --sink-delay seconds per call, to mimic a slow
+terminal or disk:
+
+    python bench_log_stream.py -n 100 --latency 0.005 --run-time 30'''
+
+import argparse
+import threading
+import time
+import uuid
+
+from log_stream import LogStreamer
+from task_waiter import FINAL_STATES
+
+
+class FakeTask:
+    def __init__(self, conn, name, line, period):
+        self._conn = conn
+        self.name = name
+        self.uuid = str(uuid.uuid4())
+        self.tags = ['bench']
+        self.auto_update = True
+        self._line = line
+        self._period = period
+        self._started = time.monotonic()
+        self._read = {'stdout': 0, 'stderr': 0}
+
+    @property
+    def state(self):
+        return 'FullyExecuting' if time.monotonic() - self._started < self._conn.run_time else 'Success'
+
+    def _printed(self, stream):
+        '''The number of lines printed so far on stream, start and end lines included'''
+        elapsed = min(time.monotonic() - self._started, self._conn.run_time)
+        count = 1 + (int(elapsed / self._period) if self._period else 0)
+        return count + (self.state == 'Success') if stream == 'stdout' else 0
+
+    def _fresh(self, stream):
+        self._conn.request()
+        printed = self._printed(stream)
+        text = self._line * (printed - self._read[stream])
+        self._read[stream] = printed
+        return text
+
+    def fresh_stdout(self):
+        return self._fresh('stdout')
+
+    def fresh_stderr(self):
+        return self._fresh('stderr')
+
+
+class FakeConnection:
+    '''Mimics the part of qarnot.Connection used by log_stream'''
+    def __init__(self, latency, run_time):
+        self.latency = latency
+        self.run_time = run_time
+        self.requests = 0
+        self.tasks = []
+        self._lock = threading.Lock()
+
+    def request(self):
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency)
+
+    def all_tasks(self, summary=True, tags=None, tags_intersect=None):
+        self.request()
+        return [t for t in self.tasks if not tags_intersect or set(tags_intersect) <= set(t.tags)]
+
+
+def make_tasks(conn, count, chatty, flood):
+    for i in range(count):
+        if i < flood:
+            line, period = 'x' * (1024 * 1024 - 1) + '\n', 0.1
+        elif i < flood + chatty:
+            line, period = f'task {i} is working\n', 0.1
+        else:
+            line, period = f'task {i}\n', None
+        conn.tasks.append(FakeTask(conn, f'bench-{i}', line, period))
+    return conn.tasks
+
+
+class Sink:
+    def __init__(self, delay):
+        self.delay = delay
+        self.received = 0
+
+    def __call__(self, prefix, stream, text):
+        time.sleep(self.delay)
+        self.received += len(text)
+
+
+def on_poll(conn, tasks, sink, poll_delay):
+    '''The samples before log_stream: fetch the output of every task after each poll, in the main loop'''
+    blocked = 0.
+    while True:
+        start = time.monotonic()
+        states = [t.state for t in conn.all_tasks(summary=True)]
+        for task in tasks:
+            for stream in ('stdout', 'stderr'):
+                text = getattr(task, f'fresh_{stream}')()
+                if text:
+                    sink(task.name, stream, text)
+        blocked += time.monotonic() - start
+        if all(state in FINAL_STATES for state in states):
+            return blocked, 0, 0
+        time.sleep(poll_delay)
+
+
+def streamed(conn, tasks, sink, poll_delay):
+    '''The same output, fetched and delivered in the background by a LogStreamer'''
+    peak = 0
+    with LogStreamer(conn, sink, min_interval=poll_delay, max_interval=poll_delay * 8, tags=['bench']) as streamer:
+        for task in tasks:
+            streamer.add(task)
+        while not all(t.state in FINAL_STATES for t in tasks):
+            peak = max(peak, streamer._total)
+            time.sleep(0.01)
+    return 0., streamer.dropped, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--count', type=int, default=100)
+    parser.add_argument('--chatty', type=int, default=5)
+    parser.add_argument('--flood', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds per fake API call')
+    parser.add_argument('--run-time', type=float, default=10., help='seconds of execution per fake task')
+    parser.add_argument('--poll-delay', type=float, default=0.5)
+    parser.add_argument('--sink-delay', type=float, default=0.001, help='seconds per sink call')
+    args = parser.parse_args()
+
+    print(f'{"mode":<10} {"elapsed":>9} {"blocked":>9} {"requests":>9} {"delivered":>11} {"dropped":>11} '
+          f'{"peak held":>11}')
+    for name, mode in (('on_poll', on_poll), ('streamer', streamed)):
+        conn = FakeConnection(args.latency, args.run_time)
+        tasks = make_tasks(conn, args.count, args.chatty, args.flood)
+        sink = Sink(args.sink_delay)
+        start = time.perf_counter()
+        blocked, dropped, peak = mode(conn, tasks, sink, args.poll_delay)
+        print(f'{name:<10} {time.perf_counter() - start:8.2f}s {blocked:8.2f}s {conn.requests:>9} '
+              f'{sink.received:>11} {dropped:>11} {peak:>11}')
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+import hashlib
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from qarnot.bucket import AWS_UPLOAD_MAX_SIZE, AWS_UPLOAD_PART_SIZE
+
+# Where the manifests of the synchronized buckets are kept, one file per bucket
+DEFAULT_MANIFEST_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'qarnot-samples', 'manifests')
+
+# What happened to each remote file during a synchronization
+SyncReport = namedtuple('SyncReport', ['uploaded', 'copied', 'unchanged', 'deleted'])
+
+
+def file_digest(path):
+    '''Hash a file by chunks, the way the bucket storage computes its ETag:
+    plain md5 for small files, md5 of the md5 of every part for the files
+    that the SDK uploads in several parts'''
+    part_digests = []
+    with open(path, 'rb') as f:
+        for part in iter(lambda: f.read(AWS_UPLOAD_PART_SIZE), b''):
+            part_digests.append(hashlib.md5(part))
+    if os.path.getsize(path) < AWS_UPLOAD_MAX_SIZE:
+        return part_digests[0].hexdigest() if part_digests else hashlib.md5().hexdigest()
+    digest = hashlib.md5(b''.join(d.digest() for d in part_digests))
+    return '%s-%d' % (digest.hexdigest(), len(part_digests))
+
+
+class Manifest:
+    '''Local record of the files last sent to a bucket: for each remote name,
+    the local path, size, modification time and digest of the file.
+    It lets unchanged files be skipped without hashing them again.'''
+    def __init__(self, bucket_name, manifest_dir=DEFAULT_MANIFEST_DIR):
+        self.filename = os.path.join(manifest_dir, bucket_name + '.json')
+        self.entries = {}
+        if os.path.exists(self.filename):
+            with open(self.filename, 'r') as f:
+                self.entries = json.load(f)
+
+    def digest(self, remote, path):
+        '''Return the digest of the local file at path, from the manifest if
+        the file did not change since it was recorded as remote'''
+        stat = os.stat(path)
+        entry = self.entries.get(remote)
+        if entry is not None and entry['path'] == os.path.abspath(path) \
+                and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            return entry['hash']
+        return file_digest(path)
+
+    def record(self, remote, path, digest):
+        stat = os.stat(path)
+        self.entries[remote] = {'path': os.path.abspath(path),
+                                'size': stat.st_size,
+                                'mtime': stat.st_mtime,
+                                'hash': digest}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmp, self.filename)
+
+
+def upload_files(bucket, files, prune=False, prefix='', max_workers=8, manifest_dir=DEFAULT_MANIFEST_DIR):
+    '''Send to bucket only the files that are new or changed.
+
+    files maps remote names to local paths, like Bucket.sync_files. A file is
+    skipped when the bucket already holds the same content under the same name,
+    and copied server side when it holds it under another name. The other
+    files are uploaded in parallel, the large ones in several parts by the SDK.
+    With prune, the remote files starting with prefix and absent from files
+    are deleted.
+    Return a SyncReport listing the remote names in each category.'''
+    manifest = Manifest(bucket.uuid, manifest_dir)
+    # A single listing tells what the bucket really holds, in case it was
+    # emptied or deleted since the manifest was written
+    remote_digests = {obj.key: obj.e_tag.strip('"') for obj in bucket.list_files()}
+
+    with ThreadPoolExecutor(max_workers) as executor:
+        names = list(files)
+        digests = dict(zip(names, executor.map(lambda name: manifest.digest(name, files[name]), names)))
+
+        # Only the remote files that are not about to be overwritten can be copied from
+        by_digest = {digest: key for key, digest in remote_digests.items()
+                     if key not in files or digests[key] == digest}
+
+        uploads, copies, unchanged = {}, [], []
+        for name in names:
+            digest = digests[name]
+            if remote_digests.get(name) == digest:
+                unchanged.append(name)
+            elif digest in by_digest or digest in uploads:
+                copies.append(name)
+            else:
+                uploads[digest] = name
+
+        list(executor.map(lambda name: bucket.add_file(files[name], name), uploads.values()))
+        for name in uploads.values():
+            by_digest[digests[name]] = name
+        list(executor.map(lambda name: bucket.copy_file(by_digest[digests[name]], name), copies))
+
+    deleted = []
+    if prune:
+        deleted = [key for key in remote_digests if key.startswith(prefix) and key not in files]
+        for key in deleted:
+            bucket.delete_file(key)
+            manifest.entries.pop(key, None)
+
+    for name in names:
+        manifest.record(name, files[name], digests[name])
+    manifest.save()
+    return SyncReport(list(uploads.values()), copies, unchanged, deleted)
+
+
+def directory_files(directory, prefix=''):
+    '''Map the remote names of the files of directory, starting with prefix, to
+    their local paths, as upload_files takes them'''
+    files = {}
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            files[prefix + os.path.relpath(path, directory).replace(os.sep, '/')] = path
+    return files
+
+
+def upload_directory(bucket, directory, remote=None, prune=True, max_workers=8,
+                     manifest_dir=DEFAULT_MANIFEST_DIR):
+    '''Incremental replacement for Bucket.sync_directory: send the new or changed
+    files of directory to bucket, under the remote prefix if given, and with
+    prune delete the remote files that are not in directory anymore'''
+    prefix = '' if remote is None else remote.rstrip('/') + '/'
+    return upload_files(bucket, directory_files(directory, prefix), prune, prefix, max_workers, manifest_dir)
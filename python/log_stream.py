@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from qarnot.exceptions import MissingTaskException
+
+from task_waiter import FINAL_STATES, fetch_states
+
+# States in which a task has not started its command yet, so has no output
+WAITING_STATES = ('UnSubmitted', 'Submitted', 'PartiallyDispatched', 'FullyDispatched')
+STREAMS = ('stdout', 'stderr')
+
+
+class RingBuffer:
+    '''Bounded queue of text: once more than max_size characters are pending,
+    the oldest ones are dropped, and counted in dropped'''
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.dropped = 0
+        self._chunks = deque()
+
+    def push(self, text):
+        '''Append text, and return the number of characters dropped to make room'''
+        self._chunks.append(text)
+        self.size += len(text)
+        return self.drop(self.size - self.max_size)
+
+    def drop(self, count):
+        '''Drop up to count characters, the oldest first. Return the number dropped'''
+        dropped = 0
+        while dropped < count and self._chunks:
+            chunk = self._chunks.popleft()
+            if len(chunk) > count - dropped:
+                self._chunks.appendleft(chunk[count - dropped:])
+                chunk = chunk[:count - dropped]
+            dropped += len(chunk)
+        self.size -= dropped
+        self.dropped += dropped
+        return dropped
+
+    def pop(self):
+        '''Empty the buffer. Return the pending text, and the number of characters
+        dropped since the last pop'''
+        text, dropped = ''.join(self._chunks), self.dropped
+        self._chunks.clear()
+        self.size = self.dropped = 0
+        return text, dropped
+
+
+class PrefixWriter:
+    '''LogStreamer sink writing every line to sys.stdout or sys.stderr, prefixed
+    with the name of its task. Incomplete lines are held until completed, so
+    that the lines of concurrent tasks are never mixed'''
+    def __init__(self, stdout=None, stderr=None):
+        self.files = {'stdout': stdout or sys.stdout, 'stderr': stderr or sys.stderr}
+        self._partial = {}
+
+    def __call__(self, prefix, stream, text):
+        lines = (self._partial.pop((prefix, stream), '') + text).split('\n')
+        if lines[-1]:
+            self._partial[prefix, stream] = lines[-1]
+        if len(lines) > 1:
+            self.files[stream].write(''.join(f'[{prefix}] {line}\n' for line in lines[:-1]))
+            self.files[stream].flush()
+
+    def close(self):
+        for (prefix, stream), line in self._partial.items():
+            self.files[stream].write(f'[{prefix}] {line}\n')
+        self._partial.clear()
+
+
+class FileSink:
+    '''LogStreamer sink appending the output of every task to {directory}/{prefix}.stdout
+    and {directory}/{prefix}.stderr'''
+    def __init__(self, directory):
+        self.directory = directory
+        self._files = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, prefix, stream, text):
+        f = self._files.get((prefix, stream))
+        if f is None:
+            f = self._files[prefix, stream] = open(os.path.join(self.directory, f'{prefix}.{stream}'), 'a')
+        f.write(text)
+        f.flush()
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+
+class _Source:
+    '''Polling state and pending output of one task'''
+    def __init__(self, task, prefix, interval, buffer_size):
+        self.task = task
+        self.prefix = prefix
+        self.interval = interval
+        self.next_poll = 0.
+        self.state = None
+        self.done = False
+        self.buffers = {stream: RingBuffer(buffer_size) for stream in STREAMS}
+
+
+class LogStreamer:
+    '''Stream the stdout and stderr of many tasks from background threads, to be
+    used as a context manager.
+
+    A fetch thread polls the states of all the streamed tasks with a single
+    request per pass, listing the tasks of job or the tasks carrying all the
+    tags (see task_waiter.fetch_states), and only fetches the output of the tasks that are running
+    or just finished, max_workers at a time. The polling interval of a task is
+    reset to min_interval when it printed something, and grows by backoff up to
+    max_interval while it stays silent. A finished task is fetched one last time,
+    then dropped.
+
+    The output is handed over to sink(prefix, stream, text) by a delivery thread,
+    so that a slow sink never stalls the polling, nor the caller. Output waiting
+    for the sink is held in a ring buffer of buffer_size characters per stream,
+    and in max_total characters overall: when a task prints faster than the sink
+    consumes, its oldest output is dropped, and the sink is told how much with a
+    '[... N characters dropped ...]' line. The sink defaults to a PrefixWriter.
+
+    The last max_errors failed fetches are kept in errors, as (task, exception)
+    pairs, until the next successful fetch of their task. A failed listing of the
+    states is kept as (None, exception) until the next successful one, and the due
+    tasks are polled again after their interval, grown by backoff'''
+    def __init__(self, conn, sink=None, min_interval=2., max_interval=30., backoff=2., max_workers=8,
+                 buffer_size=1024 * 1024, max_total=16 * 1024 * 1024, job=None, tags=None, max_errors=100):
+        self._conn = conn
+        self.job = job
+        self.tags = tags
+        self.sink = sink or PrefixWriter()
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_workers = max_workers
+        self.buffer_size = buffer_size
+        self.max_total = max_total
+        self.errors = deque(maxlen=max_errors)  # (task, exception) of the failed fetches, retried at the next poll
+        self.dropped = 0
+        self._sources = {}  # polled sources, by id of their task
+        self._outputs = []  # sources with output still to be delivered
+        self._dirty = set()
+        self._total = 0
+        self._lock = threading.Lock()
+        self._pending = threading.Condition(self._lock)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._closed = False
+        self._fetcher = threading.Thread(target=self._run_fetch, daemon=True)
+        self._deliverer = threading.Thread(target=self._run_delivery, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self._fetcher.start()
+        self._deliverer.start()
+
+    def stop(self):
+        '''Fetch the output of the tasks one last time, deliver it and stop the threads'''
+        self._stop.set()
+        self._wake.set()
+        self._fetcher.join()
+        with self._pending:
+            self._closed = True
+            self._pending.notify()
+        self._deliverer.join()
+        if hasattr(self.sink, 'close'):
+            self.sink.close()
+
+    def add(self, task, prefix=None):
+        '''Stream the output of task, prefixed with its name unless prefix is given.
+        The task may be added before or after it is submitted'''
+        source = _Source(task, prefix or task.name, self.min_interval, self.buffer_size)
+        with self._lock:
+            self._sources[id(task)] = source
+            self._outputs.append(source)
+        self._wake.set()
+
+    def _fetch_states(self):
+        '''Current state of the streamed tasks, by uuid'''
+        with self._lock:
+            # Tasks not submitted yet have no uuid, nor state to fetch
+            uuids = {source.task.uuid for source in self._sources.values() if source.task.uuid is not None}
+        return fetch_states(self._conn, uuids, self.job, self.tags)
+
+    def _fetch(self, source):
+        '''Fetch the fresh output of source into its buffers. Return the number of characters fetched'''
+        fetched = 0
+        failed = False
+        for stream in STREAMS:
+            try:
+                text = getattr(source.task, f'fresh_{stream}')()
+            except MissingTaskException:
+                # Deleted in the meantime: nothing more to fetch
+                source.done = True
+                return fetched
+            except Exception as error:
+                failed = True
+                with self._lock:
+                    self.errors.append((source.task, error))
+                continue
+            if text:
+                fetched += len(text)
+                self._push(source, stream, text)
+        if not failed:
+            # Retried successfully: the earlier errors of the task are over
+            self._clear_errors(source.task)
+        return fetched
+
+    def _clear_errors(self, task):
+        '''Forget the errors of task, or of the state listing if None'''
+        with self._lock:
+            if any(t is task for t, _ in self.errors):
+                kept = [(t, error) for t, error in self.errors if t is not task]
+                self.errors.clear()
+                self.errors.extend(kept)
+
+    def _push(self, source, stream, text):
+        with self._pending:
+            buffer = source.buffers[stream]
+            dropped = buffer.push(text)
+            self._total += len(text) - dropped
+            # Over the overall budget: drop the oldest output of the largest buffers
+            while self._total > self.max_total:
+                largest = max((b for s in self._outputs for b in s.buffers.values()), key=lambda b: b.size)
+                dropped += largest.drop(self._total - self.max_total)
+                self._total = sum(b.size for s in self._outputs for b in s.buffers.values())
+            self.dropped += dropped
+            self._dirty.add(source)
+            self._pending.notify()
+
+    def _poll(self, executor, everything):
+        '''Fetch the output of the sources due for it, or of all of them if everything'''
+        now = time.monotonic()
+        with self._lock:
+            # Fetch along the sources due within min_interval / 2, so that passes,
+            # and their request for the states, are not spread over time
+            due = [s for s in self._sources.values() if everything or s.next_poll <= now + self.min_interval / 2]
+        if not due:
+            return
+        try:
+            states = self._fetch_states()
+        except Exception as error:
+            with self._lock:
+                self.errors.append((None, error))
+            for source in due:
+                source.interval = min(source.interval * self.backoff, self.max_interval)
+                source.next_poll = now + source.interval
+            return
+        self._clear_errors(None)
+        running = []
+        for source in due:
+            source.state = states.get(source.task.uuid, source.state)
+            if source.state is None or source.state in WAITING_STATES:
+                source.next_poll = now + self.min_interval
+            else:
+                running.append(source)
+        futures = [executor.submit(self._fetch, source) for source in running]
+        for source, future in zip(running, futures):
+            try:
+                fetched = future.result()
+            except Exception as error:
+                # Not caught by _fetch: the task is polled again, even if finished
+                with self._lock:
+                    self.errors.append((source.task, error))
+                fetched = 0
+            else:
+                # The state was read before the output: a finished task has nothing left to print
+                if source.state in FINAL_STATES:
+                    source.done = True
+            source.interval = self.min_interval if fetched else min(source.interval * self.backoff,
+                                                                    self.max_interval)
+            source.next_poll = now + source.interval
+        with self._pending:
+            for source in running:
+                if source.done:
+                    del self._sources[id(source.task)]
+                    self._dirty.add(source)
+            self._pending.notify()
+
+    def _run_fetch(self):
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            while not self._stop.is_set():
+                self._wake.clear()
+                self._poll(executor, False)
+                with self._lock:
+                    next_poll = min((s.next_poll for s in self._sources.values()),
+                                    default=time.monotonic() + self.max_interval)
+                self._wake.wait(max(0., next_poll - time.monotonic()))
+            self._poll(executor, True)
+
+    def _run_delivery(self):
+        while True:
+            with self._pending:
+                self._pending.wait_for(lambda: self._dirty or self._closed)
+                if not self._dirty:
+                    return
+                batch = []
+                for source in self._dirty:
+                    for stream, buffer in source.buffers.items():
+                        text, dropped = buffer.pop()
+                        if text or dropped:
+                            batch.append((source.prefix, stream, text, dropped))
+                    if source.done and source in self._outputs:
+                        self._outputs.remove(source)
+                self._dirty.clear()
+                self._total = sum(b.size for s in self._outputs for b in s.buffers.values())
+            # Deliver without holding the lock, so that fetching goes on meanwhile
+            for prefix, stream, text, dropped in batch:
+                if dropped:
+                    self.sink(prefix, stream, f'[... {dropped} characters dropped ...]\n')
+                if text:
+                    self.sink(prefix, stream, text)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+from collections import namedtuple
+
+from qarnot.scaling import Scaling, ManagedTasksQueueScalingPolicy, TimePeriodAlways
+
+# Where the time of a finished task went, in seconds: waiting for a slot (queued),
+# fetching resources and starting its environment (startup), running the command
+# (execution) and uploading its results (upload)
+TaskTiming = namedtuple('TaskTiming', ['name', 'queued', 'startup', 'execution', 'upload', 'wall'])
+
+
+def elastic_scaling(min_slots=0, max_slots=32, min_idle_slots=1, min_idle_time=120, scaling_factor=0.5):
+    '''Scaling policy on the number of tasks queued on the pool, always enabled:
+    keep min_idle_slots slots ready for the next tasks, grow up to max_slots,
+    and release the slots idle for more than min_idle_time seconds'''
+    return Scaling([ManagedTasksQueueScalingPolicy(name='elastic',
+                                                   enabled_periods=[TimePeriodAlways('always')],
+                                                   min_total_slots=min_slots,
+                                                   max_total_slots=max_slots,
+                                                   min_idle_slots=min_idle_slots,
+                                                   min_idle_time_seconds=min_idle_time,
+                                                   scaling_factor=scaling_factor)])
+
+
+def task_timing(task):
+    '''TaskTiming of a finished task, from its status'''
+    status = task.status
+    startup = (status.download_time_sec or 0.) + (status.environment_time_sec or 0.)
+    execution = status.execution_time_sec or 0.
+    upload = status.upload_time_sec or 0.
+    wall = status.wall_time_sec or 0.
+    queued = 0.
+    if task.end_date is not None and task.creation_date is not None:
+        queued = max(0., (task.end_date - task.creation_date).total_seconds() - wall)
+    return TaskTiming(task.name, queued, startup, execution, upload, wall)
+
+
+def print_timings(timings):
+    print(f'{"task":<24} {"queued":>8} {"startup":>8} {"exec":>8} {"upload":>8}')
+    for t in timings:
+        print(f'{t.name:<24} {t.queued:7.0f}s {t.startup:7.0f}s {t.execution:7.0f}s {t.upload:7.0f}s')
+    count = max(len(timings), 1)
+    print(f'{"mean":<24} {sum(t.queued for t in timings) / count:7.0f}s '
+          f'{sum(t.startup for t in timings) / count:7.0f}s '
+          f'{sum(t.execution for t in timings) / count:7.0f}s '
+          f'{sum(t.upload for t in timings) / count:7.0f}s')
+
+
+class PoolRunner:
+    '''Long-lived pool for many short tasks, to be used as a context manager.
+
+    The pool is started once with its profile, constants (e.g. DOCKER_REPO and
+    DOCKER_TAG) and scaling policy. The tasks created by create_task then run on
+    slots that are already up, with the image already pulled, instead of each
+    paying for scheduling and startup. All the tasks belong to one job on the
+    pool, which can use dependencies. The pool is closed on exit'''
+    def __init__(self, conn, name, profile='docker-batch', constants=None, scaling=None,
+                 instances=1, use_dependencies=False):
+        self.conn = conn
+        self.pool = conn.create_pool(name, profile, instances)
+        for key, value in (constants or {}).items():
+            self.pool.constants[key] = value
+        self.pool.scaling = scaling or elastic_scaling()
+        self.use_dependencies = use_dependencies
+        self.job = None
+        self.tasks = []
+
+    def __enter__(self):
+        return self.start()
+
+    def start(self):
+        '''Submit the pool and its job, when not used as a context manager'''
+        self.pool.submit()
+        self.job = self.conn.create_job(f'{self.pool.name}-job', self.pool, useDependencies=self.use_dependencies)
+        self.job.submit()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def create_task(self, name, command=None, instances=1):
+        '''Create a task of the job on the pool, running command if given. The task
+        still has to be configured further if needed, and submitted'''
+        task = self.conn.create_task(name, None, instances, job=self.job)
+        if command is not None:
+            task.constants['DOCKER_CMD'] = command
+        self.tasks.append(task)
+        return task
+
+    def timings(self):
+        '''TaskTiming of every finished task created on the pool'''
+        return [task_timing(task) for task in self.tasks if task.state in ('Success', 'Failure', 'Cancelled')]
+
+    def close(self):
+        if self.job is not None:
+            self.job.terminate()
+        self.pool.close()
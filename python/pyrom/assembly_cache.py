@@ -0,0 +1,75 @@
+import hashlib
+import os
+
+import dolfin as df
+import h5py
+
+import model
+
+
+# Geometric constants of model the subdomains depend on, hence the cache key
+GEOMETRY_CONSTANTS = ('die_l', 'die_h', 'die_w', 'casing_l', 'casing_h', 'casing_w',
+                      'paste_h', 'block_l', 'block_h', 'block_w')
+
+
+def cache_key(filename, degree):
+    '''Hash of everything the assembled matrices depend on: the mesh file content,
+    the element degree, the geometric constants and the subdomains'''
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    geometry = tuple(getattr(model, name) for name in GEOMETRY_CONSTANTS)
+    h.update(repr((degree, geometry, sorted(model.domain_dict.items()), model.subdomain_boxes,
+                   model.air_box)).encode())
+    return h.hexdigest()
+
+
+def save(path, matrices):
+    '''Write the assembled matrices (CSR) and vectors to path'''
+    tmp = path + '.tmp'
+    with h5py.File(tmp, 'w') as f:
+        for name, M in matrices.items():
+            if isinstance(M, df.GenericMatrix):
+                indptr, indices, data = df.as_backend_type(M).mat().getValuesCSR()
+                group = f.create_group(f'matrices/{name}')
+                group.attrs['shape'] = (M.size(0), M.size(1))
+                group['indptr'] = indptr
+                group['indices'] = indices
+                group['data'] = data
+            else:
+                f[f'vectors/{name}'] = M.get_local()
+    os.replace(tmp, path)
+
+
+def load(path, V):
+    '''Read back the matrices and vectors written by save, as Fenics objects of space V'''
+    from petsc4py import PETSc
+    matrices = {}
+    with h5py.File(path, 'r') as f:
+        for name, group in f['matrices'].items():
+            mat = PETSc.Mat().createAIJ(size=tuple(group.attrs['shape']),
+                                        csr=(group['indptr'][:], group['indices'][:], group['data'][:]),
+                                        comm=PETSc.COMM_SELF)
+            mat.assemble()
+            matrices[name] = df.PETScMatrix(mat)
+        for name, values in f['vectors'].items():
+            vec = df.Function(V).vector()
+            vec.set_local(values[:])
+            vec.apply('insert')
+            matrices[name] = vec
+    return matrices
+
+
+def load_or_assemble(filename, mesh, V, cache_dir, degree=1):
+    '''Return the assembled matrices of the model for the mesh read from filename.
+    They are reloaded from cache_dir when available, which skips the subdomain
+    marking and the compilation of the forms, or assembled and stored there'''
+    path = os.path.join(cache_dir, cache_key(filename, degree) + '.h5')
+    if os.path.exists(path):
+        return load(path, V)
+    dx, ds = model.make_measures(mesh, filename)
+    matrices = model.assemble_matrices(V, dx, ds)
+    os.makedirs(cache_dir, exist_ok=True)
+    save(path, matrices)
+    return matrices
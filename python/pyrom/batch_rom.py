@@ -0,0 +1,130 @@
+import numpy as np
+
+
+# Names available to the coefficient expressions, as in pymor's ExpressionParameterFunctional
+EXPRESSION_NAMESPACE = {'__builtins__': {}, 'np': np, 'pi': np.pi,
+                        **{name: getattr(np, name) for name in ('sin', 'cos', 'tan', 'exp', 'log', 'sqrt',
+                                                                'abs', 'min', 'max', 'sum', 'array')}}
+# Time steppers of pymor and of timestepping whose scheme BatchROM reproduces, by class name
+IMPLICIT_EULER_STEPPERS = ('ImplicitEulerTimeStepper', 'FactorizedImplicitEulerTimeStepper')
+
+def affine_terms(operator):
+    '''Dense matrices, or vectors for operators from a 1-dimensional space, of the
+    terms of a LincombOperator (or of a single operator), and their coefficients'''
+    from pymor.algorithms.to_matrix import to_matrix
+    from pymor.operators.constructions import LincombOperator
+    if isinstance(operator, LincombOperator):
+        operators, coefficients = operator.operators, operator.coefficients
+    else:
+        operators, coefficients = [operator], [1.]
+    terms = []
+    for op in operators:
+        matrix = to_matrix(op, format='dense')
+        terms.append(matrix[:, 0] if op.source.dim == 1 and op.range.dim != 1 else matrix)
+    return np.array(terms), coefficients
+
+
+def coefficient_expression(coefficient):
+    '''Python expression of a pymor coefficient in terms of the parameters, e.g.
+    'lamb_die[0]', which evaluate() can compute without pymor'''
+    if hasattr(coefficient, 'expression'):
+        return coefficient.expression
+    if hasattr(coefficient, 'parameter'):
+        return f'{coefficient.parameter}[{coefficient.index or 0}]'
+    if isinstance(coefficient, (int, float, np.number)):
+        return repr(float(coefficient))
+    raise NotImplementedError(f'coefficient {coefficient}')
+
+
+def stepper_name(time_stepper):
+    '''Name of the scheme of a pymor TimeStepper: 'implicit_euler' for
+    IMPLICIT_EULER_STEPPERS, else its class name'''
+    name = type(time_stepper).__name__
+    return 'implicit_euler' if name in IMPLICIT_EULER_STEPPERS else name
+
+
+def evaluate(coefficients, mus):
+    '''Array of shape (len(mus), len(coefficients)) of the coefficients values.
+    Coefficients are pymor ParameterFunctional, numbers or expression strings,
+    and mus pymor Mu or dicts of parameter values'''
+    values = np.empty((len(mus), len(coefficients)))
+    for p, mu in enumerate(mus):
+        for q, c in enumerate(coefficients):
+            if isinstance(c, str):
+                values[p, q] = eval(c, EXPRESSION_NAMESPACE,
+                                    {key: np.atleast_1d(value) for key, value in mu.items()})
+            else:
+                values[p, q] = c.evaluate(mu) if hasattr(c, 'evaluate') else c
+    return values
+
+
+class BatchROM:
+    '''Implicit Euler solver of a reduced model for many parameters at once.
+
+    The reduced mass, operator and right hand side built by make_pymor_bindings
+    are affine in the parameters: their reduced matrices are extracted once,
+    and for a batch of parameters the systems (M(mu) + dt*A(mu)) are assembled
+    and solved as stacked numpy arrays, so that the time loop costs a few batched
+    matrix products per step instead of one pymor solve per parameter.
+    Only time independent operators are supported, as in the FOM.
+
+    mass, operator are arrays of the stacked terms matrices, rhs of the stacked
+    terms vectors, each with its list of coefficients (see evaluate). Use
+    from_rom to build it from a pymor model, or rom_artifact.load. time_stepper
+    is the name of the scheme of the model (see stepper_name): only implicit
+    Euler is implemented, the others raise NotImplementedError.'''
+    def __init__(self, mass, mass_coefficients, operator, operator_coefficients, rhs, rhs_coefficients,
+                 initial_data, T, nt, num_values=None, time_stepper='implicit_euler'):
+        if time_stepper != 'implicit_euler':
+            raise NotImplementedError(f'batched {time_stepper} time stepping')
+        self.mass, self.mass_coefficients = mass, mass_coefficients
+        self.operator, self.operator_coefficients = operator, operator_coefficients
+        self.rhs, self.rhs_coefficients = rhs, rhs_coefficients
+        self.initial_data = initial_data
+        self.T = T
+        self.nt = nt
+        self.num_values = num_values
+        self.time_stepper = time_stepper
+
+    @classmethod
+    def from_rom(cls, rom):
+        if rom.initial_data.parametric:
+            raise NotImplementedError('parametric initial data')
+        return cls(*affine_terms(rom.mass), *affine_terms(rom.operator), *affine_terms(rom.rhs),
+                   rom.initial_data.as_range_array().to_numpy()[0], rom.T, rom.time_stepper.nt, rom.num_values,
+                   stepper_name(rom.time_stepper))
+
+    @property
+    def dim(self):
+        return len(self.initial_data)
+
+    def assemble(self, mus):
+        '''Return the stacked mass matrices, system matrices and right hand sides for mus'''
+        dt = self.T / self.nt
+        M = np.einsum('pq,qij->pij', evaluate(self.mass_coefficients, mus), self.mass)
+        A = np.einsum('pq,qij->pij', evaluate(self.operator_coefficients, mus), self.operator)
+        F = evaluate(self.rhs_coefficients, mus) @ self.rhs
+        return M, M + dt * A, F
+
+    def solve(self, mus, batch_size=1024):
+        '''Reduced solutions for every parameter of mus, as an array of shape
+        (len(mus), number of time values, dim), with the output times of pymor's implicit_euler'''
+        num_values = self.num_values or self.nt + 1
+        dt = self.T / self.nt
+        DT = self.T / (num_values - 1)
+        result = []
+        for start in range(0, len(mus), batch_size):
+            M, system, F = self.assemble(mus[start:start + batch_size])
+            # u_{n+1} = step @ u_n + offset, both factorized out of the time loop
+            step = np.linalg.solve(system, M)
+            offset = np.linalg.solve(system, dt * F[..., None])[..., 0]
+            U = np.broadcast_to(self.initial_data, offset.shape).copy()
+            R = [U]
+            t = 0.
+            for n in range(self.nt):
+                t += dt
+                U = np.einsum('pij,pj->pi', step, U) + offset
+                while t + (min(dt, DT) * 0.5) >= len(R) * DT:
+                    R.append(U)
+            result.append(np.stack(R, axis=1))
+        return np.concatenate(result)
@@ -0,0 +1,50 @@
+import argparse
+import time
+
+import numpy as np
+
+from model import make_fom, make_param_space
+from batch_rom import BatchROM
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the batched reduced solver to a pymor solve per parameter')
+    parser.add_argument('mesh', help='mesh filename')
+    parser.add_argument('-t', type=int, default=10, help='number of training parameters')
+    parser.add_argument('-m', type=int, default=25, help='reduced basis size')
+    parser.add_argument('-n', type=int, default=2000, help='number of parameters to solve the ROM for')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    import pymor.basic as pmb
+    from pymor.algorithms.timestepping import implicit_euler
+    fom = make_fom(args.mesh)
+    param_space = make_param_space()
+    U = fom.solution_space.empty()
+    for mu in param_space.sample_randomly(args.t, seed=args.seed):
+        U.append(fom.solve(mu))
+    basis, _ = pmb.pod(U, product=fom.h1_0_semi_product, modes=args.m)
+    rom = pmb.InstationaryRBReductor(fom, RB=basis, product=fom.h1_0_semi_product).reduce()
+
+    def solve(mu):
+        # rom.solve can't take the parametric reduced mass: assemble it for mu first,
+        # as InstationaryParametricMassModel does
+        return implicit_euler(rom.operator, rom.rhs, rom.mass.assemble(mu), rom.initial_data.as_range_array(mu),
+                              0, rom.T, rom.time_stepper.nt, mu, rom.num_values).to_numpy()
+
+    mus = param_space.sample_randomly(args.n, seed=args.seed + 1)
+    start = time.perf_counter()
+    reference = np.array([solve(mu) for mu in mus])
+    loop_time = time.perf_counter() - start
+    start = time.perf_counter()
+    batch = BatchROM.from_rom(rom)
+    setup_time = time.perf_counter() - start
+    start = time.perf_counter()
+    solutions = batch.solve(mus)
+    batch_time = time.perf_counter() - start
+
+    error = np.abs(solutions - reference).max() / np.abs(reference).max()
+    print(f'pymor loop:     {loop_time:.2f}s ({loop_time / args.n * 1e3:.2f}ms per parameter)')
+    print(f'BatchROM:       {batch_time:.2f}s ({batch_time / args.n * 1e3:.3f}ms per parameter), '
+          f'setup {setup_time:.2f}s, {loop_time / batch_time:.0f}x faster')
+    print(f'max relative difference {error:.1e}')
@@ -0,0 +1,39 @@
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def startup(mesh, cache_dir):
+    '''Time make_fom in the current process'''
+    start = time.perf_counter()
+    from model import make_fom
+    make_fom(mesh, cache_dir=cache_dir)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare FOM startup time with and without the assembly cache. '
+                                                 'Each measure runs in a fresh process')
+    parser.add_argument('mesh', help='mesh filename')
+    parser.add_argument('--cache-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(startup(args.mesh, args.cache_dir))
+        sys.exit(0)
+
+    def measure(*extra):
+        out = subprocess.run([sys.executable, __file__, args.mesh, '--child', *extra],
+                             check=True, capture_output=True, text=True).stdout
+        return float(out.split()[-1])
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        no_cache = measure()
+        cold = measure('--cache-dir', cache_dir)
+        warm = measure('--cache-dir', cache_dir)
+    print(f'no cache:   {no_cache:.2f}s')
+    print(f'cold cache: {cold:.2f}s (assembly and write)')
+    print(f'warm cache: {warm:.2f}s ({no_cache / warm:.1f}x faster)')
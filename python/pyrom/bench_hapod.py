@@ -0,0 +1,64 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from model import make_fom, make_param_space, dump_sol_list
+from hapod import compress, merge_files
+from snapshot_store import SnapshotWriter
+
+
+def projection_error(U, basis, product):
+    '''Relative error of the orthogonal projection of U on basis, w.r.t. product'''
+    error = U - basis.lincomb(U.inner(basis, product))
+    return np.sqrt(error.norm2(product).sum() / U.norm2(product).sum())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the hierarchical POD of hapod.py to the plain POD '
+                                                 'of all the snapshots, on a small mesh')
+    parser.add_argument('mesh', help='mesh filename')
+    parser.add_argument('-n', type=int, default=12, help='number of parameters')
+    parser.add_argument('-p', '--parts', type=int, default=3, help='number of simulated train instances')
+    parser.add_argument('-m', type=int, default=25, help='number of modes')
+    parser.add_argument('--l2-err', type=float, default=0.)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    import pymor.basic as pmb
+    fom = make_fom(args.mesh)
+    product = fom.h1_0_semi_product
+    mus = make_param_space().sample_randomly(args.n, seed=args.seed)
+    solutions = [fom.solve(mu) for mu in mus]
+    U = fom.solution_space.empty()
+    for S in solutions:
+        U.append(S)
+
+    start = time.perf_counter()
+    pod_basis, pod_svals = pmb.pod(U, product=product, modes=args.m)
+    pod_time = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        local_files = []
+        for part, indices in enumerate(np.array_split(np.arange(args.n), args.parts)):
+            snapshots = os.path.join(tmp, f'u{part}.h5')
+            with SnapshotWriter(snapshots, fom.solution_space.dim) as writer:
+                for i in indices:
+                    writer.append(solutions[i], mus[i])
+            local_files.append(os.path.join(tmp, f'b{part}.h5'))
+            start = time.perf_counter()
+            dump_sol_list(local_files[-1], compress(snapshots, fom.solution_space, product, args.l2_err))
+        local_time = time.perf_counter() - start
+        start = time.perf_counter()
+        hapod_basis, hapod_svals = merge_files(local_files, fom.solution_space, product, args.m, args.l2_err)
+        merge_time = time.perf_counter() - start
+
+    m = min(len(pod_svals), len(hapod_svals))
+    print(f'POD:   {len(pod_basis)} modes in {pod_time:.1f}s, '
+          f'projection error {projection_error(U, pod_basis, product):.3e}')
+    print(f'HAPOD: {len(hapod_basis)} modes, last local step {local_time:.1f}s, merge {merge_time:.1f}s, '
+          f'projection error {projection_error(U, hapod_basis, product):.3e}')
+    print(f'max relative difference of the singular values: '
+          f'{np.abs(hapod_svals[:m] - pod_svals[:m]).max() / pod_svals[0]:.1e}')
@@ -0,0 +1,62 @@
+import argparse
+import tempfile
+import time
+from functools import partial
+
+import numpy as np
+
+from model import make_fom, make_param_space
+from timestepping import (FactorizedImplicitEulerTimeStepper, CrankNicolsonTimeStepper, BDF2TimeStepper,
+                          AdaptiveTimeStepper)
+
+
+# Time steppers compared, called with (nt, solver_options). The model asks for nt = 120 (dt = 5s),
+# and every one of them outputs the solution on these 121 times
+INTEGRATORS = {'implicit euler (current)': FactorizedImplicitEulerTimeStepper,
+               'implicit euler dt/4': lambda nt, **kw: FactorizedImplicitEulerTimeStepper(4 * nt, **kw),
+               'crank-nicolson': CrankNicolsonTimeStepper,
+               'crank-nicolson 2dt': lambda nt, **kw: CrankNicolsonTimeStepper(nt, steps=nt // 2, **kw),
+               'bdf2': BDF2TimeStepper,
+               'bdf2 2dt': lambda nt, **kw: BDF2TimeStepper(nt, steps=nt // 2, **kw),
+               'bdf2 4dt': lambda nt, **kw: BDF2TimeStepper(nt, steps=nt // 4, **kw),
+               'adaptive rtol 1e-3': partial(AdaptiveTimeStepper, rtol=1e-3),
+               'adaptive rtol 1e-4': partial(AdaptiveTimeStepper, rtol=1e-4),
+               'adaptive rtol 1e-5': partial(AdaptiveTimeStepper, rtol=1e-5)}
+
+
+def run(mesh, time_stepper, mus, solver_options, cache_dir):
+    '''Solve the FOM for every parameter of mus. Returns the solutions (on the output
+    times of the model), the time per solve and the stats of the time stepper'''
+    fom = make_fom(mesh, solver_options, cache_dir=cache_dir,
+                   time_stepper=lambda nt: time_stepper(nt, solver_options=solver_options))
+    solutions = []
+    start = time.perf_counter()
+    for mu in mus:
+        solutions.append(fom.solve(mu).to_numpy())
+    return solutions, (time.perf_counter() - start) / len(mus), fom.time_stepper.stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Accuracy against wall time of the time integrators, on the '
+                                                 'same parameters, against a BDF2 solution with tiny steps')
+    parser.add_argument('mesh', help='mesh filename')
+    parser.add_argument('-n', type=int, default=3, help='number of parameters')
+    parser.add_argument('--refine', type=int, default=32, help='steps of the reference per step of the model')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # Direct solves, the error of the Krylov solvers would hide the one of the integrators
+    solver_options = {'solver': 'lu'}
+    mus = make_param_space().sample_randomly(args.n, seed=args.seed)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        reference, elapsed, _ = run(args.mesh, lambda nt, **kw: BDF2TimeStepper(nt, steps=args.refine * nt, **kw),
+                                    mus, solver_options, cache_dir)
+        print(f'reference: {elapsed:.2f}s per solve')
+        print(f'{"integrator":<26} {"per solve":>10} {"steps":>7} {"rejected":>8} {"systems":>7} {"max rel. error":>14}')
+        for name, time_stepper in INTEGRATORS.items():
+            solutions, elapsed, stats = run(args.mesh, time_stepper, mus, solver_options, cache_dir)
+            # Error on the output times, relative to the largest value of the trajectory
+            error = max(np.abs(U - R).max() / np.abs(R).max() for U, R in zip(solutions, reference))
+            steps = stats.get('steps', stats['solves']) / args.n
+            print(f'{name:<26} {elapsed:9.3f}s {steps:7.0f} {stats.get("rejected", 0) / args.n:8.1f} '
+                  f'{stats.get("systems", args.n) / args.n:7.0f} {error:14.1e}')
@@ -0,0 +1,56 @@
+import argparse
+import os
+import time
+
+import dolfin as df
+import numpy as np
+
+import model
+from subdomains import TOL
+
+
+def compiled_markers(mesh):
+    '''The markers as computed before subdomains: JIT compiled box tests, each one
+    marking the cells in a pass of its own'''
+    box = 'x[0] <= x1 + tol && x[0] >= x0 - tol && x[1] <= y1 + tol && x[1] >= y0 - tol ' \
+          '&& x[2] <= z1 + tol && x[2] >= z0 - tol'
+    markers = df.MeshFunction('size_t', mesh, 3)
+    markers.set_all(model.domain_dict['block'])
+    for name, (x0, x1, y0, y1, z0, z1) in model.subdomain_boxes:
+        subdomain = df.CompiledSubDomain(box, tol=TOL, x0=x0, x1=x1, y0=y0, y1=y1, z0=z0, z1=z1)
+        subdomain.mark(markers, model.domain_dict[name])
+    boundary_markers = df.MeshFunction('size_t', mesh, 2)
+    boundary_markers.set_all(0)
+    df.CompiledSubDomain('on_boundary && x[2] > 0 - tol', tol=TOL).mark(boundary_markers, 1)
+    return markers, boundary_markers
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return time.perf_counter() - start, result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the subdomain marking of the mesh with compiled '
+                                                 'subdomains, with numpy, and reloaded from the saved markers')
+    parser.add_argument('mesh', help='mesh filename')
+    args = parser.parse_args()
+
+    mesh = model.load_mesh(args.mesh)
+    path = args.mesh + '.markers.h5'
+    if os.path.exists(path):
+        os.remove(path)
+    compiled, (markers, boundary_markers) = timed(compiled_markers, mesh)
+    numpy, (dx, ds) = timed(model.make_measures, mesh, args.mesh)
+    reloaded, (dx_reloaded, ds_reloaded) = timed(model.make_measures, mesh, args.mesh)
+
+    print(f'{mesh.num_cells()} cells')
+    print(f'compiled subdomains: {compiled:6.2f}s')
+    print(f'numpy:               {numpy:6.2f}s ({compiled / numpy:.1f}x faster)')
+    print(f'saved markers:       {reloaded:6.2f}s ({compiled / reloaded:.1f}x faster)')
+    for name, reference, measure in (('cells', markers, dx), ('facets', boundary_markers, ds),
+                                     ('reloaded cells', markers, dx_reloaded),
+                                     ('reloaded facets', boundary_markers, ds_reloaded)):
+        differ = np.count_nonzero(reference.array() != measure.subdomain_data().array())
+        print(f'{name}: {differ} markers differ')
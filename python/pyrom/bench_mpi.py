@@ -0,0 +1,59 @@
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from snapshot_store import SnapshotStore
+
+
+def run(mpirun, processes, mesh, n, solver, seed, output):
+    '''Run train_mpi.py with processes MPI processes, and return its timings'''
+    timings = output + '.json'
+    command = shlex.split(mpirun) + ['-n', str(processes), sys.executable,
+                                     os.path.join(os.path.dirname(os.path.abspath(__file__)), 'train_mpi.py'),
+                                     mesh, '-n', str(n), '-s', solver, '--seed', str(seed), '-o', output,
+                                     '--timings', timings]
+    # One thread per process, the cores are used by the MPI processes
+    env = dict(os.environ, OMP_NUM_THREADS='1')
+    if subprocess.run(command, env=env, stdout=subprocess.DEVNULL).returncode:
+        return None
+    with open(timings) as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Strong scaling of the FOM solves with MPI: the same '
+                                                 'parameters are solved with every number of processes')
+    parser.add_argument('mesh', help='mesh filename')
+    parser.add_argument('-n', type=int, default=4, help='number of parameters')
+    parser.add_argument('-p', '--processes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('-s', '--solver', default='cg/hypre_amg', help='see bench_solvers.SOLVERS')
+    parser.add_argument('--mpirun', default='mpirun', help='MPI launcher, e.g. "mpirun --allow-run-as-root"')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f'{"processes":>9} {"dofs/proc":>9} {"build":>8} {"per solve":>10} {"write":>8} '
+          f'{"speedup":>8} {"efficiency":>10} {"rel. diff":>9}')
+    reference = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for processes in args.processes:
+            output = os.path.join(tmp, f'u{processes}.h5')
+            result = run(args.mpirun, processes, args.mesh, args.n, args.solver, args.seed, output)
+            if result is None:
+                print(f'{processes:>9} failed')
+                continue
+            # Snapshots are laid out the same whatever the partition (see model.dof_columns)
+            with SnapshotStore(output) as store:
+                U = store.read()
+            if reference is None:
+                reference = (result, U)
+            speedup = reference[0]['processes'] * reference[0]['solve'] / result['solve']
+            diff = np.abs(U - reference[1]).max() / np.abs(reference[1]).max()
+            print(f'{processes:>9} {result["dofs"] // processes:>9} {result["build"]:7.1f}s '
+                  f'{result["solve"] / args.n:9.3f}s {result["write"]:7.2f}s {speedup:8.2f} '
+                  f'{speedup / processes:10.0%} {diff:9.1e}')
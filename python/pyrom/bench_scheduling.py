@@ -0,0 +1,75 @@
+import argparse
+import heapq
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from work_queue import FileLeaseStore, WorkQueue
+
+
+def static_makespan(durations, instances):
+    '''Makespan when every instance solves a fixed contiguous share of the parameters'''
+    return max(share.sum() for share in np.array_split(durations, instances))
+
+
+def dynamic_makespan(durations, instances, chunk_size, overhead=0.):
+    '''Makespan when the instances pull chunks from a queue, each claim costing overhead'''
+    chunks = [durations[i:i + chunk_size].sum() + overhead for i in range(0, len(durations), chunk_size)]
+    ends = [0.] * instances
+    for chunk in chunks:
+        heapq.heappush(ends, heapq.heappop(ends) + chunk)
+    return max(ends)
+
+
+def run_queue(durations, instances, chunk_size, scale):
+    '''Run the actual WorkQueue on a FileLeaseStore with one thread per instance,
+    each work item sleeping its duration times scale. Returns the wall time divided by scale'''
+    with tempfile.TemporaryDirectory() as root:
+        def worker():
+            queue = WorkQueue(FileLeaseStore(root, lease_time=60.), len(durations), chunk_size,
+                              poll_interval=0.01)
+            for chunk in queue.chunks():
+                time.sleep(durations[queue.items(chunk)].sum() * scale)
+                queue.complete(chunk)
+        threads = [threading.Thread(target=worker) for _ in range(instances)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return (time.perf_counter() - start) / scale
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the makespan of static and dynamic (work queue) '
+                                                 'distribution of FOM solves among instances')
+    parser.add_argument('-n', type=int, default=120 * 30, help='number of parameters')
+    parser.add_argument('-i', '--instances', type=int, default=30)
+    parser.add_argument('-c', '--chunk-sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--mean', type=float, default=60., help='mean solve time, in seconds')
+    parser.add_argument('--sigma', type=float, default=0.5, help='log-normal spread of the solve times')
+    parser.add_argument('--overhead', type=float, default=1., help='cost of a chunk claim, in seconds')
+    parser.add_argument('--durations', default=None, help='file of measured solve times, one per line, '
+                                                          'instead of random ones')
+    parser.add_argument('--scale', type=float, default=0., help='also run the actual work queue with threads, '
+                                                                'sleeping scale seconds per simulated second')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.durations:
+        durations = np.loadtxt(args.durations)
+    else:
+        rng = np.random.default_rng(args.seed)
+        durations = rng.lognormal(np.log(args.mean) - args.sigma ** 2 / 2, args.sigma, args.n)
+    ideal = durations.sum() / args.instances
+    static = static_makespan(durations, args.instances)
+    print(f'{len(durations)} solves on {args.instances} instances, ideal makespan {ideal:.0f}s')
+    print(f'static:          {static:8.0f}s  ({static / ideal:.2f}x ideal)')
+    for chunk_size in args.chunk_sizes:
+        dynamic = dynamic_makespan(durations, args.instances, chunk_size, args.overhead)
+        line = f'queue, chunk {chunk_size:>3}: {dynamic:6.0f}s  ({dynamic / ideal:.2f}x ideal)'
+        if args.scale:
+            line += f'  measured {run_queue(durations, args.instances, chunk_size, args.scale):.0f}s'
+        print(line)
@@ -0,0 +1,39 @@
+import argparse
+import os
+import tempfile
+import time
+from functools import partial
+
+from model import make_fom, make_param_space, default_solver_options, used_time
+from snapshot_store import solve_to_store
+from timestepping import FactorizedImplicitEulerTimeStepper, SnapshotSelection
+
+
+SELECTIONS = {'all': None,
+              'used_time()': partial(SnapshotSelection, used_time()),
+              'stride 10': partial(SnapshotSelection, stride=10),
+              'rtol 1e-2': partial(SnapshotSelection, rtol=1e-2)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the memory, time and file size of the FOM '
+                                                 'trajectories for every rule of time steps to keep')
+    parser.add_argument('mesh', help='mesh filename')
+    parser.add_argument('-n', type=int, default=5, help='number of parameters')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    mus = make_param_space().sample_randomly(args.n, seed=args.seed)
+    time_stepper = partial(FactorizedImplicitEulerTimeStepper, solver_options=default_solver_options)
+    print(f'{"kept steps":<12} {"values":>7} {"per solve":>10} {"trajectory":>11} {"file":>10}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, selection in SELECTIONS.items():
+            fom = make_fom(args.mesh, time_stepper=time_stepper, selection=selection and selection())
+            filename = os.path.join(tmp, 'u.h5')
+            start = time.perf_counter()
+            rows = solve_to_store(fom, mus, filename)
+            elapsed = (time.perf_counter() - start) / args.n
+            # The values of one trajectory held in memory during the solve
+            trajectory = rows / args.n * fom.solution_space.dim * 8 / 2**20
+            print(f'{name:<12} {rows / args.n:7.1f} {elapsed:9.3f}s {trajectory:8.1f} MB '
+                  f'{os.path.getsize(filename) / 2**20:7.1f} MB')
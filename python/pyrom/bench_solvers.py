@@ -0,0 +1,84 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+
+SOLVERS = {'cg/ilu': {'solver': 'cg', 'preconditioner': 'ilu'},
+           'cg/ilu rtol 1e-10': {'solver': 'cg', 'preconditioner': 'ilu', 'relative_tolerance': 1e-10},
+           'cg/hypre_amg': {'solver': 'cg', 'preconditioner': 'hypre_amg'},
+           'cg/hypre_amg rtol 1e-10': {'solver': 'cg', 'preconditioner': 'hypre_amg',
+                                       'relative_tolerance': 1e-10},
+           'cg/petsc_amg': {'solver': 'cg', 'preconditioner': 'petsc_amg'},
+           'gmres/ilu': {'solver': 'gmres', 'preconditioner': 'ilu'},
+           'gmres/hypre_amg': {'solver': 'gmres', 'preconditioner': 'hypre_amg'},
+           'lu': {'solver': 'lu'},
+           'mumps': {'solver': 'mumps'}}
+
+
+def run_config(mesh, solver_options, n, seed):
+    '''Solve the FOM for n seeded random parameters with solver_options, and return
+    the timings, the Krylov iterations, the peak memory and the solutions norms'''
+    from model import make_fom, make_param_space
+    from timestepping import FactorizedImplicitEulerTimeStepper
+
+    start = time.perf_counter()
+    steppers = []
+
+    def time_stepper(nt):
+        steppers.append(FactorizedImplicitEulerTimeStepper(nt, solver_options))
+        return steppers[-1]
+    fom = make_fom(mesh, solver_options, time_stepper=time_stepper)
+    build = time.perf_counter() - start
+    mus = make_param_space().sample_randomly(n, seed=seed)
+    start = time.perf_counter()
+    norms = [fom.solve(mu).norm().tolist() for mu in mus]
+    solve = time.perf_counter() - start
+    stats = steppers[-1].stats
+    return {'build': build,
+            'solve': solve / n,
+            'iterations': stats['iterations'] / max(stats['solves'], 1),
+            'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'norms': norms}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the FOM solves for a matrix of linear solvers '
+                                                 'and thread counts, each in its own process')
+    parser.add_argument('mesh', help='mesh filename')
+    parser.add_argument('-n', type=int, default=5, help='number of parameters')
+    parser.add_argument('-s', '--solvers', nargs='+', choices=SOLVERS, default=list(SOLVERS),
+                        help='solver configurations to run')
+    parser.add_argument('-t', '--threads', type=int, nargs='+', default=[1], help='OMP_NUM_THREADS values')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_config(args.mesh, SOLVERS[args.child], args.n, args.seed)))
+        sys.exit()
+
+    reference = None
+    print(f'{"solver":<24} {"threads":>7} {"build":>8} {"per solve":>10} {"its/step":>9} '
+          f'{"max RSS":>9} {"rel. diff":>9}')
+    for name in args.solvers:
+        for threads in args.threads:
+            env = dict(os.environ, OMP_NUM_THREADS=str(threads))
+            child = subprocess.run([sys.executable, __file__, args.mesh, '-n', str(args.n),
+                                    '--seed', str(args.seed), '--child', name],
+                                   env=env, stdout=subprocess.PIPE, universal_newlines=True)
+            if child.returncode:
+                print(f'{name:<24} {threads:>7} failed')
+                continue
+            result = json.loads(child.stdout.splitlines()[-1])
+            norms = np.array(result['norms'])
+            if reference is None:
+                reference = norms
+            diff = np.abs(norms - reference).max() / np.abs(reference).max()
+            print(f'{name:<24} {threads:>7} {result["build"]:7.1f}s {result["solve"]:9.3f}s '
+                  f'{result["iterations"]:9.1f} {result["max_rss"]:6.0f} MB {diff:9.1e}')
@@ -0,0 +1,36 @@
+import argparse
+import time
+from functools import partial
+
+from pymor.algorithms.timestepping import ImplicitEulerTimeStepper
+
+from model import make_fom, make_param_space
+from timestepping import FactorizedImplicitEulerTimeStepper
+
+
+STEPPERS = {'implicit-euler (cg/ilu per step)': ImplicitEulerTimeStepper,
+            'factorized (cg/ilu reused)': partial(FactorizedImplicitEulerTimeStepper,
+                                                  solver_options={'solver': 'cg', 'preconditioner': 'ilu'}),
+            'factorized (sparse lu)': partial(FactorizedImplicitEulerTimeStepper,
+                                              solver_options={'solver': 'lu'})}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time fom.solve with each time stepper')
+    parser.add_argument('mesh', help='mesh filename')
+    parser.add_argument('-n', type=int, default=5, help='number of parameters')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    mus = make_param_space().sample_randomly(args.n, seed=args.seed)
+    reference = None
+    for name, time_stepper in STEPPERS.items():
+        fom = make_fom(args.mesh, time_stepper=time_stepper)
+        fom.solve(mus[0])  # Warm up: form compilation, solver setup
+        start = time.perf_counter()
+        solutions = [fom.solve(mu) for mu in mus]
+        elapsed = (time.perf_counter() - start) / len(mus)
+        if reference is None:
+            reference = solutions
+        error = max(((U - R).norm() / R.norm().clip(1e-300)).max() for U, R in zip(solutions, reference))
+        print(f'{name:<34} {elapsed:8.3f}s per solve  max relative difference {error:.1e}')
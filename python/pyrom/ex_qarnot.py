@@ -13,11 +13,10 @@ fom_res_bucket = conn.create_bucket('fom-results')
 train_task = conn.create_task('train', 'docker-batch', TRAIN_INST, job=job)
 train_task.constants['DOCKER_REPO'] = DOCKER_REPO
 train_task.constants['DOCKER_TAG'] = DOCKER_TAG
-# h5repack compresse the solution files to quicken data exchanges
-train_task.constants['DOCKER_CMD'] = f"'python3 main.py -n {TRAIN_PARAM_NB} -o train/u &&" + \
-                                "h5repack -f GZIP=1 train/u${INSTANCE_ID}.h5 train/u${INSTANCE_ID}_c.h5'"
+# Solutions are written compressed by snapshot_store, no need to h5repack them
+train_task.constants['DOCKER_CMD'] = f"'python3 main.py -n {TRAIN_PARAM_NB} -o train/u'"
 train_task.resources.append(input_bucket)
 train_task.results = fom_res_bucket
-train_task.results_whitelist = r'_c.h5'  # we only want to withdraw compressed files
+train_task.results_whitelist = r'u\d+\.h5$'  # we only want to withdraw the solution files
 # [...]
 train_task.submit()
\ No newline at end of file
@@ -0,0 +1,154 @@
+import argparse
+import time
+
+import numpy as np
+
+from model import make_fom, make_param_space, dump_sol_list, dof_columns
+from batch_rom import BatchROM
+
+
+class ResidualEstimator:
+    '''A posteriori error estimator of the reduced solution, from the residual of
+    the implicit Euler scheme of the FOM:
+
+        r_n = phi*f - sum_q capa_q/dt * M_q (u_n - u_{n-1}) - sum_q lamb_q * K_q u_n - h * R u_n
+
+    Every term is affine in the parameters, so once the images of the basis by
+    each matrix are known, ||r_n||^2 is a small quadratic form of the reduced
+    coefficients (offline/online decomposition). The estimate is
+    sqrt(dt * sum_n ||r_n||^2) / min_q(lamb_q), min_q(lamb_q) being a lower bound
+    of the coercivity of the diffusion operator.
+
+    The residual norm is the euclidean one, or the dual norm of riesz_product
+    if given, at the cost of one solve per basis vector and affine term.'''
+    def __init__(self, fom, basis, riesz_product=None):
+        self.dt = fom.T / fom.time_stepper.nt
+        self.fom = fom
+        mass, op, rhs = fom.mass, fom.operator, fom.rhs
+        # Columns of the residual, in the order of coefficients() below
+        W = rhs.operators[0].as_range_array().copy()
+        for M in mass.operators:
+            W.append(M.apply(basis))
+        for A in op.operators:
+            W.append(A.apply(basis))
+        R = W if riesz_product is None else riesz_product.apply_inverse(W)
+        self.gram = W.inner(R)
+        self.n_mass = len(mass.operators)
+
+    def coefficients(self, coeffs, mu):
+        '''Coefficients of the residual columns at every time step, for the reduced
+        solution coeffs (array of shape (time steps + 1, basis size))'''
+        capa = np.array(self.fom.mass.evaluate_coefficients(mu))
+        op = np.array(self.fom.operator.evaluate_coefficients(mu))
+        phi = self.fom.rhs.evaluate_coefficients(mu)[0]
+        u, du = coeffs[1:], np.diff(coeffs, axis=0)
+        steps = len(u)
+        return np.hstack([np.full((steps, 1), phi),
+                          *[-c / self.dt * du for c in capa],
+                          *[-c * u for c in op]])
+
+    def estimate(self, coeffs, mu):
+        c = self.coefficients(coeffs, mu)
+        residuals = np.einsum('ni,ij,nj->n', c, self.gram, c)
+        coercivity = min(mu[key][0] for key in mu if key.startswith('lamb_'))
+        return np.sqrt(self.dt * np.maximum(residuals, 0).sum()) / coercivity
+
+
+def extend_basis(basis, snapshots, product, modes_per_snapshot):
+    '''POD-greedy extension: add to the basis the first POD modes of the part of
+    each trajectory the basis does not capture yet'''
+    import pymor.basic as pmb
+    offset = len(basis)
+    for U in snapshots:
+        error = U.copy()
+        if len(basis):
+            error -= basis.lincomb(U.inner(basis, product))
+        modes, _ = pmb.pod(error, product=product, modes=modes_per_snapshot)
+        basis.append(modes)
+    pmb.gram_schmidt(basis, product=product, offset=offset, copy=False)
+    return basis
+
+
+def weak_greedy(fom, training_set, tol, max_basis_size=50, batch_size=1, modes_per_snapshot=1,
+                solve=None, product=None, riesz_product=None):
+    '''Build a reduced basis by weak greedy selection over training_set.
+
+    At each step, the ROM error is estimated for every parameter of training_set
+    (see ResidualEstimator), and the FOM is solved for the batch_size parameters
+    with the highest estimates. The loop stops when the highest estimate is below
+    tol, or when the basis reaches max_basis_size.
+
+    The reduced model has a parametric mass, which pymor's InstationaryModel can't
+    solve: the reduced solutions of the training set are computed by BatchROM,
+    which assembles the mass for each parameter.
+    solve(mus) returns the FOM solutions for a list of parameters; it defaults to
+    solving them one after another and can be replaced, e.g. by a local process
+    pool, to run the batch in parallel.
+    Returns the reductor, the ROM, and the history of maximum estimates.'''
+    import pymor.basic as pmb
+    product = product or fom.h1_0_semi_product
+    solve = solve or (lambda mus: [fom.solve(mu) for mu in mus])
+    basis = fom.solution_space.empty()
+    remaining = list(training_set)
+    history = []
+    # The first batch can't be estimated, take the first parameters
+    selected = remaining[:batch_size]
+    while True:
+        start = time.perf_counter()
+        remaining = [mu for mu in remaining if not any(mu is s for s in selected)]
+        extend_basis(basis, solve(selected), product, modes_per_snapshot)
+        reductor = pmb.InstationaryRBReductor(fom, RB=basis, product=product)
+        rom = reductor.reduce()
+        if len(basis) >= max_basis_size or not remaining:
+            break
+        estimator = ResidualEstimator(fom, basis, riesz_product)
+        batch = BatchROM.from_rom(rom)
+        # The estimator needs every time step, not only the num_values outputs
+        batch.num_values = None
+        estimates = np.array([estimator.estimate(coeffs, mu)
+                              for coeffs, mu in zip(batch.solve(remaining), remaining)])
+        history.append(estimates.max())
+        print(f'basis size {len(basis)}: max estimate {estimates.max():.3e} '
+              f'({time.perf_counter() - start:.1f}s)')
+        if estimates.max() <= tol:
+            break
+        selected = [remaining[i] for i in np.argsort(estimates)[::-1][:batch_size]]
+    return reductor, rom, history
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a reduced basis by weak greedy parameter selection')
+    parser.add_argument('mesh', help='mesh filename')
+    parser.add_argument('-n', type=int, default=500, help='number of training parameters to select from')
+    parser.add_argument('-t', '--tol', type=float, default=1e-3, help='target error estimate')
+    parser.add_argument('-m', type=int, default=50, help='maximum basis size')
+    parser.add_argument('-b', '--batch', type=int, default=1, help='FOM solves per greedy step')
+    parser.add_argument('-p', type=int, default=None, help='solve each batch on a local pool of p processes')
+    parser.add_argument('-o', default='rom/basis.h5', help='output file of the reduced basis')
+    parser.add_argument('--rom', default=None, help='also export the ROM to this file, see rom_artifact')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    fom = make_fom(args.mesh)
+    training_set = make_param_space().sample_randomly(args.n, seed=args.seed)
+    solve = pool = None
+    if args.p is not None:
+        from train_local import make_pool, train
+        # Created once, so that the workers build the FOM once for all the greedy steps
+        pool = make_pool(args.mesh, args.p)
+
+        def solve(mus):
+            U, _ = train(args.mesh, mus, fom.solution_space, args.p, pool=pool)
+            steps = len(U) // len(mus)
+            return [U[i * steps:(i + 1) * steps] for i in range(len(mus))]
+    try:
+        reductor, rom, history = weak_greedy(fom, training_set, args.tol, args.m, args.batch, solve=solve)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    print(f'basis size {len(reductor.bases["RB"])} after {len(history) + 1} greedy steps')
+    dump_sol_list(args.o, reductor.bases['RB'])
+    if args.rom:
+        import rom_artifact
+        rom_artifact.save(args.rom, rom, reductor.bases['RB'], dof_columns(fom.solution_space.V))
@@ -0,0 +1,148 @@
+import argparse
+import glob
+import math
+import os
+import sys
+
+import numpy as np
+
+from snapshot_store import SnapshotStore
+
+
+def pod(U, product=None, modes=None, l2_err=0., rtol=4e-8):
+    '''pymor's pod of the VectorArray U, or the same on the rows of the numpy array
+    U (only with the euclidean product), e.g. to test the HAPOD without FEniCS.
+    Returns the orthonormal modes and their singular values'''
+    if not isinstance(U, np.ndarray):
+        import pymor.basic as pmb
+        return pmb.pod(U, product=product, modes=modes, l2_err=l2_err, rtol=rtol)
+    if product is not None:
+        raise NotImplementedError('POD of a numpy array w.r.t. a product')
+    _, svals, basis = np.linalg.svd(U, full_matrices=False)
+    # Like pymor, keep the modes whose discarded tail is above l2_err, and above rtol
+    tail = np.sqrt(np.cumsum(svals[::-1] ** 2))[::-1]
+    count = np.count_nonzero((tail > l2_err) & (svals > rtol * svals.max(initial=0.)))
+    if modes is not None:
+        count = min(count, modes)
+    return basis[:count], svals[:count]
+
+
+def scaled_pod(U, product, l2_err=0., modes=None):
+    '''POD of U with the modes scaled by their singular values: their POD is
+    (up to the discarded l2_err) the same as the POD of U, so they can stand for
+    U in a later merge'''
+    basis, svals = pod(U, product, modes, l2_err)
+    if isinstance(basis, np.ndarray):
+        return basis * svals[:, np.newaxis]
+    basis.scal(svals)
+    return basis
+
+
+def incremental_pod(chunks, product, l2_err=0., steps=1):
+    '''Compress the snapshots given chunk by chunk into scaled POD modes: at each
+    step, the modes so far and the new chunk are compressed together, so that only
+    one chunk is in memory at a time. The tolerance is split over the steps so that
+    the overall discarded energy stays within l2_err'''
+    step_err = l2_err / math.sqrt(max(steps, 1))
+    basis = None
+    for U in chunks:
+        if isinstance(basis, np.ndarray):
+            U = np.vstack([basis, U])
+        elif basis is not None:
+            basis.append(U)
+            U = basis
+        basis = scaled_pod(U, product, step_err)
+    return basis
+
+
+def store_chunks(filename, space, max_rows=None):
+    '''Read the snapshots of filename (see snapshot_store) one trajectory at a time,
+    or by max_rows rows if given or if the parameters were not recorded'''
+    from model import dof_columns
+    columns = dof_columns(space.V)
+    with SnapshotStore(filename) as store:
+        if max_rows is None and (store.mu_index >= 0).all():
+            for index in np.unique(store.mu_index):
+                yield store.to_vector_array(space, store.trajectory_rows(index), columns)
+        else:
+            max_rows = max_rows or 1000
+            for start in range(0, len(store), max_rows):
+                yield store.to_vector_array(space, slice(start, start + max_rows), columns)
+
+
+def compress(filename, space, product, l2_err=0., max_rows=None):
+    '''Local step, run by a train instance: compress the snapshots of filename to
+    scaled POD modes'''
+    return compress_files([filename], space, product, l2_err, max_rows)
+
+
+def compress_files(filenames, space, product, l2_err=0., max_rows=None):
+    '''compress() the snapshots of several files together, e.g. the chunks an instance
+    solved from a work queue'''
+    steps = 0
+    for filename in filenames:
+        with SnapshotStore(filename) as store:
+            steps += len(np.unique(store.mu_index)) if max_rows is None else math.ceil(len(store) / max_rows)
+    chunks = (U for filename in filenames for U in store_chunks(filename, space, max_rows))
+    return incremental_pod(chunks, product, l2_err, steps)
+
+
+def merge(bases, product, modes=None, l2_err=0., count=1):
+    '''Global step, run by rom-build: merge the scaled modes of count train instances
+    one after the other, and return the final orthonormal (w.r.t. product) POD modes
+    and singular values. bases is an iterable of VectorArray, e.g. loaded lazily,
+    or of numpy arrays'''
+    merged = incremental_pod(bases, product, l2_err, count)
+    return pod(merged, product, modes)
+
+
+def merge_files(filenames, space, product, modes=None, l2_err=0.):
+    '''merge() the scaled modes stored in filenames, reading one file at a time'''
+    from model import load_sol_list
+    bases = (load_sol_list(filename, space) for filename in filenames)
+    return merge(bases, product, modes, l2_err, len(filenames))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Hierarchical POD: compress the snapshots of each train instance '
+                                                 'to a local basis, then merge the local bases')
+    subparsers = parser.add_subparsers(dest='step', required=True)
+    local = subparsers.add_parser('compress', help='compress a snapshots file to scaled POD modes')
+    local.add_argument('mesh', help='mesh filename')
+    local.add_argument('inputs', nargs='+', help='snapshots files, or glob patterns')
+    local.add_argument('-o', required=True, help='output file of the scaled modes')
+    local.add_argument('--l2-err', type=float, default=0., help='discarded l2 energy of this step')
+    local.add_argument('--max-rows', type=int, default=None, help='snapshots read at a time, '
+                                                                  'default to one trajectory')
+    local.add_argument('--allow-empty', action='store_true', help='write nothing and succeed if no file matches, '
+                                                                  'e.g. for a worker that claimed no chunk')
+    merge_parser = subparsers.add_parser('merge', help='merge scaled POD modes into the reduced basis')
+    merge_parser.add_argument('mesh', help='mesh filename')
+    merge_parser.add_argument('inputs', nargs='+', help='files of scaled modes, or glob patterns')
+    merge_parser.add_argument('-m', type=int, default=None, help='number of modes of the reduced basis')
+    merge_parser.add_argument('-o', default='rom/basis.h5', help='output file of the reduced basis')
+    merge_parser.add_argument('--l2-err', type=float, default=0., help='discarded l2 energy of this step')
+    merge_parser.add_argument('--scaled-output', default=None, help='also write the merged scaled modes, '
+                                                                   'to merge them again with later local bases')
+    args = parser.parse_args()
+
+    filenames = sorted(f for pattern in args.inputs for f in glob.glob(pattern))
+    if not filenames and args.step == 'compress' and args.allow_empty:
+        print(f'no file matches {" ".join(args.inputs)}, nothing to compress')
+        sys.exit()
+    if not filenames:
+        parser.error(f'no file matches {" ".join(args.inputs)}')
+    from model import make_fom, dump_sol_list, load_sol_list
+    fom = make_fom(args.mesh)
+    product = fom.h1_0_semi_product
+    if args.step == 'compress':
+        basis = compress_files(filenames, fom.solution_space, product, args.l2_err, args.max_rows)
+    else:
+        bases = (load_sol_list(filename, fom.solution_space) for filename in filenames)
+        scaled = incremental_pod(bases, product, args.l2_err, len(filenames))
+        if args.scaled_output:
+            dump_sol_list(args.scaled_output, scaled)
+        basis, svals = pod(scaled, product, args.m)
+        print(f'{len(basis)} modes from {len(filenames)} local bases, last singular value {svals[-1]:.3e}')
+    os.makedirs(os.path.dirname(args.o) or '.', exist_ok=True)
+    dump_sol_list(args.o, basis)
@@ -1,3 +1,6 @@
+from functools import partial
+from math import inf
+
 import dolfin as df
 from pymor.models.basic import InstationaryModel
 
@@ -20,96 +23,160 @@ domain_dict = {'block':1,
                'casing':3,
                'die':4}
 
+'''Default linear solver of the FOM. Other keys understood by timestepping.make_solver
+(tolerances, PETSc options...) are honored by the time steppers of timestepping, the default one included'''
+default_solver_options = {'solver': 'cg', 'preconditioner': 'ilu'}
+'''Default linear solver of the FOM under MPI, PETSc ILU being serial only'''
+default_mpi_solver_options = {'solver': 'cg', 'preconditioner': 'hypre_amg'}
+
 
 def load_mesh(filename):
+    '''Load the mesh, partitioned among the processes when run with mpirun'''
     return df.Mesh(filename)
 
 
-def make_measures(mesh):
-    '''Defines subdomains for the mesh and returns associated measures'''
-    tol = 1e-7  # Constant for numerical precision
+def mpi_size():
+    return df.MPI.comm_world.size
 
-    boundary_air = df.CompiledSubDomain('on_boundary && x[2] > 0 - tol',
-                                tol=tol)
 
-    sub_die = df.CompiledSubDomain('x[0] <= xb + tol && x[0] >= -xb - tol \
-                                 && x[1] <= yb + tol && x[1] >= -yb - tol \
-                                 && x[2] <= z1 + tol && x[2] >= z0 - tol',
-                                   tol=tol, xb = die_l/2, yb = die_w/2,
-                                   z1 = -paste_h-casing_h+die_h, z0 = -paste_h-casing_h)
+def centered_box(length, width, z0, z1):
+    '''Box of the given length (x) and width (y) centered on the z axis, from height z0 to z1'''
+    return (-length/2, length/2, -width/2, width/2, z0, z1)
 
-    sub_casing = df.CompiledSubDomain('x[0] <= xb + tol && x[0] >= -xb - tol \
-                                 && x[1] <= yb + tol && x[1] >= -yb - tol \
-                                 && x[2] <= z1 + tol && x[2] >= z0 - tol',
-                                   tol=tol, xb = casing_l/2, yb = casing_w/2,
-                                   z1 = -paste_h, z0 = -paste_h-casing_h)
 
-    sub_paste = df.CompiledSubDomain('x[0] <= xb + tol && x[0] >= -xb - tol \
-                                 && x[1] <= yb + tol && x[1] >= -yb - tol \
-                                 && x[2] <= z1 + tol && x[2] >= z0 - tol',
-                                   tol=tol, xb = casing_l/2, yb = casing_w/2,
-                                   z1 = 0, z0 = -paste_h)
+'''Subdomains as boxes, by name in domain_dict. Cells are marked 'block' unless in one
+of these boxes, the last one containing them wins. Extra layers can be appended,
+along with their number in domain_dict'''
+subdomain_boxes = [('casing', centered_box(casing_l, casing_w, -paste_h-casing_h, -paste_h)),
+                   ('die', centered_box(die_l, die_w, -paste_h-casing_h, -paste_h-casing_h+die_h)),
+                   ('paste', centered_box(casing_l, casing_w, -paste_h, 0))]
 
-    markers = df.MeshFunction('size_t', mesh, 3)
-    markers.set_all(domain_dict['block'])
-    sub_casing.mark(markers, domain_dict['casing'])
-    sub_die.mark(markers, domain_dict['die'])
-    sub_paste.mark(markers, domain_dict['paste'])
+'''Boundary facets exchanging with the air, marked 1'''
+air_box = (-inf, inf, -inf, inf, 0, inf)
 
-    boundary_markers = df.MeshFunction('size_t', mesh, 2)
-    boundary_markers.set_all(0)
-    boundary_air.mark(boundary_markers, 1)
+
+def make_measures(mesh, filename=None):
+    '''Defines subdomains for the mesh and returns associated measures.
+    Cells and boundary facets are classified against subdomain_boxes and air_box
+    all at once with numpy (see subdomains). If filename, the file the mesh was read
+    from, is given, the markers are saved next to it and reused by later calls'''
+    from subdomains import mark
+    cell_boxes = [(domain_dict[name], box) for name, box in subdomain_boxes]
+    markers, boundary_markers = mark(mesh, cell_boxes, domain_dict['block'], [(1, air_box)], filename)
 
     dx = df.Measure('dx', domain=mesh, subdomain_data=markers)
     ds = df.Measure('ds', domain=mesh, subdomain_data=boundary_markers)
     return dx, ds
 
 
-def make_space(mesh):
-    return df.FunctionSpace(mesh, 'P', 1)
+def make_space(mesh, degree=1):
+    return df.FunctionSpace(mesh, 'P', degree)
+
+
+def dof_columns(V):
+    '''Column of every degree of freedom owned by the process in the snapshot files:
+    the index of its vertex in the mesh file. Dolfin numbers the dofs differently
+    for every partition of the mesh, this numbering does not depend on it, so that
+    files written with any number of MPI processes are read the same way.
+    Only for P1 spaces, whose dofs are the vertices'''
+    if V.ufl_element().degree() != 1:
+        raise ValueError('snapshot columns are only defined for P1 spaces')
+    first, last = V.dofmap().ownership_range()
+    vertices = df.dof_to_vertex_map(V)[:last - first]
+    return V.mesh().topology().global_indices(0)[vertices]
 
 
 class InstationaryParametricMassModel(InstationaryModel):
     '''This simple class encapsulate pymor.InstationaryModel which can't have a parametric mass.
     We simply assemble the mass the before handing everything to the base class. It causes no problem
-    since the mass is not time dependant'''
+    since the mass is not time dependant.
+    With a selection (timestepping.SnapshotSelection), solutions only hold the time steps it keeps,
+    and solution_times gives their times. Time steppers that support it never store the other ones'''
     def __init__(self, T, initial_data, operator, rhs, mass=None, time_stepper=None, num_values=None,
-                 output_functional=None, products=None, error_estimator=None, visualizer=None, name=None):
+                 output_functional=None, products=None, error_estimator=None, visualizer=None, name=None,
+                 selection=None):
+        self.selection = selection
         super().__init__(T, initial_data, operator, rhs, mass, time_stepper, num_values, 
                          output_functional, products, error_estimator, visualizer, name)
 
     def _compute_solution(self, mu=None, **kwargs):
         mu = mu.with_(t=0.)
         U0 = self.initial_data.as_range_array(mu)
+        selects = self.selection is not None and getattr(self.time_stepper, 'selects', False)
+        if self.selection is not None:
+            self.selection.reset()
         U = self.time_stepper.solve(operator=self.operator,
                                         rhs=self.rhs,
                                         initial_data=U0,
                                         mass=self.mass.assemble(mu),
-                                        initial_time=0, end_time=self.T, mu=mu, num_values=self.num_values)
+                                        initial_time=0, end_time=self.T, mu=mu,
+                                        num_values=None if self.selection is not None else self.num_values,
+                                        **({'selection': self.selection} if selects else {}))
+        if self.selection is not None and not selects:
+            U = self.selection.select(U, 0, self.T)
         return U
 
+    def solution_times(self, count):
+        '''Times of the count values of the last solution'''
+        if self.selection is not None:
+            return list(self.selection.times)
+        return [self.T * i / (count - 1) for i in range(count)] if count > 1 else [0.]
+
+
+def assemble_matrices(V, dx, ds):
+    '''Assemble the Fenics matrices and vectors of the model, returned in a dict by name'''
+    u = df.TrialFunction(V)
+    v = df.TestFunction(V)
+    matrices = {}
+    for dom, i in domain_dict.items():
+        matrices[f'mass_{dom}'] = df.assemble(df.inner(u, v)*dx(i))
+        matrices[f'diff_{dom}'] = df.assemble(df.inner(df.grad(u), df.grad(v))*dx(i))
+    matrices['robin_left'] = df.assemble(u*v*ds(1))
+    matrices['source'] = df.assemble(v*dx(domain_dict['die']))
 
-def make_pymor_bindings(V, dx, ds, solver_options):
-    '''Assemble the Fenics operator and binds them to pymor.Operator with parameter separation
+    # Norms matrix
+    matrices['l2'] = df.assemble(df.inner(u, v)*df.dx)
+    matrices['h1'] = df.assemble(df.inner(df.grad(u), df.grad(v))*dx)
+    return matrices
+
+
+def make_pymor_bindings(V, dx, ds, solver_options, matrices=None, time_stepper=None, selection=None):
+    '''Assemble the Fenics operator and binds them to pymor.Operator with parameter separation.
+    Already assembled matrices (see assemble_matrices) can be given instead of dx and ds.
+    solver_options, e.g. {'solver': 'gmres', 'preconditioner': 'hypre_amg'}, are used to invert
+    the operators, and in particular M + dt*A(mu) at each time step.
+    time_stepper(nt) returns the pymor.TimeStepper to use for nt time steps, defaults to
+    timestepping.FactorizedImplicitEulerTimeStepper with solver_options, which factorizes
+    M + dt*A(mu) once per solve instead of at every time step.
+    It can also be the name of one of timestepping.TIME_STEPPERS, e.g. 'bdf2' or 'adaptive',
+    which then use solver_options.
+    selection (timestepping.SnapshotSelection) restricts the solutions to some time steps.
     Returns the full order model (pymor.Model)'''
     import pymor.basic as pmb
     from pymor.bindings.fenics import FenicsVectorSpace, FenicsMatrixOperator
-    from pymor.algorithms.timestepping import ImplicitEulerTimeStepper
 
     space = FenicsVectorSpace(V)
+    if isinstance(time_stepper, str):
+        from timestepping import TIME_STEPPERS
+        time_stepper = partial(TIME_STEPPERS[time_stepper], solver_options=solver_options)
+    if time_stepper is None:
+        from timestepping import FactorizedImplicitEulerTimeStepper
+        time_stepper = partial(FactorizedImplicitEulerTimeStepper, solver_options=solver_options)
+    # pymor looks for the options of apply_inverse under the 'inverse' key
+    solver_options = {'inverse': solver_options}
 
     # Operators matrix
-    u = df.TrialFunction(V)
-    v = df.TestFunction(V)
-    mass_mat = [df.assemble(df.inner(u, v)*dx(i)) for i in domain_dict.values()]
-    diff_mat = [df.assemble(df.inner(df.grad(u), df.grad(v))*dx(i)) for i in domain_dict.values()]
-    robin_left_mat = df.assemble(u*v*ds(1))
-    source_mat = df.assemble(v*dx(domain_dict['die']))
+    if matrices is None:
+        matrices = assemble_matrices(V, dx, ds)
+    mass_mat = [matrices[f'mass_{dom}'] for dom in domain_dict.keys()]
+    diff_mat = [matrices[f'diff_{dom}'] for dom in domain_dict.keys()]
+    robin_left_mat = matrices['robin_left']
+    source_mat = matrices['source']
 
     # Norms matrix
-    l2_mat = df.assemble(df.inner(u, v)*df.dx)
+    l2_mat = matrices['l2']
     l2_0_mat = l2_mat.copy()
-    h1_mat = df.assemble(df.inner(df.grad(u), df.grad(v))*dx)
+    h1_mat = matrices['h1']
     h1_0_mat = h1_mat.copy()
 
     # Operators
@@ -125,10 +192,12 @@ def make_pymor_bindings(V, dx, ds, solver_options):
     # Separated operator
     mass = pmb.LincombOperator(mass_op, project_capa)
 
+    # The time stepper inverts M + dt*op with the solver options of op
     op = pmb.LincombOperator([*diff_op,
                               robin_left_op],
                              [*project_lamb,
-                              pmb.ExpressionParameterFunctional('h[0]', {'h':1})])
+                              pmb.ExpressionParameterFunctional('h[0]', {'h':1})],
+                             solver_options=solver_options)
 
     rhs = pmb.LincombOperator([source_op],
                               [pmb.ExpressionParameterFunctional('phi[0]', {'phi':1})])
@@ -137,17 +206,18 @@ def make_pymor_bindings(V, dx, ds, solver_options):
     dt = 5
     fom = InstationaryParametricMassModel(
                             T = end_time, 
-                            initial_data=space.make_array([df.project(df.Constant(0), V).vector()]),
+                            initial_data=space.make_array([df.Function(V).vector()]),
                             operator=op,
                             rhs=rhs,
                             mass=mass,
-                            time_stepper=ImplicitEulerTimeStepper(end_time//dt),
+                            time_stepper=time_stepper(end_time//dt),
                             num_values= None,
                             products={'l2': FenicsMatrixOperator(l2_mat, V, V),
                                        'l2_0': FenicsMatrixOperator(l2_0_mat, V, V),
                                        'h1': FenicsMatrixOperator(h1_mat, V, V),
                                        'h1_0_semi': FenicsMatrixOperator(h1_0_mat, V, V)},
-                            visualizer = None
+                            visualizer = None,
+                            selection=selection
                             )
     return fom
     
@@ -183,13 +253,24 @@ def make_param_space():
     return pmb.ParameterSpace(params, param_range)
 
 
-def make_fom(filename, option={'solver': 'cg', 'preconditioner': 'ilu'}):
-    '''Returns the full order model specified from the mesh filename and solver options'''
+def make_fom(filename, option=None, cache_dir=None, time_stepper=None, selection=None):
+    '''Returns the full order model specified from the mesh filename and solver options.
+    If cache_dir is given, the assembled matrices are stored there and reloaded by later calls
+    on the same mesh, see assembly_cache. time_stepper and selection are passed to make_pymor_bindings.
+    Run with mpirun, the mesh is partitioned among the processes, which assemble and solve the
+    FOM together, with default_mpi_solver_options by default. The cache is serial only'''
     mesh = load_mesh(filename)
-    dx, ds = make_measures(mesh)
     V = make_space(mesh)
-    option = {'solver': 'cg', 'preconditioner': 'ilu'}
-    return make_pymor_bindings(V, dx, ds, option)
+    parallel = mpi_size() > 1
+    option = option or (default_mpi_solver_options if parallel else default_solver_options)
+    if cache_dir is not None and parallel:
+        raise ValueError('the assembly cache can not be used with MPI')
+    if cache_dir is not None:
+        from assembly_cache import load_or_assemble
+        return make_pymor_bindings(V, None, None, option, load_or_assemble(filename, mesh, V, cache_dir),
+                                   time_stepper, selection)
+    dx, ds = make_measures(mesh, filename)
+    return make_pymor_bindings(V, dx, ds, option, time_stepper=time_stepper, selection=selection)
 
 
 def used_time():
@@ -208,16 +289,26 @@ def dump_sol(hdf_file: df.HDF5File, U_list, index: int, partition: str):
     hdf_file.write(u_dump, partition)
 
 
-def dump_sol_list(filename: str, U_list, radica: str='sol'):
-    '''Write solution list to hdf5 file, on the partition /{radica}'''
-    hdf_file = df.HDF5File(U_list.space.V.mesh().mpi_comm(), filename, 'w')
-    for i in range(len(U_list)):
-        dump_sol(hdf_file, U_list, i, str_radica_ind(radica, i))
-    hdf_file.close()
-    
-
-def load_sol_list(filename: str, space, radica: str='sol'):
-    '''Load solution from filename that are in the form /{radica}_i'''
+def dump_sol_list(filename: str, U_list, radica: str='sol', *, mu=None, times=None):
+    '''Write solution list to hdf5 file, as the rows of a single compressed dataset (see snapshot_store),
+    in the columns given by dof_columns. Under MPI, all the processes write their part collectively.
+    radica only named the datasets of the former layout, and is kept for the existing callers'''
+    from snapshot_store import SnapshotWriter
+    V = U_list.space.V
+    with SnapshotWriter(filename, U_list.dim, comm=V.mesh().mpi_comm(), columns=dof_columns(V)) as writer:
+        writer.append(U_list, mu, times)
+
+
+def load_sol_list(filename: str, space, radica: str='sol', rows=None):
+    '''Load solutions from filename, written by dump_sol_list, or the given rows only.
+    Files of the former layout, one dataset /{radica}_i per solution, are still read'''
+    import h5py
+    with h5py.File(filename, 'r') as f:
+        legacy = 'snapshots' not in f
+    if not legacy:
+        from snapshot_store import SnapshotStore
+        with SnapshotStore(filename) as store:
+            return store.to_vector_array(space, rows, dof_columns(space.V))
     hdf = df.HDF5File(space.V.mesh().mpi_comm(), filename, 'r')
     vecs = []
     i = 0
@@ -228,4 +319,3 @@ def load_sol_list(filename: str, space, radica: str='sol'):
         i += 1
     hdf.close()
     return space.make_array(vecs)
-        
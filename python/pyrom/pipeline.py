@@ -0,0 +1,364 @@
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+DOCKER_REPO = 'qarnotlab/pymor_fenics'
+DOCKER_TAG = '2020.2.0_2019.1.0'
+MESH = 'mesh.xml'
+# The work queue keeps its leases in a bucket through the SDK, which the image lacks
+QARNOT_SDK = 'qarnot==2.23.0'
+# Modules of this directory that the tasks run or import. The image predates them,
+# so they are sent along with ./input, see upload_input
+TASK_MODULES = ('model.py', 'subdomains.py', 'assembly_cache.py', 'timestepping.py', 'sampling.py',
+                'snapshot_store.py', 'bench_solvers.py', 'train_mpi.py', 'work_queue.py', 'hapod.py',
+                'batch_rom.py', 'rom_artifact.py', 'rom_eval.py')
+
+
+class Stage:
+    '''A task of the DAG: command runs on instances instances once every upstream
+    stage is done, with the buckets named in resources and its results sent to the
+    bucket named results. constants are added to the task constants. With queue, the
+    instances share a work queue whose leases are kept in a bucket of their own, see
+    use_work_queue'''
+    def __init__(self, name, command, instances=1, upstreams=(), resources=(), results=None,
+                 whitelist=None, constants=None, queue=False):
+        self.name = name
+        self.command = command
+        self.instances = instances
+        self.upstreams = list(upstreams)
+        self.resources = list(resources)
+        self.results = results
+        self.whitelist = whitelist
+        self.constants = constants or {}
+        self.queue = queue
+
+
+def upload_input(bucket, directory='input'):
+    '''Send the files of directory and TASK_MODULES to bucket, the input resource of
+    every stage, skipping the unchanged ones (see bucket_sync.upload_files). The
+    modules replace the files of the same name in directory, e.g. an older model.py,
+    and the remote files that are in neither are deleted'''
+    from bucket_sync import directory_files, upload_files
+    here = os.path.dirname(os.path.abspath(__file__))
+    files = directory_files(directory)
+    files.update((name, os.path.join(here, name)) for name in TASK_MODULES)
+    return upload_files(bucket, files, prune=True)
+
+
+def validation_params(val_param_nb, seed=1):
+    '''Command writing the validation parameters to param.pkl. Every task regenerates
+    the same ones (see sampling), instead of downloading them from a bucket filled
+    by a task of its own. The seed differs from the one of the training parameters'''
+    return f'python3 sampling.py -n {val_param_nb} --seed {seed} -o param.pkl'
+
+
+def train_sample(param_nb, instances, instance_id=None):
+    '''Command writing to param.pkl the shard of this instance of the training sample of
+    param_nb parameters, split among instances (see sampling). instance_id defaults to
+    INSTANCE_ID, and may be a shell expression'''
+    option = f' --instance-id {instance_id}' if instance_id is not None else ''
+    return f'python3 sampling.py -n {param_nb} --instances {instances}{option} -o param.pkl'
+
+
+def solve_command(params, output):
+    '''Command solving the FOM for the parameters given by params (train_mpi.py
+    options) to the snapshot file output (see snapshot_store)'''
+    return f'python3 train_mpi.py {MESH} {params} -o {output}'
+
+
+def queue_command(params, output):
+    '''Command solving the FOM for the parameters given by params (work_queue.py options),
+    pulled by chunks from the work queue of the task (see use_work_queue), each chunk
+    written to output with {chunk} replaced by its number. The Qarnot SDK is installed
+    first, at the QARNOT_SDK version'''
+    return (f'pip3 install --quiet {QARNOT_SDK} && '
+            f'python3 work_queue.py {MESH} {params} --lease-bucket ${{LEASE_BUCKET}} -o {output}')
+
+
+def fom_command(params, output, instances, queue=False):
+    '''Command solving the FOM for the validation parameters given by params, the shard
+    of this instance among instances written gzip compressed to output${INSTANCE_ID}_c.h5
+    (see snapshot_store), each trajectory tagged with the index of its parameter.
+    With queue, the instances share the parameters through a work queue, and the
+    chunks are written to output{chunk}_c.h5 instead'''
+    if queue:
+        return queue_command(params, f'{output}{{chunk}}_c.h5')
+    return solve_command(f'{params} --instances {instances}', f'{output}${{INSTANCE_ID}}_c.h5')
+
+
+def train_command(params, output, local, queue=False):
+    '''Command solving the FOM for the parameters given by params (train_mpi.py or
+    work_queue.py options) to output${INSTANCE_ID}.h5, or with queue to the chunks
+    output{chunk}.h5 this instance pulled from the work queue, then compressing the
+    snapshots to the local basis local${INSTANCE_ID}.h5 (hapod.py compress), the only
+    file sent back. An instance that pulled no chunk writes no local basis'''
+    if queue:
+        solve, snapshots = queue_command(params, f'{output}{{chunk}}.h5'), f'{output}*.h5'
+    else:
+        solve, snapshots = solve_command(params, f'{output}${{INSTANCE_ID}}.h5'), f'{output}${{INSTANCE_ID}}.h5'
+    empty = ' --allow-empty' if queue else ''
+    return f'{solve} && python3 hapod.py compress {MESH} {snapshots} -o {local}${{INSTANCE_ID}}.h5{empty}'
+
+
+def rom_val_command(rom_file, val_params):
+    '''Command solving the ROM of rom_file (see rom_artifact) for the validation
+    parameters to rom-val/coefficients.npz (rom_eval.py solve)'''
+    return f'{val_params} && python3 rom_eval.py solve {rom_file} -i param.pkl -o rom-val/coefficients.npz'
+
+
+def rom_compare_command(rom_file):
+    '''Command writing to compare/errors.csv the errors of the ROM of rom_file against
+    the FOM validation snapshots val/u*_c.h5 (rom_eval.py compare)'''
+    return f'python3 rom_eval.py compare {rom_file} rom-val/coefficients.npz val/u*_c.h5 -o compare/errors.csv'
+
+
+def use_work_queue(conn, job, task):
+    '''Give the instances of task a work queue (see work_queue): a new bucket for its
+    leases, named in the LEASE_BUCKET constant, and the credentials to use it.
+    Returns the bucket, to delete once the task is done'''
+    bucket = conn.create_bucket(f'leases-{task.name}-{job.uuid}')
+    task.constants['LEASE_BUCKET'] = bucket.uuid
+    task.allow_credentials_to_be_exported_to_task_environment()
+    return bucket
+
+
+def barrier_stages(train_inst=30, train_param_nb=120, val_inst=25, val_param_nb=50, rb_size=50, queue=True):
+    '''The DAG of run.py: every stage waits for all the instances of its upstream tasks.
+    Each train instance compresses its own snapshots (hapod.py compress), and rom-build
+    merges the local bases into the reduced basis (hapod.py merge). With queue, the
+    train and fom-val instances share their parameters through work queues, otherwise
+    each one solves its own shard of the training sample'''
+    val_params = validation_params(val_param_nb)
+    # Without queue, each instance solves its own shard of the sample
+    shard = '' if queue else f' --instances {train_inst}'
+    train = train_command(f'-n {train_param_nb * train_inst}{shard}', 'train/u', 'train/b', queue)
+    return [
+        Stage('train', train, train_inst,
+              resources=['input'], results='fom-results', whitelist=r'b\d+\.h5$', queue=queue),
+        Stage('rom-build', f'python3 hapod.py merge {MESH} train/b*.h5 -m {rb_size} -o rom/basis.h5 && '
+                           f'python3 rom_artifact.py {MESH} rom/basis.h5 -o rom/rom.npz', 1, ['train'],
+              ['fom-results', 'input'], 'rom'),
+        Stage('fom-val', f"{val_params} && {fom_command('-i param.pkl', 'val/u', val_inst, queue)}", val_inst,
+              resources=['input'], results='fom-results', whitelist=r'_c.h5', queue=queue),
+        Stage('rom-val', rom_val_command('rom/rom.npz', val_params), 1, ['rom-build'],
+              ['input', 'rom'], 'rom-results'),
+        Stage('rom-compare', rom_compare_command('rom/rom.npz'), 1, ['rom-val', 'fom-val'],
+              ['input', 'rom', 'rom-results', 'fom-results'], 'compare')]
+
+
+def pipelined_stages(groups=3, train_inst=30, train_param_nb=120, val_inst=25, val_param_nb=50, rb_size=50,
+                     queue=True):
+    '''Pipelined DAG: the train instances are split into groups tasks. Each train
+    instance compresses its own snapshots (hapod.py compress), and rom-build-k
+    merges the local bases of group k into the scaled modes of rom-build-(k-1),
+    so the reduced basis is updated as soon as each group is done. rom-val-k
+    validates version k of the ROM while the next groups are still training,
+    into a rom-results-k bucket of its own so that the versions do not overwrite
+    each other, and only the last version goes through rom-compare.
+
+    Task dependencies are between whole tasks, not instances: rather than a
+    rom-build step per train instance, the instances are grouped in tasks, and
+    groups sets the trade-off between how early the first ROM is available and
+    the number of merge steps and task startups.
+
+    With queue, the instances of each train task
+    and of fom-val share their parameters through a work queue, otherwise every train
+    instance solves its own shard of the training sample, numbered across the groups'''
+    val_params = validation_params(val_param_nb)
+    stages = [Stage('fom-val', f"{val_params} && {fom_command('-i param.pkl', 'val/u', val_inst, queue)}",
+                    val_inst, resources=['input'], results='fom-results', whitelist=r'_c.h5', queue=queue)]
+    sizes = [len(share) for share in np.array_split(np.arange(train_inst), groups)]
+    for k, size in enumerate(sizes):
+        if queue:
+            # The queue of group k holds its shard of the whole training sample
+            command = (f'{train_sample(train_param_nb * train_inst, groups, k)} && '
+                       + train_command('-i param.pkl', f'train/u{k}_', f'train/b{k}_', queue))
+        else:
+            shard = f'--instances {train_inst} --instance-id $(({sum(sizes[:k])} + INSTANCE_ID))'
+            command = train_command(f'-n {train_param_nb * train_inst} {shard}', f'train/u{k}_', f'train/b{k}_')
+        stages.append(Stage(f'train-{k}', command,
+                            size, resources=['input'], results='fom-results', whitelist=rf'b{k}_\d+\.h5$',
+                            queue=queue))
+        previous = f'rom/scaled{k - 1}.h5 ' if k else ''
+        stages.append(Stage(f'rom-build-{k}',
+                            f"python3 hapod.py merge {MESH} {previous}train/b{k}_*.h5 -m {rb_size} "
+                            f"--scaled-output rom/scaled{k}.h5 -o rom/basis{k}.h5 && "
+                            f"python3 rom_artifact.py {MESH} rom/basis{k}.h5 -o rom/rom{k}.npz",
+                            1, [f'train-{k}'] + ([f'rom-build-{k - 1}'] if k else []),
+                            ['fom-results', 'input', 'rom'], 'rom'))
+        stages.append(Stage(f'rom-val-{k}', rom_val_command(f'rom/rom{k}.npz', val_params), 1,
+                            [f'rom-build-{k}'], ['input', 'rom'], f'rom-results-{k}'))
+    last = len(sizes) - 1
+    stages.append(Stage('rom-compare', rom_compare_command(f'rom/rom{last}.npz'), 1, [f'rom-val-{last}', 'fom-val'],
+                        ['input', 'rom', f'rom-results-{last}', 'fom-results'], 'compare'))
+    return stages
+
+
+def print_dag(stages):
+    for stage in stages:
+        upstreams = ', '.join(stage.upstreams) or '-'
+        print(f'{stage.name:<14} x{stage.instances:<3} after {upstreams}')
+
+
+def critical_path(stages, durations):
+    '''Earliest end time of the DAG when every stage starts as soon as its upstreams
+    are done, given durations by stage name. Returns the end time and the critical path'''
+    end, previous = {}, {}
+    for stage in stages:  # stages are in topological order
+        start = max((end[u] for u in stage.upstreams), default=0.)
+        previous[stage.name] = max(stage.upstreams, key=end.get, default=None)
+        end[stage.name] = start + durations[stage.name]
+    name = max(end, key=end.get)
+    path = []
+    while name is not None:
+        path.append(name)
+        name = previous[name]
+    return max(end.values()), path[::-1]
+
+
+def model_durations(stages, train_time=600., sigma=0.3, pod_time=900., compress_time=60., merge_time=60.,
+                    val_time=300., rom_time=60., startup=90., seed=0):
+    '''Modelled stage durations: each train and fom-val instance takes a random,
+    log-normal, time; a task lasts as long as its slowest instance. The POD of all
+    the snapshots in rom-build takes pod_time; in the pipeline, each train instance
+    spends compress_time on its local POD and each rom-build-k merge_time on merging
+    the local bases. Every task pays startup seconds of scheduling and image pull'''
+    rng = np.random.default_rng(seed)
+    durations = {}
+    for stage in stages:
+        if stage.name == 'train':
+            work = rng.lognormal(np.log(train_time), sigma, stage.instances).max()
+        elif stage.name.startswith('train-'):
+            work = rng.lognormal(np.log(train_time), sigma, stage.instances).max() + compress_time
+        elif stage.name == 'fom-val':
+            work = rng.lognormal(np.log(val_time), sigma, stage.instances).max()
+        elif stage.name == 'rom-build':
+            work = pod_time + rom_time
+        elif stage.name.startswith('rom-build-'):
+            work = merge_time + rom_time
+        else:
+            work = rom_time
+        durations[stage.name] = startup + work
+    return durations
+
+
+def submit(conn, job, stages, profile='docker-batch'):
+    '''Create and submit the tasks of stages in job, which must use dependencies.
+    profile is None if the job runs on a pool, see pool_runner.PoolRunner.
+    Returns the tasks by stage name and the (task, upstream tasks) dependencies.
+    The lease buckets of the stages with a work queue are in the leases attribute of
+    the tasks, see delete_leases'''
+    buckets = {}
+    tasks = {}
+    dependencies = []
+    for stage in stages:
+        task = conn.create_task(stage.name, profile, stage.instances, job=job)
+        if profile is not None:
+            task.constants['DOCKER_REPO'] = DOCKER_REPO
+            task.constants['DOCKER_TAG'] = DOCKER_TAG
+        task.constants['DOCKER_CMD'] = f"'{stage.command}'"
+        for key, value in stage.constants.items():
+            task.constants[key] = value
+        for name in stage.resources:
+            task.resources.append(buckets.setdefault(name, conn.create_bucket(name)))
+        if stage.results:
+            task.results = buckets.setdefault(stage.results, conn.create_bucket(stage.results))
+        if stage.whitelist:
+            task.results_whitelist = stage.whitelist
+        task.leases = use_work_queue(conn, job, task) if stage.queue else None
+        upstreams = [tasks[name] for name in stage.upstreams]
+        if upstreams:
+            task.set_task_dependencies_from_tasks(upstreams)
+            dependencies.append((task, upstreams))
+        task.submit()
+        tasks[stage.name] = task
+    return tasks, dependencies
+
+
+def delete_leases(tasks):
+    '''Delete the lease buckets of the finished tasks made by submit'''
+    for task in tasks:
+        if task.leases is not None:
+            task.leases.delete()
+
+
+def _seconds(duration):
+    '''Seconds of a task duration string, e.g. '01:02:03', or '1.01:02:03' with days'''
+    days = 0
+    if '.' in duration.split(':')[0]:
+        days, duration = duration.split('.', 1)
+    hours, minutes, seconds = (float(x) for x in duration.split(':'))
+    return int(days) * 86400 + hours * 3600 + minutes * 60 + seconds
+
+
+def report(stages, tasks):
+    '''Print when every stage was queued, started and ended relative to the first
+    submission, and the measured critical path'''
+    origin = min(task.creation_date for task in tasks.values())
+    print(f'{"stage":<14} {"queued":>8} {"started":>8} {"ended":>8} {"wall":>8} {"cpu":>9}')
+    durations = {}
+    for stage in stages:
+        task = tasks[stage.name]
+        wall = _seconds(task.wall_time)
+        ended = (task.end_date - origin).total_seconds()
+        started = ended - wall
+        queued = (task.creation_date - origin).total_seconds()
+        # Time from the end of its last upstream, which is what the critical path is made of
+        ready = max((durations[u][0] for u in stage.upstreams), default=queued)
+        durations[stage.name] = (ended, ended - ready)
+        print(f'{stage.name:<14} {queued:7.0f}s {started:7.0f}s {ended:7.0f}s {wall:7.0f}s '
+              f'{_seconds(task.execution_time):8.0f}s')
+    total, path = critical_path(stages, {name: d for name, (_, d) in durations.items()})
+    print(f'end to end {total:.0f}s, critical path: {" -> ".join(path)}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pipelined ROM workflow: the reduced basis is updated '
+                                                 'as each group of train instances finishes')
+    parser.add_argument('-g', '--groups', type=int, default=3, help='number of train tasks')
+    parser.add_argument('--submit', action='store_true', help='submit the pipeline, otherwise only print '
+                                                              'the DAG and compare modelled critical paths')
+    parser.add_argument('--barrier', action='store_true', help='submit the barrier DAG of run.py instead')
+    parser.add_argument('--pool', type=int, default=0, help='run all the stages on an elastic pool of at most '
+                                                            'this many slots, instead of one cold task each')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    pipelined = pipelined_stages(args.groups)
+    barrier = barrier_stages()
+    if not args.submit:
+        print_dag(pipelined)
+        for name, stages in (('barrier', barrier), ('pipelined', pipelined)):
+            total, path = critical_path(stages, model_durations(stages, seed=args.seed))
+            print(f'{name:<9} critical path {total:6.0f}s: {" -> ".join(path)}')
+        sys.exit()
+
+    import qarnot
+    from pool_runner import PoolRunner, elastic_scaling, task_timing, print_timings
+    from run import wait_loop
+    conn = qarnot.Connection('qarnot.conf')
+    upload_input(conn.create_bucket('input'))
+    stages = barrier if args.barrier else pipelined
+    print_dag(stages)
+    start = datetime.now()
+    if args.pool:
+        with PoolRunner(conn, 'rom-pool', constants={'DOCKER_REPO': DOCKER_REPO, 'DOCKER_TAG': DOCKER_TAG},
+                        scaling=elastic_scaling(max_slots=args.pool), use_dependencies=True) as runner:
+            tasks, dependencies = submit(conn, runner.job, stages, profile=None)
+            wait_loop(conn, list(tasks.values()), dependencies, job=runner.job)
+            delete_leases(tasks.values())
+    else:
+        job = conn.create_job('rom-job', useDependencies=True)
+        job.submit()
+        tasks, dependencies = submit(conn, job, stages)
+        wait_loop(conn, list(tasks.values()), dependencies, job=job)
+        delete_leases(tasks.values())
+    print(f'\ndone in {timedelta(seconds=round((datetime.now() - start).total_seconds()))}')
+    report(stages, tasks)
+    print()
+    print_timings([task_timing(tasks[stage.name]) for stage in stages])
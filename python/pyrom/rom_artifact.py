@@ -0,0 +1,81 @@
+import argparse
+
+import numpy as np
+
+from batch_rom import BatchROM, coefficient_expression
+
+
+'''Lightweight export of a reduced model: the affine reduced matrices, the expressions
+of their coefficients, the time stepping scheme and settings and optionally the reduced
+basis, in one compressed .npz file. load() only needs numpy, not pymor nor FEniCS'''
+FORMAT_VERSION = 1
+
+
+def save(filename, rom, basis=None, columns=None):
+    '''Write rom (reduced pymor model) to filename, with the reduced basis (VectorArray
+    or numpy array) if given, to reconstruct full order solutions, and the columns of
+    its values in the snapshot stores of the FOM if they are permuted (see
+    model.dof_columns), to compare them'''
+    batch = BatchROM.from_rom(rom)
+    arrays = {'version': FORMAT_VERSION,
+              'mass': batch.mass,
+              'operator': batch.operator,
+              'rhs': batch.rhs,
+              'initial_data': batch.initial_data,
+              'T': batch.T,
+              'nt': batch.nt,
+              'time_stepper': batch.time_stepper,
+              'num_values': batch.num_values or 0,
+              'parameters': np.array([f'{key}:{size}' for key, size in rom.parameters.items()])}
+    for name in ('mass', 'operator', 'rhs'):
+        arrays[f'{name}_coefficients'] = np.array([coefficient_expression(c)
+                                                   for c in getattr(batch, f'{name}_coefficients')])
+    if basis is not None:
+        arrays['basis'] = basis if isinstance(basis, np.ndarray) else basis.to_numpy()
+    if columns is not None:
+        arrays['columns'] = columns
+    np.savez_compressed(filename, **arrays)
+
+
+def load(filename):
+    '''Return the BatchROM stored in filename, the reduced basis (or None), and the
+    dict of parameter names and sizes'''
+    with np.load(filename) as f:
+        if int(f['version']) != FORMAT_VERSION:
+            raise ValueError(f'{filename}: unsupported ROM format version {int(f["version"])}')
+        rom = BatchROM(f['mass'], list(f['mass_coefficients']),
+                       f['operator'], list(f['operator_coefficients']),
+                       f['rhs'], list(f['rhs_coefficients']),
+                       f['initial_data'], float(f['T']), int(f['nt']), int(f['num_values']) or None,
+                       # Files written before the scheme was stored are implicit Euler
+                       str(f['time_stepper']) if 'time_stepper' in f else 'implicit_euler')
+        basis = f['basis'] if 'basis' in f else None
+        parameters = {key: int(size) for key, size in (p.split(':') for p in f['parameters'])}
+    return rom, basis, parameters
+
+
+def snapshot_columns(filename):
+    '''Columns saved with the ROM of filename, or None'''
+    with np.load(filename) as f:
+        return f['columns'] if 'columns' in f else None
+
+
+def reconstruct(coefficients, basis):
+    '''Full order solutions, as numpy arrays, from reduced coefficients (..., dim of the basis)'''
+    return coefficients @ basis
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the ROM of a reduced basis and export it')
+    parser.add_argument('mesh', help='mesh filename')
+    parser.add_argument('basis', help='reduced basis file, see model.dump_sol_list')
+    parser.add_argument('-o', default='rom/rom.npz', help='output file of the ROM')
+    parser.add_argument('--no-basis', action='store_true', help='do not store the basis in the ROM file')
+    args = parser.parse_args()
+
+    import pymor.basic as pmb
+    from model import make_fom, load_sol_list, dof_columns
+    fom = make_fom(args.mesh)
+    basis = load_sol_list(args.basis, fom.solution_space)
+    rom = pmb.InstationaryRBReductor(fom, RB=basis, product=fom.h1_0_semi_product).reduce()
+    save(args.o, rom, None if args.no_basis else basis, dof_columns(fom.solution_space.V))
@@ -0,0 +1,98 @@
+'''Validation of a ROM exported by rom_artifact, run by the rom-val and rom-compare
+stages: solve computes the reduced solutions of the validation parameters, compare
+reconstructs them and measures their error against the FOM snapshots of fom-val,
+matched by parameter id and time. Neither needs FEniCS'''
+import argparse
+import glob
+import os
+import pickle
+import time
+
+import numpy as np
+
+import rom_artifact
+from snapshot_store import SnapshotStore
+
+
+def solve(rom_file, mus, output):
+    '''Solve the ROM of rom_file for every parameter of mus and write the reduced
+    coefficients, of shape (len(mus), number of times, dim), their times and the
+    solve time to output (.npz). Returns the solve time'''
+    rom, _, _ = rom_artifact.load(rom_file)
+    start = time.perf_counter()
+    coefficients = rom.solve(mus)
+    elapsed = time.perf_counter() - start
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    np.savez_compressed(output, coefficients=coefficients, times=np.linspace(0., rom.T, coefficients.shape[1]),
+                        solve_time=elapsed)
+    return elapsed
+
+
+def compare(rom_file, coefficients_file, filenames):
+    '''Errors of the reduced solutions of coefficients_file (see solve), reconstructed
+    with the basis of rom_file, against the FOM trajectories stored in filenames
+    (see snapshot_store), in the euclidean norm of the dofs. Returns a dict mapping
+    each parameter id to the largest error over time relative to the largest norm of
+    the FOM solution, and the error of the whole trajectory relative to its norm'''
+    _, basis, _ = rom_artifact.load(rom_file)
+    if basis is None:
+        raise ValueError(f'{rom_file} has no reduced basis, see rom_artifact.py --no-basis')
+    columns = rom_artifact.snapshot_columns(rom_file)
+    with np.load(coefficients_file) as f:
+        coefficients, times = f['coefficients'], f['times']
+    errors = {}
+    for filename in filenames:
+        with SnapshotStore(filename) as store:
+            if store.permuted and columns is None:
+                raise ValueError(f'{filename} was written with permuted columns, which {rom_file} does not have')
+            for index in np.unique(store.mu_index):
+                rows = store.trajectory_rows(index)
+                param_id = int(store.param_id[rows[0]])
+                if param_id < 0:
+                    raise ValueError(f'{filename}: trajectory {index} has no parameter id')
+                steps = np.abs(store.time[rows][:, np.newaxis] - times).argmin(axis=1)
+                if not np.allclose(times[steps], store.time[rows]):
+                    raise ValueError(f'{filename}: times of trajectory {index} not computed by the ROM')
+                U = store.read(rows)
+                if store.permuted:
+                    U = U[:, columns]
+                error = U - rom_artifact.reconstruct(coefficients[param_id, steps], basis)
+                errors[param_id] = (np.linalg.norm(error, axis=1).max() / np.linalg.norm(U, axis=1).max(),
+                                    np.linalg.norm(error) / np.linalg.norm(U))
+    return errors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solve the validation parameters with an exported ROM, '
+                                                 'or compare its solutions to the FOM ones')
+    subparsers = parser.add_subparsers(dest='step', required=True)
+    solve_parser = subparsers.add_parser('solve', help='solve the ROM for a parameter list')
+    solve_parser.add_argument('rom', help='ROM file, see rom_artifact')
+    solve_parser.add_argument('-i', default='param.pkl', help='pickled parameter list')
+    solve_parser.add_argument('-o', default='rom-val/coefficients.npz', help='output file of the coefficients')
+    compare_parser = subparsers.add_parser('compare', help='errors of the ROM solutions against the FOM ones')
+    compare_parser.add_argument('rom', help='ROM file, with its reduced basis')
+    compare_parser.add_argument('coefficients', help='reduced coefficients written by solve')
+    compare_parser.add_argument('inputs', nargs='+', help='FOM snapshots files, or glob patterns')
+    compare_parser.add_argument('-o', default='compare/errors.csv', help='output file of the errors by parameter')
+    args = parser.parse_args()
+
+    if args.step == 'solve':
+        with open(args.i, 'rb') as f:
+            mus = pickle.load(f)
+        elapsed = solve(args.rom, mus, args.o)
+        print(f'{len(mus)} ROM solves in {elapsed:.3f}s')
+    else:
+        filenames = sorted(f for pattern in args.inputs for f in glob.glob(pattern))
+        if not filenames:
+            parser.error(f'no file matches {" ".join(args.inputs)}')
+        errors = compare(args.rom, args.coefficients, filenames)
+        os.makedirs(os.path.dirname(args.o) or '.', exist_ok=True)
+        with open(args.o, 'w') as f:
+            f.write('param_id,max_error,l2_error\n')
+            for param_id, (max_error, l2_error) in sorted(errors.items()):
+                f.write(f'{param_id},{max_error:.6e},{l2_error:.6e}\n')
+        worst = max(errors, key=lambda param_id: errors[param_id][0])
+        l2_errors = [l2_error for _, l2_error in errors.values()]
+        print(f'{len(errors)} trajectories from {len(filenames)} files: largest error {errors[worst][0]:.3e} '
+              f'(parameter {worst}), mean l2 error {np.mean(l2_errors):.3e}')
@@ -1,112 +1,66 @@
+import os
+import sys
 from datetime import datetime
 import qarnot
-from time import sleep
 
-def wait_loop(task_list):
-    '''Wait loop that wait for every tasks in task_list to be finished'''
-    finished = [False for t in task_list]
-    while finished.count(True) < len(finished):
-        for i, t in enumerate(task_list):
-            if not finished[i] and t.wait(0.1):
-                finished[i] = True
-                print(f'task {t.name} finished with state {t.state}.  {finished.count(True)}/{len(finished)}')
-                if t.state != 'Success':
-                    raise RuntimeError(f'task {t.name} failed: {t.errors}.\n' + 
-                                       'See https://console.qarnot.com/app/tasks for more info')
-        sleep(1)
-    pass
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from task_waiter import TaskWaiter
+from pool_runner import PoolRunner, elastic_scaling, print_timings, task_timing
+from pipeline import DOCKER_REPO, DOCKER_TAG, barrier_stages, delete_leases, report, submit, upload_input
+
+
+def wait_loop(conn, task_list, dependencies=None, job=None):
+    '''Wait loop that wait for every tasks in task_list to be finished, polling the
+    tasks of job at once if given. Raises task_waiter.TaskFailedError on the first
+    task that does not succeed, after aborting the tasks depending on it'''
+    def on_finished(t):
+        print(f'task {t.name} finished with state {waiter.states[t.uuid]}.  '
+              f'{len(waiter.finished)}/{len(task_list)}')
+
+    waiter = TaskWaiter(conn, task_list, on_finished=on_finished, dependencies=dependencies, job=job)
+    waiter.wait()
 
 
 if __name__=='__main__':
     conn = qarnot.Connection('qarnot.conf')
-    job = conn.create_job('rom-job', useDependencies=True)
-    job.submit()
-    
-    DOCKER_REPO = 'qarnotlab/pymor_fenics'
-    DOCKER_TAG = '2020.2.0_2019.1.0'
-    
+
     TRAIN_PARAM_NB = 120
     TRAIN_INST = 30
     VAL_PARAM_NB = 50
     VAL_INST = 25
     RB_SIZE = 50
-    
-    input_bucket = conn.create_bucket('input')
-    input_bucket.sync_directory('input')
-    fom_res_bucket = conn.create_bucket('fom-results')
-    rom_bucket = conn.create_bucket('rom')
-    rom_res_bucket = conn.create_bucket('rom-results')
-    param_bucket = conn.create_bucket('param')
-    rom_compare_bucket = conn.create_bucket('compare')
+    # Instances pull the parameters from a work queue instead of solving a fixed share
+    WORK_QUEUE = True
+    # Run every task on an elastic pool of at most this many slots, already up with the
+    # image pulled (see pool_runner), instead of one cold task each. 0 for no pool
+    POOL_SLOTS = 0
+
+    # Only the files of ./input and the task modules that changed since the last run are sent
+    upload_input(conn.create_bucket('input'))
+    # The DAG is the one of pipeline.py --barrier
+    stages = barrier_stages(train_inst=TRAIN_INST, train_param_nb=TRAIN_PARAM_NB, val_inst=VAL_INST,
+                            val_param_nb=VAL_PARAM_NB, rb_size=RB_SIZE, queue=WORK_QUEUE)
+
+    pool = None
+    if POOL_SLOTS:
+        pool = PoolRunner(conn, 'rom-pool', constants={'DOCKER_REPO': DOCKER_REPO, 'DOCKER_TAG': DOCKER_TAG},
+                          scaling=elastic_scaling(max_slots=POOL_SLOTS), use_dependencies=True).start()
+        job, profile = pool.job, None
+    else:
+        job, profile = conn.create_job('rom-job', useDependencies=True), 'docker-batch'
+        job.submit()
 
-    train_task = conn.create_task('train', 'docker-batch', TRAIN_INST, job=job)
-    train_task.constants['DOCKER_REPO'] = DOCKER_REPO
-    train_task.constants['DOCKER_TAG'] = DOCKER_TAG
-    # h5repack compresse the solution files to quicken data exchanges
-    train_task.constants['DOCKER_CMD'] = f"'python3 main.py -n {TRAIN_PARAM_NB} -o train/u &&" + \
-                                    "h5repack -f GZIP=1 train/u${INSTANCE_ID}.h5 train/u${INSTANCE_ID}_c.h5'"
-    train_task.resources.append(input_bucket)
-    train_task.results = fom_res_bucket
-    train_task.results_whitelist = r'_c.h5'
-    
-    rom_task = conn.create_task('rom-build', 'docker-batch', 1, job=job)
-    rom_task.constants['DOCKER_REPO'] = DOCKER_REPO
-    rom_task.constants['DOCKER_TAG'] = DOCKER_TAG
-    rom_task.constants['DOCKER_CMD'] = f"'python3 rombuild.py -n {TRAIN_INST} -m {RB_SIZE} -i train'"
-    rom_task.resources.append(fom_res_bucket)
-    rom_task.resources.append(input_bucket)
-    rom_task.results = rom_bucket
-    
-    write_param_task = conn.create_task('write-param', 'docker-batch', 1, job=job)
-    write_param_task.constants['DOCKER_REPO'] = DOCKER_REPO
-    write_param_task.constants['DOCKER_TAG'] = DOCKER_TAG
-    write_param_task.constants['DOCKER_CMD'] = f"'python3 writeparam.py {VAL_PARAM_NB}'"
-    write_param_task.resources.append(input_bucket)
-    write_param_task.results = param_bucket
-    
-    fom_val_task = conn.create_task('fom-val', 'docker-batch', VAL_INST, job=job)
-    fom_val_task.constants['DOCKER_REPO'] = DOCKER_REPO
-    fom_val_task.constants['DOCKER_TAG'] = DOCKER_TAG
-    fom_val_task.constants['DOCKER_CMD'] = "'python3 main.py -i param.pkl -o val/u &&" + \
-                                    "h5repack -f GZIP=1 val/u${INSTANCE_ID}.h5 val/u${INSTANCE_ID}_c.h5'"
-    fom_val_task.resources.append(input_bucket)
-    fom_val_task.resources.append(param_bucket)
-    fom_val_task.results = fom_res_bucket
-    fom_val_task.results_whitelist = r'_c.h5'
-    
-    rom_val_task = conn.create_task('rom-val', 'docker-batch', 1, job=job)
-    rom_val_task.constants['DOCKER_REPO'] = DOCKER_REPO
-    rom_val_task.constants['DOCKER_TAG'] = DOCKER_TAG
-    rom_val_task.constants['DOCKER_CMD'] = "'python3 romsolve.py -i param.pkl'"
-    rom_val_task.resources.append(input_bucket)
-    rom_val_task.resources.append(rom_bucket)
-    rom_val_task.resources.append(param_bucket)
-    rom_val_task.results = rom_res_bucket
-    
-    rom_compare_task = conn.create_task('rom-compare', 'docker-batch', 1, job=job)
-    rom_compare_task.constants['DOCKER_REPO'] = DOCKER_REPO
-    rom_compare_task.constants['DOCKER_TAG'] = DOCKER_TAG
-    rom_compare_task.constants['DOCKER_CMD'] = "'python3 romcompare.py -i val'"
-    rom_compare_task.resources.append(input_bucket)
-    rom_compare_task.resources.append(rom_bucket)
-    rom_compare_task.resources.append(rom_res_bucket)
-    rom_compare_task.resources.append(fom_res_bucket)
-    rom_compare_task.results = rom_compare_bucket
-    
-    train_task.submit()
-    write_param_task.submit()
-    rom_task.set_task_dependencies_from_tasks([train_task])
-    rom_task.submit()
-    fom_val_task.set_task_dependencies_from_tasks([write_param_task])
-    fom_val_task.submit()
-    rom_val_task.set_task_dependencies_from_tasks([write_param_task, rom_task])
-    rom_val_task.submit()
-    rom_compare_task.set_task_dependencies_from_tasks([rom_val_task, fom_val_task])
-    rom_compare_task.submit()
+    try:
+        tasks, dependencies = submit(conn, job, stages, profile)
+        print('waiting for tasks to finish...')
+        wait_loop(conn, list(tasks.values()), dependencies, job=job)
+    finally:
+        if pool is not None:
+            pool.close()
+    delete_leases(tasks.values())
+    train_task, rom_task = tasks['train'], tasks['rom-build']
+    fom_val_task, rom_val_task = tasks['fom-val'], tasks['rom-val']
 
-    print('waiting for tasks to finish...')
-    wait_loop([train_task, write_param_task, rom_task, fom_val_task, rom_val_task, rom_compare_task])
-    
     print('\n\n********  Time results ********')
     print(f'Training time: {train_task.execution_time}. Done in {train_task.wall_time} thanks to parallelization')
     print(f'ROM building time: {rom_task.execution_time}')
@@ -117,7 +71,12 @@ if __name__=='__main__':
     fom_sec = datetime.strptime(fom_val_task.execution_time, "%H:%M:%S")
     fom_sec = (fom_sec - datetime(1900, 1, 1)).seconds
     print(f'ROM is {fom_sec//rom_sec} times quicker')
+    # Where the time went, e.g. to compare runs with and without POOL_SLOTS
+    print()
+    report(stages, tasks)
+    print()
+    print_timings([task_timing(tasks[stage.name]) for stage in stages])
 
     print('\n\n********  ROM precision ********')
     print('see output of task rom-compare in console: https://console.qarnot.com/app/tasks')
-    print('bucket compare contains graph of errors')
+    print('bucket compare contains the errors by validation parameter in errors.csv')
@@ -0,0 +1,159 @@
+import argparse
+import os
+import pickle
+
+import numpy as np
+
+
+# Primitive polynomials (degree s, coefficients a) and initial direction numbers m of the
+# Sobol sequence in dimensions 2 to 10, from Joe and Kuo (new-joe-kuo-6.21201)
+SOBOL_TABLE = [(1, 0, (1,)),
+               (2, 1, (1, 3)),
+               (3, 1, (1, 3, 1)),
+               (3, 2, (1, 1, 1)),
+               (4, 1, (1, 1, 3, 3)),
+               (4, 4, (1, 3, 5, 13)),
+               (5, 2, (1, 1, 5, 5, 17)),
+               (5, 4, (1, 1, 5, 5, 5)),
+               (5, 7, (1, 1, 7, 11, 19))]
+SOBOL_BITS = 30
+
+# Parameters sampled uniformly in log scale, their range spanning orders of magnitude
+LOG_SCALE_PREFIXES = ('capa_',)
+
+
+def sobol_directions(dim):
+    '''Direction numbers (dim, SOBOL_BITS) of the first dim dimensions'''
+    if dim > len(SOBOL_TABLE) + 1:
+        raise ValueError(f'Sobol sequence only defined up to {len(SOBOL_TABLE) + 1} dimensions')
+    V = np.zeros((dim, SOBOL_BITS), dtype=np.int64)
+    V[0] = 1 << np.arange(SOBOL_BITS - 1, -1, -1)
+    for d in range(1, dim):
+        s, a, m = SOBOL_TABLE[d - 1]
+        m = list(m)
+        for j in range(s, SOBOL_BITS):
+            value = m[j - s] ^ (m[j - s] << s)
+            for k in range(1, s):
+                if (a >> (s - 1 - k)) & 1:
+                    value ^= m[j - k] << k
+            m.append(value)
+        V[d] = [m[j] << (SOBOL_BITS - 1 - j) for j in range(SOBOL_BITS)]
+    return V
+
+
+def sobol(indices, dim, seed=0):
+    '''Points of the Sobol sequence of the given indices in [0, 1)^dim, in Gray code
+    order. Any range of the sequence is computed on its own, without the points before.
+    The sequence is scrambled by a random digital shift drawn from seed, which keeps
+    its equidistribution'''
+    indices = np.asarray(indices, dtype=np.int64)
+    gray = indices ^ (indices >> 1)
+    V = sobol_directions(dim)
+    X = np.zeros((len(indices), dim), dtype=np.int64)
+    for j in range(SOBOL_BITS):
+        X ^= ((gray >> j) & 1)[:, None] * V[:, j]
+    X ^= np.random.default_rng(seed).integers(0, 1 << SOBOL_BITS, dim)
+    return X / float(1 << SOBOL_BITS)
+
+
+def latin_hypercube(n, dim, seed=0):
+    '''n points in [0, 1)^dim, exactly one in each of the n slices of every dimension'''
+    rng = np.random.default_rng(seed)
+    strata = np.array([rng.permutation(n) for _ in range(dim)]).T
+    return (strata + rng.random((n, dim))) / n
+
+
+def unit_sample(n, dim, method='sobol', seed=0, indices=None):
+    '''Points indices (default all) of a sample of n points in [0, 1)^dim, the same for
+    the same (n, method, seed): method is 'sobol', 'lhs' (latin hypercube) or 'random'.
+    Prefer sizes of powers of 2 with Sobol, whose points are best spread by blocks of 2**k'''
+    indices = np.arange(n) if indices is None else np.asarray(indices)
+    if method == 'sobol':
+        return sobol(indices, dim, seed)
+    if method == 'lhs':
+        return latin_hypercube(n, dim, seed)[indices]
+    if method == 'random':
+        return np.random.default_rng(seed).random((n, dim))[indices]
+    raise ValueError(f'unknown sampling method {method}')
+
+
+def to_parameters(param_space, X):
+    '''Parameter values of the points X of the unit cube, mapped onto the ranges of
+    param_space, in log scale for the names starting with LOG_SCALE_PREFIXES.
+    Parameters are taken in sorted order, one column of X per component'''
+    names = sorted(param_space.parameters)
+    columns = {}
+    start = 0
+    for name in names:
+        size = param_space.parameters[name]
+        low, high = param_space.ranges[name]
+        x = X[:, start:start + size]
+        if name.startswith(LOG_SCALE_PREFIXES):
+            columns[name] = np.exp(np.log(low) + x * (np.log(high) - np.log(low)))
+        else:
+            columns[name] = low + x * (high - low)
+        start += size
+    return [param_space.parameters.parse({name: columns[name][i] for name in names}) for i in range(len(X))]
+
+
+def sample(param_space, n, method='sobol', seed=0, indices=None):
+    '''The parameters indices (default all) of the sample of n parameters of
+    param_space, see unit_sample and to_parameters'''
+    return to_parameters(param_space, unit_sample(n, param_space.parameters.dim, method, seed, indices))
+
+
+def shard_indices(n, instance_id, instance_count):
+    '''Indices of the parameters of instance instance_id among instance_count, as
+    contiguous blocks so that Sobol shards are themselves well spread'''
+    if not 0 <= instance_id < instance_count:
+        raise ValueError(f'instance {instance_id} out of {instance_count}')
+    return np.array_split(np.arange(n), instance_count)[instance_id]
+
+
+def instance_shard(param_space, n, instance_count, method='sobol', seed=0, instance_id=None):
+    '''Shard of this instance of the sample of n parameters: any instance regenerates
+    its own from (seed, instance_id, instance_count), without exchanging files.
+    instance_id defaults to the INSTANCE_ID environment variable of Qarnot tasks.
+    Returns the indices of the parameters in the whole sample and the parameters'''
+    if instance_id is None:
+        instance_id = int(os.environ['INSTANCE_ID'])
+    indices = shard_indices(n, instance_id, instance_count)
+    return indices, sample(param_space, n, method, seed, indices)
+
+
+def add_sampling_arguments(parser, n=120):
+    '''Add the -n, --sampling and --seed options of sample_from_args to parser'''
+    parser.add_argument('-n', type=int, default=n, help='number of parameters')
+    parser.add_argument('--sampling', choices=('sobol', 'lhs', 'random'), default='sobol',
+                        help='sampling of the parameter space, see sampling.unit_sample')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def sample_from_args(param_space, args):
+    '''The sample of the options of add_sampling_arguments. 'random' is the
+    sample_randomly of pymor, as before this module'''
+    if args.sampling == 'random':
+        return param_space.sample_randomly(args.n, seed=args.seed)
+    return sample(param_space, args.n, args.sampling, args.seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write the pickled list of parameters of a sample, or of the '
+                                                 'shard of this instance, e.g. for work_queue.py -i')
+    add_sampling_arguments(parser)
+    parser.add_argument('--instances', type=int, default=None,
+                        help='only write the shard of instance INSTANCE_ID among this many instances')
+    parser.add_argument('--instance-id', type=int, default=None,
+                        help='shard to write instead of the one of INSTANCE_ID, e.g. of a group of tasks')
+    parser.add_argument('-o', default='param.pkl', help='output file')
+    args = parser.parse_args()
+
+    from model import make_param_space
+    param_space = make_param_space()
+    if args.instances:
+        mus = instance_shard(param_space, args.n, args.instances, args.sampling, args.seed, args.instance_id)[1]
+    else:
+        mus = sample_from_args(param_space, args)
+    with open(args.o, 'wb') as f:
+        pickle.dump(mus, f)
+    print(f'{len(mus)} parameters written to {args.o}')
@@ -0,0 +1,214 @@
+import os
+
+import h5py
+import numpy as np
+
+
+# Target size of an HDF5 chunk of the snapshots dataset, in bytes
+CHUNK_BYTES = 1024 * 1024
+
+
+class SnapshotWriter:
+    '''Write snapshots as the rows of a single 2-D dataset /snapshots of an HDF5
+    file, along with, for every row, the index of its parameter (/mu_index), its
+    time (/time) and the id of its parameter in a larger parameter set (/param_id),
+    e.g. when the set is shared out among instances. Parameter values are stored
+    under /parameters/{name}.
+
+    Rows are appended as they are computed, e.g. one trajectory after each FOM
+    solve, and flushed so that the file is readable even if the run stops.
+    The dataset is chunked by a few rows and compressed with compression
+    (None to disable). If compression is None and the total number of rows
+    is given, the dataset is allocated contiguous instead, so that readers
+    can memory-map it (see SnapshotStore.memmap).
+
+    columns, if given, is the column of the file of every value of the rows
+    given to append, e.g. a numbering independent of the MPI partition (see
+    model.dof_columns). The rows of an MPI run are distributed over the
+    processes of comm, each one giving the values of its own columns: they are
+    written collectively with parallel HDF5 if h5py was built with it, and
+    uncompressed since compressed parallel writes need HDF5 >= 1.10.2.
+    Otherwise they are gathered and written by the first process.'''
+    def __init__(self, filename, dim, rows=None, compression='gzip', compression_opts=1, comm=None,
+                 columns=None):
+        self.comm = comm if comm is not None and comm.size > 1 else None
+        if self.comm is not None and columns is None:
+            raise ValueError('the columns of every process are needed to write distributed rows')
+        self.columns = None if columns is None else np.asarray(columns)
+        # h5py only writes increasing column indices
+        self._order = None if columns is None else np.argsort(self.columns)
+        self.parallel = self.comm is not None and h5py.get_config().mpi
+        self.rows = 0
+        self.mus = 0
+        self.file = None
+        if self.parallel:
+            self.file = h5py.File(filename, 'w', driver='mpio', comm=self.comm)
+            compression = None
+        elif self.comm is None or self.comm.rank == 0:
+            self.file = h5py.File(filename, 'w')
+        else:
+            return
+        self.contiguous = compression is None and rows is not None
+        if self.contiguous:
+            self.snapshots = self.file.create_dataset('snapshots', (rows, dim), 'f8')
+        else:
+            chunk_rows = max(1, min(rows or 64, CHUNK_BYTES // (8 * dim)))
+            if compression != 'gzip':
+                compression_opts = None
+            self.snapshots = self.file.create_dataset('snapshots', (0, dim), 'f8', maxshape=(None, dim),
+                                                      chunks=(chunk_rows, dim), compression=compression,
+                                                      compression_opts=compression_opts)
+        self.mu_index = self.file.create_dataset('mu_index', (0,), 'i8', maxshape=(None,), chunks=(1024,))
+        self.time = self.file.create_dataset('time', (0,), 'f8', maxshape=(None,), chunks=(1024,))
+        self.param_id = self.file.create_dataset('param_id', (0,), 'i8', maxshape=(None,), chunks=(1024,))
+        self.parameters = self.file.create_group('parameters')
+        if columns is not None:
+            self.snapshots.attrs['columns'] = 'permuted'
+
+    def _place(self, parts):
+        '''Full rows out of the (columns, values) parts'''
+        U = np.empty((len(parts[0][1]), self.snapshots.shape[1]))
+        for columns, values in parts:
+            U[:, columns] = values
+        return U
+
+    def append(self, U, mu=None, times=None, param_id=-1):
+        '''Append the rows of U (VectorArray or 2-D numpy array). mu, if given, is
+        the parameter of all of them, times their times and param_id its id'''
+        U = U if isinstance(U, np.ndarray) else U.to_numpy()
+        start, stop = self.rows, self.rows + len(U)
+        self.rows = stop
+        if self.comm is not None and not self.parallel:
+            parts = self.comm.gather((self.columns, U), root=0)
+            if self.file is None:
+                return
+            U = self._place(parts)
+        elif self.columns is not None and not self.parallel:
+            U = self._place([(self.columns, U)])
+        if not self.contiguous:
+            self.snapshots.resize(stop, axis=0)
+        elif stop > len(self.snapshots):
+            raise ValueError(f'{stop} rows written to a store allocated for {len(self.snapshots)}')
+        if self.parallel:
+            self.snapshots[start:stop, self.columns[self._order]] = U[:, self._order]
+        else:
+            self.snapshots[start:stop] = U
+        self.mu_index.resize(stop, axis=0)
+        self.time.resize(stop, axis=0)
+        self.param_id.resize(stop, axis=0)
+        self.param_id[start:stop] = param_id
+        self.mu_index[start:stop] = -1 if mu is None else self.mus
+        self.time[start:stop] = np.nan if times is None else times
+        if mu is not None:
+            for key, value in mu.items():
+                value = np.atleast_1d(value)
+                if key not in self.parameters:
+                    self.parameters.create_dataset(key, (0, len(value)), 'f8', maxshape=(None, len(value)))
+                self.parameters[key].resize(self.mus + 1, axis=0)
+                self.parameters[key][self.mus] = value
+            self.mus += 1
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SnapshotStore:
+    '''Read access to a file written by SnapshotWriter. Any subset of rows can be
+    read without loading the others, and uncompressed contiguous stores are
+    memory-mapped instead of read'''
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = h5py.File(filename, 'r')
+        self.snapshots = self.file['snapshots']
+        # Written with SnapshotWriter columns: the values of a space are at its own columns
+        self.permuted = self.snapshots.attrs.get('columns') == 'permuted'
+        self.mu_index = self.file['mu_index'][:]
+        self.time = self.file['time'][:]
+        self.param_id = self.file['param_id'][:] if 'param_id' in self.file else -np.ones_like(self.mu_index)
+        # Rows beyond mu_index were allocated but never written
+        self.rows = len(self.mu_index)
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def dim(self):
+        return self.snapshots.shape[1]
+
+    def memmap(self):
+        '''Return the snapshots as a read-only numpy memmap, or None if the dataset
+        is chunked or compressed'''
+        offset = self.snapshots.id.get_offset()
+        if offset is None or self.snapshots.chunks is not None:
+            return None
+        return np.memmap(self.filename, mode='r', dtype=self.snapshots.dtype,
+                         offset=offset, shape=(self.rows, self.dim))
+
+    def read(self, rows=None):
+        '''Return the rows (slice, or sorted list of indices, default all) as a numpy array'''
+        rows = slice(0, self.rows) if rows is None else rows
+        mapped = self.memmap()
+        if mapped is not None:
+            return np.array(mapped[rows])
+        if isinstance(rows, slice):
+            return self.snapshots[slice(*rows.indices(self.rows))]
+        return self.snapshots[np.asarray(rows)]
+
+    def trajectory_rows(self, index, times=None):
+        '''Indices of the rows of parameter number index, restricted to the given times'''
+        rows = np.flatnonzero(self.mu_index == index)
+        if times is not None:
+            rows = rows[np.isin(self.time[rows], times)]
+        return rows
+
+    def parameters(self):
+        '''Return the stored parameters as a list of dicts, in the order they were written'''
+        group = self.file['parameters']
+        count = min((len(group[key]) for key in group), default=0)
+        return [{key: group[key][i] for key in group} for i in range(count)]
+
+    def to_vector_array(self, space, rows=None, columns=None):
+        '''The rows as a VectorArray of space. columns are the columns of the values of
+        space, as given to SnapshotWriter, needed if the store was written with some'''
+        U = self.read(rows)
+        if self.permuted:
+            if columns is None:
+                raise ValueError(f'{self.filename} was written with permuted columns, give the columns of space')
+            U = U[:, columns]
+        return space.from_numpy(U)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def solve_to_store(fom, mus, filename, compression='gzip', comm=None, columns=None):
+    '''Solve fom for every parameter of mus and write each trajectory to filename
+    as soon as it is computed. comm and columns are given to SnapshotWriter for
+    MPI runs. Values are stamped with fom.solution_times if fom has it (see
+    model.InstationaryParametricMassModel), evenly over [0, fom.T] otherwise.
+    Returns the number of rows written'''
+    if comm is None or comm.rank == 0:
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    if comm is not None:
+        comm.barrier()
+    with SnapshotWriter(filename, fom.solution_space.dim, compression=compression, comm=comm,
+                        columns=columns) as writer:
+        for mu in mus:
+            U = fom.solve(mu)
+            times = fom.solution_times(len(U)) if hasattr(fom, 'solution_times') else np.linspace(0, fom.T, len(U))
+            writer.append(U, mu, times)
+        return writer.rows
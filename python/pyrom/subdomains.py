@@ -0,0 +1,104 @@
+import hashlib
+import os
+
+import dolfin as df
+import h5py
+import numpy as np
+
+
+# Tolerance of the box tests, for numerical precision
+TOL = 1e-7
+
+
+def inside(points, box, tol=TOL):
+    '''Whether each of the points (n, 3) lies in box = (xmin, xmax, ymin, ymax, zmin, zmax)'''
+    box = np.asarray(box, dtype=float)
+    return ((points >= box[0::2] - tol) & (points <= box[1::2] + tol)).all(axis=1)
+
+
+def classify(coordinates, entities, boxes, default=0, tol=TOL):
+    '''Marker of every entity (cells or facets, given by their vertex indices in
+    coordinates): the value of the last of the (value, box) boxes containing its
+    midpoint and all its vertices, the same test as SubDomain.mark, or default'''
+    values = np.full(len(entities), default, dtype=np.uintp)
+    midpoints = coordinates[entities].mean(axis=1)
+    for value, box in boxes:
+        hit = inside(coordinates, box, tol)[entities].all(axis=1) & inside(midpoints, box, tol)
+        values[hit] = value
+    return values
+
+
+def cell_markers(mesh, boxes, default, tol=TOL):
+    '''MeshFunction marking the cells of mesh with classify'''
+    markers = df.MeshFunction('size_t', mesh, mesh.topology().dim())
+    markers.array()[:] = classify(mesh.coordinates(), mesh.cells(), boxes, default, tol)
+    return markers
+
+
+def facet_markers(mesh, boxes, tol=TOL):
+    '''MeshFunction marking the exterior facets of mesh with classify, the other ones with 0'''
+    dim = mesh.topology().dim() - 1
+    mesh.init(dim, 0)
+    facets = mesh.topology()(dim, 0)().reshape(-1, dim + 1)
+    exterior = df.BoundaryMesh(mesh, 'exterior').entity_map(dim).array()
+    markers = df.MeshFunction('size_t', mesh, dim)
+    markers.set_all(0)
+    markers.array()[exterior] = classify(mesh.coordinates(), facets[exterior], boxes, 0, tol)
+    return markers
+
+
+def markers_key(filename, cell_boxes, default, facet_boxes, tol=TOL):
+    '''Hash of everything the markers of the mesh file depend on: its content, as in
+    assembly_cache.cache_key, so that a mesh copied or touched with the same content
+    still matches and a mesh rewritten within the same timestamp does not'''
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    h.update(repr((cell_boxes, default, facet_boxes, tol)).encode())
+    return h.hexdigest()
+
+
+def load_markers(path, key, mesh):
+    '''The cell and facet markers saved in path by save_markers, or None if they
+    are missing or were computed for another key'''
+    if not os.path.exists(path):
+        return None
+    with h5py.File(path, 'r') as f:
+        if f.attrs.get('key') != key:
+            return None
+        markers = df.MeshFunction('size_t', mesh, mesh.topology().dim())
+        markers.array()[:] = f['markers/cells'][:]
+        boundary_markers = df.MeshFunction('size_t', mesh, mesh.topology().dim() - 1)
+        boundary_markers.array()[:] = f['markers/facets'][:]
+    return markers, boundary_markers
+
+
+def save_markers(path, key, markers, boundary_markers):
+    tmp = path + '.tmp'
+    with h5py.File(tmp, 'w') as f:
+        f.attrs['key'] = key
+        f['markers/cells'] = markers.array()
+        f['markers/facets'] = boundary_markers.array()
+    os.replace(tmp, path)
+
+
+def mark(mesh, cell_boxes, default, facet_boxes, filename=None, tol=TOL):
+    '''Cell and facet markers of mesh (see cell_markers and facet_markers).
+    If the mesh was read from filename, they are saved next to it, in
+    {filename}.markers.h5, and reloaded by later calls instead of computed.
+    Under MPI, every process marks its own part of the mesh'''
+    if filename is None or mesh.mpi_comm().size > 1:
+        return cell_markers(mesh, cell_boxes, default, tol), facet_markers(mesh, facet_boxes, tol)
+    path = filename + '.markers.h5'
+    key = markers_key(filename, cell_boxes, default, facet_boxes, tol)
+    loaded = load_markers(path, key, mesh)
+    if loaded is not None:
+        return loaded
+    markers = cell_markers(mesh, cell_boxes, default, tol), facet_markers(mesh, facet_boxes, tol)
+    try:
+        save_markers(path, key, *markers)
+    except OSError:
+        # e.g. read-only input directory: the markers are just computed again next time
+        pass
+    return markers
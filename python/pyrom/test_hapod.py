@@ -0,0 +1,43 @@
+import numpy as np
+
+from hapod import incremental_pod, merge, pod
+
+
+def projection_error(U, basis):
+    '''Relative error of the orthogonal projection of the rows of U on the rows of basis'''
+    error = U - (U @ basis.T) @ basis
+    return np.linalg.norm(error) / np.linalg.norm(U)
+
+
+def snapshots(n=240, dim=400, rank=30, seed=0):
+    '''Rows of decaying energy, like the trajectories of the FOM'''
+    rng = np.random.default_rng(seed)
+    decay = np.exp(-0.3 * np.arange(rank))
+    return (rng.standard_normal((n, rank)) * decay) @ rng.standard_normal((rank, dim))
+
+
+def hapod(U, instances, chunks, modes, l2_err):
+    '''The two levels of hapod.py: each instance compresses its snapshots chunk by
+    chunk, then the local bases are merged'''
+    local = [incremental_pod(np.array_split(part, chunks), None, l2_err, chunks)
+             for part in np.array_split(U, instances)]
+    return merge(local, None, modes, l2_err, instances)
+
+
+def test_hapod_matches_pod():
+    U = snapshots()
+    basis, svals = hapod(U, instances=4, chunks=3, modes=20, l2_err=0.)
+    pod_basis, pod_svals = pod(U, modes=20)
+    assert np.allclose(basis @ basis.T, np.eye(20))
+    assert np.allclose(svals, pod_svals, rtol=1e-6)
+    assert np.isclose(projection_error(U, basis), projection_error(U, pod_basis), rtol=1e-6)
+
+
+def test_hapod_error_within_tolerance():
+    U = snapshots()
+    l2_err = 1e-3 * np.linalg.norm(U)
+    basis, _ = hapod(U, instances=4, chunks=3, modes=None, l2_err=l2_err)
+    pod_basis, _ = pod(U, l2_err=l2_err)
+    # Both levels discard up to l2_err, so the HAPOD needs about as many modes for a slightly larger error
+    assert projection_error(U, basis) <= 2 * l2_err / np.linalg.norm(U)
+    assert len(basis) <= len(pod_basis) + 2
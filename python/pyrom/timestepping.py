@@ -0,0 +1,363 @@
+import math
+
+import dolfin as df
+from pymor.algorithms.timestepping import TimeStepper, implicit_euler
+from pymor.bindings.fenics import FenicsVectorSpace
+
+
+def make_solver(matrix, solver_options):
+    '''Return a Fenics solver bound once and for all to matrix.
+    PETSc only factorizes the matrix, or builds its preconditioner, on the first
+    solve and reuses it as long as the operator does not change.
+
+    solver_options keys:
+        solver: 'lu', or a direct solver like 'mumps', or a Krylov method like 'cg' or 'gmres'
+        preconditioner: for Krylov methods, e.g. 'ilu', 'hypre_amg', 'petsc_amg'
+        relative_tolerance, absolute_tolerance, maximum_iterations: for Krylov methods
+        petsc_options: dict of extra PETSc options without the leading dash,
+            e.g. {'pc_hypre_boomeramg_strong_threshold': 0.5}'''
+    method = solver_options.get('solver', 'lu')
+    if method == 'lu' or method in df.lu_solver_methods():
+        solver = df.PETScLUSolver(df.as_backend_type(matrix), 'default' if method == 'lu' else method)
+    else:
+        solver = df.PETScKrylovSolver(method, solver_options.get('preconditioner', 'default'))
+        solver.set_operator(df.as_backend_type(matrix))
+        # Previous time step is a good initial guess
+        solver.parameters['nonzero_initial_guess'] = True
+        for key in ('relative_tolerance', 'absolute_tolerance', 'maximum_iterations'):
+            if key in solver_options:
+                solver.parameters[key] = solver_options[key]
+    petsc_options = solver_options.get('petsc_options')
+    if petsc_options:
+        prefix = f'fom_{id(solver)}_'
+        for key, value in petsc_options.items():
+            df.PETScOptions.set(prefix + key, value)
+        solver.ksp().setOptionsPrefix(prefix)
+        solver.ksp().setFromOptions()
+        # The solver holds its settings now, don't let the options pile up in the global database
+        for key in petsc_options:
+            df.PETScOptions.clear(prefix + key)
+    return solver
+
+
+class SnapshotSelection:
+    '''The time steps of a trajectory to keep, decided while time stepping so that
+    the others are never stored: the steps of indices (0 being the initial data),
+    every stride-th step, and, if rtol is given, every step whose relative distance
+    to the last kept one exceeds rtol. The times of the steps kept by the last
+    solve are in times'''
+    def __init__(self, indices=(), stride=None, rtol=None):
+        self.indices = set(indices)
+        self.stride = stride
+        self.rtol = rtol
+        self.times = []
+
+    def reset(self):
+        self.times = []
+
+    def keep(self, n, t, change=None):
+        '''Whether to keep step n, at time t. change() returns the relative distance
+        of step n to the last kept one, and is only called for rtol'''
+        kept = (n in self.indices
+                or (self.stride is not None and n % self.stride == 0)
+                or (self.rtol is not None and (not self.times or change() > self.rtol)))
+        if kept:
+            self.times.append(t)
+        return kept
+
+    def select(self, U, initial_time, end_time):
+        '''Keep the selected values of the trajectory U, computed with every time step'''
+        dt = (end_time - initial_time) / (len(U) - 1)
+        kept = []
+        for n in range(len(U)):
+            if self.keep(n, initial_time + n * dt,
+                         lambda: (U[n] - U[kept[-1]]).norm()[0] / max(U[n].norm()[0], 1e-300)):
+                kept.append(n)
+        return U[kept]
+
+
+def add_selection_arguments(parser):
+    '''Command line options of the time steps to keep, see selection_from_args'''
+    parser.add_argument('--times', choices=['all', 'used'], default='all',
+                        help='keep every time step, or only model.used_time()')
+    parser.add_argument('--stride', type=int, help='also keep every stride-th time step')
+    parser.add_argument('--rtol', type=float, help='also keep the steps changing by more than rtol')
+
+
+def selection_from_args(args):
+    '''SnapshotSelection given by the options of add_selection_arguments, None to keep everything'''
+    if args.times == 'all' and args.stride is None and args.rtol is None:
+        return None
+    from model import used_time
+    return SnapshotSelection(used_time() if args.times == 'used' else (), args.stride, args.rtol)
+
+
+class FactorizedImplicitEulerTimeStepper(TimeStepper):
+    '''Implicit Euler time stepper for time independent Fenics operators.
+
+    With a fixed time step, the system matrix M + dt*A(mu) is the same at every
+    step: it is assembled once per solve, and its factorization (solver 'lu') or
+    preconditioner (Krylov solvers) is reused for all the steps instead of being
+    rebuilt by every apply_inverse.
+
+    solver_options are described in make_solver, e.g. {'solver': 'lu'} or
+    {'solver': 'cg', 'preconditioner': 'ilu', 'relative_tolerance': 1e-8}.
+    The number of linear solves and of Krylov iterations are accumulated in stats.
+    Given a SnapshotSelection, solve only stores the time steps it keeps.'''
+    # InstationaryParametricMassModel hands its SnapshotSelection over to solve
+    selects = True
+
+    def __init__(self, nt, solver_options=None):
+        self.nt = nt
+        self.solver_options = solver_options or {'solver': 'lu'}
+        self.stats = {'solves': 0, 'iterations': 0}
+
+    def solve(self, initial_time, end_time, initial_data, operator, rhs=None, mass=None, mu=None,
+              num_values=None, selection=None):
+        space = operator.source
+        if not isinstance(space, FenicsVectorSpace):
+            # A ROM inherits the time stepper of its FOM: its numpy operators have no Fenics
+            # matrix to factorize, solve them with the same scheme from pymor
+            U = implicit_euler(operator, rhs, mass, initial_data, initial_time, end_time, self.nt, mu,
+                               None if selection is not None else num_values)
+            return U if selection is None else selection.select(U, initial_time, end_time)
+        dt = (end_time - initial_time) / self.nt
+        num_values = num_values or self.nt + 1
+        DT = (end_time - initial_time) / (num_values - 1)
+
+        M = mass.assemble(mu).matrix
+        system = (mass + operator * dt).assemble(mu).matrix
+        solver = make_solver(system, self.solver_options)
+        F = None
+        if rhs is not None:
+            F = rhs.as_range_array(mu)._list[0].real_part.impl * dt
+
+        U = initial_data._list[0].real_part.impl.copy()
+        b = U.copy()
+        R = []
+
+        def change():
+            b.zero()
+            b.axpy(1, U)
+            b.axpy(-1, R[-1])
+            return b.norm('l2') / max(U.norm('l2'), 1e-300)
+
+        if selection is None or selection.keep(0, initial_time, change):
+            R.append(U.copy())
+        t = initial_time
+        for n in range(self.nt):
+            t += dt
+            M.mult(U, b)
+            if F is not None:
+                b.axpy(1, F)
+            self.stats['iterations'] += solver.solve(U, b)
+            self.stats['solves'] += 1
+            if selection is not None:
+                if selection.keep(n + 1, t, change):
+                    R.append(U.copy())
+                continue
+            # Same output times as pymor.algorithms.timestepping.implicit_euler
+            while t - initial_time + (min(dt, DT) * 0.5) >= len(R) * DT:
+                R.append(U.copy())
+        return space.make_array(R)
+
+
+class FenicsTimeStepper(TimeStepper):
+    '''Base of the integrators below, for M u' + A(mu) u = F(mu) with time independent
+    Fenics operators. They solve systems (M + h*A(mu)) u = b for a few values of h,
+    each one assembled and factorized (or preconditioned) once per solve, see system.
+
+    Subclasses yield the successive (t, u) from _steps, with steps of their own: the
+    solution is output on nt + 1 evenly spaced times (or num_values) whatever the
+    steps, linearly interpolated between them. A SnapshotSelection keeps some of
+    these output times only, the others are never stored.
+    The numbers of steps, rejected steps, linear solves, Krylov iterations and
+    systems are accumulated in stats.'''
+    selects = True
+
+    def __init__(self, nt, solver_options=None):
+        self.nt = nt
+        self.solver_options = solver_options or {'solver': 'lu'}
+        self.stats = {'steps': 0, 'rejected': 0, 'solves': 0, 'iterations': 0, 'systems': 0}
+
+    def system(self, h):
+        '''Solver of M + h*A(mu), built on first use'''
+        if h not in self._solvers:
+            matrix = (self._mass + self._operator * h).assemble(self._mu).matrix
+            self._solvers[h] = make_solver(matrix, self.solver_options)
+            self.stats['systems'] += 1
+        return self._solvers[h]
+
+    def apply(self, matrix, u):
+        b = u.copy()
+        matrix.mult(u, b)
+        return b
+
+    def solve_system(self, h, b, guess):
+        '''Solution of (M + h*A(mu)) u = b, starting the Krylov solvers from guess'''
+        u = guess.copy()
+        self.stats['iterations'] += self.system(h).solve(u, b)
+        self.stats['solves'] += 1
+        return u
+
+    def solve(self, initial_time, end_time, initial_data, operator, rhs=None, mass=None, mu=None,
+              num_values=None, selection=None):
+        space = operator.source
+        self._mass, self._operator, self._mu = mass, operator, mu
+        self._solvers = {}
+        self._M = mass.assemble(mu).matrix
+        self._A = operator.assemble(mu).matrix
+        self._F = rhs.as_range_array(mu)._list[0].real_part.impl if rhs is not None else None
+        num_values = self.nt + 1 if selection is not None or num_values is None else num_values
+        times = [initial_time + (end_time - initial_time) * k / (num_values - 1) for k in range(num_values)]
+        eps = 1e-9 * (end_time - initial_time)
+        R = []
+        k = 0
+
+        def output(t0, u0, t1, u1):
+            '''Output the times up to t1, interpolated between (t0, u0) and (t1, u1)'''
+            nonlocal k
+            while k < num_values and times[k] <= t1 + eps:
+                theta = (times[k] - t0) / (t1 - t0) if t1 - t0 > eps else 1.
+                u = u1.copy()
+                if theta < 1 - 1e-12:
+                    u *= theta
+                    u.axpy(1 - theta, u0)
+                if selection is None or selection.keep(k, times[k], lambda: _distance(u, R[-1])):
+                    R.append(u)
+                k += 1
+
+        t, u = initial_time, initial_data._list[0].real_part.impl.copy()
+        output(t, u, t, u)
+        for t_next, u_next in self._steps(initial_time, end_time, u):
+            self.stats['steps'] += 1
+            output(t, u, t_next, u_next)
+            t, u = t_next, u_next
+        self._solvers = {}
+        return space.make_array(R)
+
+    def _steps(self, initial_time, end_time, u):
+        raise NotImplementedError
+
+
+def _distance(u, v):
+    '''Relative distance of u to v'''
+    d = u.copy()
+    d.axpy(-1, v)
+    return d.norm('l2') / max(u.norm('l2'), 1e-300)
+
+
+class CrankNicolsonTimeStepper(FenicsTimeStepper):
+    '''Crank-Nicolson (trapezoidal rule), second order, with a fixed number of steps
+    (default nt). Not L-stable: the fast modes of a non smooth initial state are
+    damped slowly with large steps, see BDF2TimeStepper'''
+    def __init__(self, nt, solver_options=None, steps=None):
+        super().__init__(nt, solver_options)
+        self.steps = steps or nt
+
+    def _steps(self, initial_time, end_time, u):
+        dt = (end_time - initial_time) / self.steps
+        for n in range(self.steps):
+            b = self.apply(self._M, u)
+            b.axpy(-dt / 2, self.apply(self._A, u))
+            if self._F is not None:
+                b.axpy(dt, self._F)
+            u = self.solve_system(dt / 2, b, u)
+            yield initial_time + (n + 1) * dt, u
+
+
+class BDF2TimeStepper(FenicsTimeStepper):
+    '''Second order backward differentiation formula, L-stable, with a fixed number
+    of steps (default nt). The first step is an implicit Euler step'''
+    def __init__(self, nt, solver_options=None, steps=None):
+        super().__init__(nt, solver_options)
+        self.steps = steps or nt
+
+    def _steps(self, initial_time, end_time, u):
+        dt = (end_time - initial_time) / self.steps
+        previous = None
+        for n in range(self.steps):
+            if previous is None:
+                # (M + dt*A) u1 = M u0 + dt*F
+                b = self.apply(self._M, u)
+                h = dt
+            else:
+                # (M + 2/3*dt*A) u2 = 4/3 M u1 - 1/3 M u0 + 2/3 dt*F
+                b = self.apply(self._M, u)
+                b *= 4 / 3
+                b.axpy(-1 / 3, self.apply(self._M, previous))
+                h = 2 * dt / 3
+            if self._F is not None:
+                b.axpy(h, self._F)
+            previous, u = u, self.solve_system(h, b, u)
+            yield initial_time + (n + 1) * dt, u
+
+
+class AdaptiveTimeStepper(FenicsTimeStepper):
+    '''Adaptive TR-BDF2 integrator: a trapezoidal stage to t + gamma*dt, then a BDF2
+    stage to t + dt, second order and L-stable. Both stages solve with M + d*dt*A.
+
+    The local error is estimated by the distance to a Crank-Nicolson step from the
+    same state, and kept under rtol relative to the solution. Steps are dt_max / 2**k
+    for k up to levels, so that the few systems of the steps taken are factorized once
+    per solve. dt_max defaults to the span of the solve divided by nt/8. The solve
+    starts with the smallest steps and doubles them at most once per step'''
+    gamma = 2 - 2 ** 0.5
+    d = 1 - 2 ** -0.5
+
+    def __init__(self, nt, solver_options=None, rtol=1e-4, dt_max=None, levels=6, safety=0.9):
+        super().__init__(nt, solver_options)
+        self.rtol = rtol
+        self.dt_max = dt_max
+        self.levels = levels
+        self.safety = safety
+
+    def _trbdf2(self, u, dt):
+        g, d = self.gamma, self.d
+        # (M + d*dt*A) ug = M u - d*dt*A u + gamma*dt*F
+        Mu = self.apply(self._M, u)
+        b = Mu.copy()
+        b.axpy(-d * dt, self.apply(self._A, u))
+        if self._F is not None:
+            b.axpy(g * dt, self._F)
+        ug = self.solve_system(d * dt, b, u)
+        # (M + d*dt*A) u1 = (M ug / gamma - (1 - gamma)**2 / gamma M u + (1 - gamma)*dt*F) / (2 - gamma)
+        b = self.apply(self._M, ug)
+        b *= 1 / (g * (2 - g))
+        b.axpy(-(1 - g) ** 2 / (g * (2 - g)), Mu)
+        if self._F is not None:
+            b.axpy((1 - g) * dt / (2 - g), self._F)
+        return self.solve_system(d * dt, b, ug)
+
+    def _crank_nicolson(self, u, dt):
+        b = self.apply(self._M, u)
+        b.axpy(-dt / 2, self.apply(self._A, u))
+        if self._F is not None:
+            b.axpy(dt, self._F)
+        return self.solve_system(dt / 2, b, u)
+
+    def _steps(self, initial_time, end_time, u):
+        span = end_time - initial_time
+        dt_max = self.dt_max or span * 8 / self.nt
+        level = self.levels
+        t = initial_time
+        while t < end_time - 1e-9 * span:
+            dt = min(dt_max / 2 ** level, end_time - t)
+            u1 = self._trbdf2(u, dt)
+            error = _distance(u1, self._crank_nicolson(u, dt))
+            factor = self.safety * (self.rtol / max(error, 1e-300)) ** (1 / 3)
+            if error > self.rtol and level < self.levels:
+                self.stats['rejected'] += 1
+                level = min(self.levels, level + max(1, math.ceil(-math.log2(factor))))
+                continue
+            t, u = t + dt, u1
+            if factor >= 2 and level > 0:
+                level -= 1
+            yield t, u
+
+
+# Time steppers by name, each called as time_stepper(nt, solver_options=...)
+TIME_STEPPERS = {'implicit_euler': FactorizedImplicitEulerTimeStepper,
+                 'crank_nicolson': CrankNicolsonTimeStepper,
+                 'bdf2': BDF2TimeStepper,
+                 'adaptive': AdaptiveTimeStepper}
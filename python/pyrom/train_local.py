@@ -0,0 +1,92 @@
+import argparse
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from model import make_fom, make_param_space, dump_sol_list
+from sampling import add_sampling_arguments, sample_from_args
+from timestepping import add_selection_arguments, selection_from_args
+
+
+# Full order model of the worker process, built once by _init_worker
+_fom = None
+_build_time = None
+
+
+def _init_worker(filename, selection):
+    global _fom, _build_time
+    start = time.perf_counter()
+    _fom = make_fom(filename, selection=selection)
+    _build_time = time.perf_counter() - start
+
+
+def _solve_chunk(chunk):
+    '''Solve the FOM for every parameter of the chunk. Snapshots are sent back
+    as a numpy array since FEniCS vectors can't cross process boundaries'''
+    index, mus = chunk
+    start = time.perf_counter()
+    snapshots = np.vstack([_fom.solve(mu).to_numpy() for mu in mus])
+    return index, os.getpid(), _build_time, time.perf_counter() - start, len(mus), snapshots
+
+
+def make_pool(filename, processes=None, selection=None):
+    '''Process pool whose workers each build the FOM defined by the mesh filename
+    once, to be given to train when it is called many times, e.g. by the greedy'''
+    return Pool(processes or os.cpu_count(), initializer=_init_worker, initargs=(filename, selection))
+
+
+def train(filename, param_set, space, processes=None, chunks_per_process=4, selection=None, pool=None):
+    '''Solve the FOM defined by the mesh filename for every parameter of param_set
+    on a local process pool, and return the snapshots as one VectorArray of space,
+    in the order of param_set, along with per worker timings.
+
+    Every worker builds the FOM once and then solves chunks of parameters.
+    There are chunks_per_process chunks per worker so that faster workers
+    can take more of them.
+    Timings map worker pids to dicts with keys build, solve and samples.
+    selection (timestepping.SnapshotSelection) restricts the snapshots to some time steps.
+    pool, from make_pool with the same filename, processes and selection, is used
+    instead of a pool of its own, which is closed once done'''
+    processes = processes or os.cpu_count()
+    if pool is None:
+        with make_pool(filename, processes, selection) as pool:
+            return train(filename, param_set, space, processes, chunks_per_process, selection, pool)
+    chunk_count = max(1, min(len(param_set), processes * chunks_per_process))
+    bounds = np.linspace(0, len(param_set), chunk_count + 1).astype(int)
+    chunks = [(i, param_set[bounds[i]:bounds[i + 1]]) for i in range(chunk_count)]
+    results = [None] * chunk_count
+    timings = {}
+    for index, pid, build, solve, samples, snapshots in pool.imap_unordered(_solve_chunk, chunks):
+        results[index] = snapshots
+        timing = timings.setdefault(pid, {'build': build, 'solve': 0., 'samples': 0})
+        timing['solve'] += solve
+        timing['samples'] += samples
+    return space.from_numpy(np.vstack(results)), timings
+
+
+def print_timings(timings):
+    for pid, timing in sorted(timings.items()):
+        print(f'worker {pid}: FOM built in {timing["build"]:.1f}s, '
+              f'{timing["samples"]} solves in {timing["solve"]:.1f}s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solve the FOM for a sample of parameters on a local process pool')
+    parser.add_argument('mesh', help='mesh filename')
+    parser.add_argument('-p', type=int, default=None, help='number of processes, default to the number of cores')
+    parser.add_argument('-o', default='train/u_local.h5', help='output file of the snapshots')
+    add_sampling_arguments(parser)
+    add_selection_arguments(parser)
+    args = parser.parse_args()
+
+    fom = make_fom(args.mesh)
+    param_set = sample_from_args(make_param_space(), args)
+    start = time.perf_counter()
+    U_train, timings = train(args.mesh, param_set, fom.solution_space, args.p,
+                             selection=selection_from_args(args))
+    print(f'{args.n} FOM solves in {time.perf_counter() - start:.1f}s')
+    print_timings(timings)
+    os.makedirs(os.path.dirname(args.o) or '.', exist_ok=True)
+    dump_sol_list(args.o, U_train)
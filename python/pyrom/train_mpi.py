@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import pickle
+import time
+
+from model import make_fom, make_param_space, dof_columns
+from sampling import add_sampling_arguments, sample_from_args, shard_indices
+from snapshot_store import SnapshotWriter
+from timestepping import add_selection_arguments, selection_from_args
+
+
+def train(fom, param_set, filename, compression='gzip', param_ids=None):
+    '''Solve fom for every parameter of param_set with all the MPI processes, the
+    mesh being partitioned among them, and append each trajectory collectively to
+    filename as soon as it is computed (see snapshot_store.SnapshotWriter), tagged
+    with its id in param_ids, e.g. its index in a larger sample.
+    Returns the time spent solving and writing'''
+    V = fom.solution_space.V
+    comm = V.mesh().mpi_comm()
+    if comm.rank == 0:
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    comm.barrier()
+    timings = {'solve': 0., 'write': 0.}
+    param_ids = range(len(param_set)) if param_ids is None else param_ids
+    with SnapshotWriter(filename, fom.solution_space.dim, compression=compression, comm=comm,
+                        columns=dof_columns(V)) as writer:
+        for mu, param_id in zip(param_set, param_ids):
+            start = time.perf_counter()
+            U = fom.solve(mu)
+            comm.barrier()
+            timings['solve'] += time.perf_counter() - start
+            start = time.perf_counter()
+            writer.append(U, mu, fom.solution_times(len(U)), param_id=param_id)
+            comm.barrier()
+            timings['write'] += time.perf_counter() - start
+    return timings
+
+
+if __name__ == '__main__':
+    from bench_solvers import SOLVERS
+
+    parser = argparse.ArgumentParser(description='Solve the FOM for a sample of parameters, with MPI if run '
+                                                 'with e.g. mpirun -n 4 python3 train_mpi.py mesh.xml')
+    parser.add_argument('mesh', help='mesh filename')
+    parser.add_argument('-i', default=None, help='pickled parameter list, or a sample (see sampling) if not given')
+    parser.add_argument('--instances', type=int, default=None,
+                        help='only solve the shard of instance INSTANCE_ID among this many instances')
+    parser.add_argument('--instance-id', type=int, default=None,
+                        help='shard to solve instead of the one of INSTANCE_ID, e.g. of a group of tasks')
+    parser.add_argument('-o', default='train/u_mpi.h5', help='output file of the snapshots')
+    parser.add_argument('-s', '--solver', choices=SOLVERS, default=None,
+                        help='linear solver, see bench_solvers.SOLVERS. Default to model.default_mpi_solver_options')
+    parser.add_argument('--timings', help='json file the timings are written to')
+    add_sampling_arguments(parser, n=10)
+    add_selection_arguments(parser)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    fom = make_fom(args.mesh, SOLVERS.get(args.solver), selection=selection_from_args(args))
+    comm = fom.solution_space.V.mesh().mpi_comm()
+    comm.barrier()
+    build = time.perf_counter() - start
+    if args.i:
+        with open(args.i, 'rb') as f:
+            param_set = pickle.load(f)
+    else:
+        param_set = sample_from_args(make_param_space(), args)
+    # Snapshots are tagged with the index of their parameter in the whole list
+    param_ids = list(range(len(param_set)))
+    if args.instances:
+        instance_id = int(os.environ['INSTANCE_ID']) if args.instance_id is None else args.instance_id
+        param_ids = list(shard_indices(len(param_set), instance_id, args.instances))
+        param_set = [param_set[i] for i in param_ids]
+    timings = train(fom, param_set, args.o, param_ids=param_ids)
+
+    if comm.rank == 0:
+        print(f'{comm.size} processes, {fom.solution_space.dim} dofs: FOM built in {build:.1f}s, '
+              f'{len(param_set)} solves in {timings["solve"]:.1f}s, written in {timings["write"]:.1f}s')
+        if args.timings:
+            with open(args.timings, 'w') as f:
+                json.dump(dict(timings, build=build, processes=comm.size, dofs=fom.solution_space.dim), f)
@@ -0,0 +1,195 @@
+import argparse
+import os
+import pickle
+import socket
+import time
+import uuid
+
+
+class FileLeaseStore:
+    '''Leases on work chunks, kept as files of a shared directory.
+
+    A chunk is claimed by creating leases/{chunk} exclusively, and marked
+    done by creating done/{chunk}. A lease older than lease_time seconds is
+    considered lost, e.g. with its instance, and can be taken over.'''
+    def __init__(self, root, lease_time=600.):
+        self.root = root
+        self.lease_time = lease_time
+        os.makedirs(os.path.join(root, 'leases'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'done'), exist_ok=True)
+
+    def _lease(self, chunk):
+        return os.path.join(self.root, 'leases', str(chunk))
+
+    def claim(self, chunk, owner):
+        path = self._lease(chunk)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) < self.lease_time:
+                    return False
+                # Expired: the first one to rename it away takes it over
+                os.rename(path, f'{path}.{owner}.expired')
+            except FileNotFoundError:
+                return False
+            return self.claim(chunk, owner)
+        with os.fdopen(fd, 'w') as f:
+            f.write(owner)
+        return True
+
+    def complete(self, chunk, owner):
+        with open(os.path.join(self.root, 'done', str(chunk)), 'w') as f:
+            f.write(owner)
+
+    def done(self):
+        return {int(name) for name in os.listdir(os.path.join(self.root, 'done'))}
+
+
+class BucketLeaseStore:
+    '''Leases on work chunks, kept in a Qarnot bucket shared by the instances of a task.
+
+    Buckets have no atomic create: every claimant writes its own lease
+    leases/{chunk}/{timestamp}-{owner} and then lists them; the earliest
+    lease that is not expired wins. Two instances may still occasionally solve
+    the same chunk, results are tagged by parameter id so duplicates are harmless.'''
+    def __init__(self, bucket, lease_time=600.):
+        self.bucket = bucket
+        self.lease_time = lease_time
+
+    def _holder(self, chunk, now):
+        '''Owner of the earliest lease of chunk that is not expired, if any'''
+        leases = sorted(obj.key.rsplit('/', 1)[1] for obj in self.bucket.directory(f'leases/{chunk}/'))
+        for lease in leases:
+            stamp, owner = lease.split('-', 1)
+            if now - float(stamp) < self.lease_time:
+                return owner
+        return None
+
+    def claim(self, chunk, owner):
+        now = time.time()
+        if self._holder(chunk, now) is not None:
+            return False
+        self.bucket.add_string(owner, f'leases/{chunk}/{now:017.6f}-{owner}')
+        return self._holder(chunk, now) == owner
+
+    def complete(self, chunk, owner):
+        self.bucket.add_string(owner, f'done/{chunk}')
+
+    def done(self):
+        return {int(obj.key.rsplit('/', 1)[1]) for obj in self.bucket.directory('done/')}
+
+
+class WorkQueue:
+    '''Dynamic distribution of n_items work items, in chunks of chunk_size, among
+    the instances sharing store: each instance claims the next free chunk when it
+    is done with the previous one, so faster instances take more chunks, instead
+    of every instance solving a fixed share. When every remaining chunk is leased,
+    the store is polled every poll_interval seconds until they are done, or their
+    lease expires'''
+    def __init__(self, store, n_items, chunk_size=1, owner=None, poll_interval=10.):
+        self.store = store
+        self.poll_interval = poll_interval
+        self.n_items = n_items
+        self.chunk_size = chunk_size
+        self.owner = owner or f'{socket.gethostname()}.{os.getpid()}.{uuid.uuid4().hex[:8]}'
+
+    @property
+    def n_chunks(self):
+        return -(-self.n_items // self.chunk_size)
+
+    def items(self, chunk):
+        return range(chunk * self.chunk_size, min((chunk + 1) * self.chunk_size, self.n_items))
+
+    def chunks(self):
+        '''Yield the claimed chunks, until every chunk is done. The caller must call
+        complete(chunk) once a chunk is processed. Chunks left by lost instances are
+        retried after their lease expires'''
+        start = 0
+        while True:
+            done = self.store.done()
+            if len(done) >= self.n_chunks:
+                return
+            # Start after the last chunk claimed, the ones before are most likely taken
+            for chunk in [(start + k) % self.n_chunks for k in range(self.n_chunks)]:
+                if chunk not in done and self.store.claim(chunk, self.owner):
+                    start = chunk + 1
+                    yield chunk
+                    break
+            else:
+                # Everything left is leased to other instances: wait for them, or for expired leases
+                time.sleep(self.poll_interval)
+
+    def complete(self, chunk):
+        self.store.complete(chunk, self.owner)
+
+
+def chunk_filename(output, chunk):
+    '''File of a chunk: output formatted with the chunk number if it contains {chunk},
+    e.g. 'val/u{chunk}_c.h5', else {output}_{chunk}.h5'''
+    return output.format(chunk=chunk) if '{chunk}' in output else f'{output}_{chunk}.h5'
+
+
+def run_worker(queue, mus, solve, output, solution_times=None, columns=None):
+    '''Solve the parameters mus claimed from queue with solve(mu), and write each
+    chunk to chunk_filename(output, chunk), tagged by parameter ids (indices in mus).
+    solution_times(count), if given, returns the times of the count values of the
+    last solution, e.g. fom.solution_times. columns are given to SnapshotWriter,
+    e.g. model.dof_columns, so that the chunks have the layout of the other stores.
+    Returns the number of chunks solved by this instance'''
+    from snapshot_store import SnapshotWriter
+    count = 0
+    for chunk in queue.chunks():
+        filename = chunk_filename(output, chunk)
+        solutions = []
+        for i in queue.items(chunk):
+            U = solve(mus[i])
+            solutions.append((i, U, solution_times(len(U)) if solution_times else None))
+        with SnapshotWriter(filename + '.tmp', solutions[0][1].dim, columns=columns) as writer:
+            for i, U, times in solutions:
+                writer.append(U, mus[i], times, param_id=i)
+        os.replace(filename + '.tmp', filename)
+        queue.complete(chunk)
+        count += 1
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solve the FOM for parameters pulled by chunks from a queue '
+                                                 'shared by all the instances')
+    parser.add_argument('mesh', help='mesh filename')
+    parser.add_argument('-i', default=None, help='pickled parameter list, or a sample (see sampling) if not given')
+    parser.add_argument('-c', '--chunk-size', type=int, default=2, help='parameters per chunk')
+    parser.add_argument('--lease-dir', default=None, help='shared directory of the leases')
+    parser.add_argument('--lease-bucket', default=None, help='Qarnot bucket of the leases, using the QARNOT_TOKEN '
+                                                             'environment variable, or the credentials exported '
+                                                             'to the task environment. Needs the qarnot SDK')
+    parser.add_argument('--lease-time', type=float, default=1800., help='seconds after which a chunk is retried')
+    parser.add_argument('-o', default='train/u', help='output prefix, chunks are written to {prefix}_{chunk}.h5, '
+                                                      'or output file name containing {chunk}')
+    from sampling import add_sampling_arguments, sample_from_args
+    from timestepping import add_selection_arguments, selection_from_args
+    # The same sample for all the instances, with the same options
+    add_sampling_arguments(parser)
+    add_selection_arguments(parser)
+    args = parser.parse_args()
+
+    from model import make_fom, make_param_space, dof_columns
+    if args.i:
+        with open(args.i, 'rb') as f:
+            mus = pickle.load(f)
+    else:
+        mus = sample_from_args(make_param_space(), args)
+    if args.lease_bucket:
+        import qarnot
+        # Without QARNOT_TOKEN, the SDK falls back to the QARNOT_CLIENT_TOKEN exported to the task
+        conn = qarnot.Connection(client_token=os.environ.get('QARNOT_TOKEN'))
+        store = BucketLeaseStore(conn.retrieve_or_create_bucket(args.lease_bucket), args.lease_time)
+    else:
+        store = FileLeaseStore(args.lease_dir or 'leases', args.lease_time)
+    os.makedirs(os.path.dirname(args.o) or '.', exist_ok=True)
+    fom = make_fom(args.mesh, selection=selection_from_args(args))
+    start = time.perf_counter()
+    count = run_worker(WorkQueue(store, len(mus), args.chunk_size), mus, fom.solve, args.o, fom.solution_times,
+                       dof_columns(fom.solution_space.V))
+    print(f'{count} chunks solved in {time.perf_counter() - start:.1f}s')
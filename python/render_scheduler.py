@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+import heapq
+import json
+import math
+import os
+import re
+from collections import namedtuple
+
+# A frame, or one tile of a frame split in a grid of tiles = (columns, rows) tiles
+WorkUnit = namedtuple('WorkUnit', ['frame', 'tile', 'tiles'])
+
+# Tile grids a heavy frame can be split into, by increasing number of tiles
+TILE_GRIDS = [(1, 1), (2, 1), (2, 2), (3, 2), (3, 3), (4, 3), (4, 4)]
+
+# Blender script applying the render settings, and the region of the tile, given in
+# the environment. Tiles are rendered at the full frame size, transparent outside of
+# their region since it is not rendered, so that assemble() only has to stack them.
+# The film itself is left opaque, so that tiles show the world background as a whole
+# frame would
+SETTINGS_SCRIPT = '''import os
+import bpy
+
+env = os.environ
+scene = bpy.context.scene
+render = scene.render
+render.image_settings.file_format = 'PNG'
+render.image_settings.color_mode = 'RGBA'
+if 'ENGINE' in env:
+    render.engine = env['ENGINE']
+if 'RES_X' in env:
+    render.resolution_x, render.resolution_y = int(env['RES_X']), int(env['RES_Y'])
+if 'RES_PERCENT' in env:
+    render.resolution_percentage = int(env['RES_PERCENT'])
+if 'CYCLES_SAMPLES' in env:
+    scene.cycles.samples = int(env['CYCLES_SAMPLES'])
+if 'TILE' in env:
+    columns, rows = int(env['TILES_X']), int(env['TILES_Y'])
+    x, y = int(env['TILE']) % columns, int(env['TILE']) // columns
+    render.use_border = True
+    render.use_crop_to_border = False
+    render.border_min_x, render.border_max_x = x / columns, (x + 1) / columns
+    render.border_min_y, render.border_max_y = y / rows, (y + 1) / rows
+'''
+
+
+def unit_name(unit):
+    '''Base name of the image of unit, without extension'''
+    if unit.tile is None:
+        return 'f%04d' % unit.frame
+    return 'f%04d_t%d' % (unit.frame, unit.tile)
+
+
+class RenderHistory:
+    '''Render time of every frame in previous runs, in seconds, stored as json
+    in path. Frames never rendered are assumed to cost the median known time'''
+    def __init__(self, path):
+        self.path = path
+        self.times = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.times = {int(frame): seconds for frame, seconds in json.load(f).items()}
+
+    def cost(self, frame):
+        if frame in self.times:
+            return self.times[frame]
+        known = sorted(self.times.values())
+        return known[len(known) // 2] if known else 1.
+
+    def record(self, timings):
+        '''Update with the times of a run, by (frame, tile) as returned by parse_timings.
+        The time of a frame is the sum of its tiles: timings must hold those of the
+        whole run, see parse_timings_files'''
+        frames = {}
+        for (frame, _), seconds in timings.items():
+            frames[frame] = frames.get(frame, 0.) + seconds
+        self.times.update(frames)
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump({str(frame): seconds for frame, seconds in sorted(self.times.items())}, f, indent=1)
+
+
+def split_frames(frames, costs, target):
+    '''Work units of frames: a frame costing more than target is split into the
+    smallest grid of tiles bringing each tile under target. Returns (unit, cost) pairs'''
+    units = []
+    for frame in frames:
+        cost = costs[frame]
+        grid = next((g for g in TILE_GRIDS if cost / (g[0] * g[1]) <= target), TILE_GRIDS[-1])
+        count = grid[0] * grid[1]
+        if count == 1:
+            units.append((WorkUnit(frame, None, None), cost))
+        else:
+            units.extend((WorkUnit(frame, tile, grid), cost / count) for tile in range(count))
+    return units
+
+
+def unit_cost(unit, history):
+    '''Estimated render time of unit'''
+    cost = history.cost(unit.frame)
+    return cost if unit.tile is None else cost / (unit.tiles[0] * unit.tiles[1])
+
+
+def balance(units, instances):
+    '''Assign the (unit, cost) pairs to at most instances tasks, longest first to
+    the least loaded task. Returns a list of (units, estimated time) per task'''
+    bins = [(0., i, []) for i in range(min(instances, len(units)))]
+    for unit, cost in sorted(units, key=lambda u: -u[1]):
+        load, i, assigned = heapq.heappop(bins)
+        assigned.append(unit)
+        heapq.heappush(bins, (load + cost, i, assigned))
+    return [(assigned, load) for load, _, assigned in sorted(bins, key=lambda b: b[1])]
+
+
+def plan(frames, history, instances):
+    '''Share the frames among at most instances tasks so that their estimated
+    render times, from history, are balanced: frames too heavy to fit in an even
+    share are split into tiles before balance()'''
+    costs = {frame: history.cost(frame) for frame in frames}
+    target = sum(costs.values()) / instances
+    # Allow some slack over the even share, so that frames are only tiled when worth it
+    return balance(split_frames(frames, costs, target * 1.2), instances)
+
+
+def render_command(units, blend_file, settings_script, log_name, environment=None):
+    '''Shell command rendering units one after the other with the Blender command
+    line into out/, and appending the render time of each unit to out/{log_name}.
+    environment holds the variables read by SETTINGS_SCRIPT, e.g. {'ENGINE': 'CYCLES'}'''
+    variables = ''.join('%s=%s ' % item for item in (environment or {}).items())
+    steps = ['mkdir -p out']
+    for unit in units:
+        tile, pattern = '', 'f####'
+        if unit.tile is not None:
+            tile = 'TILE=%d TILES_X=%d TILES_Y=%d ' % (unit.tile, *unit.tiles)
+            pattern += '_t%d' % unit.tile
+        steps.append('s=$(date +%%s); %s%sblender -b %s --python %s -o "$PWD/out/%s" -f %d; '
+                     'echo %d %s $(($(date +%%s) - s)) >> out/%s'
+                     % (variables, tile, blend_file, settings_script, pattern, unit.frame,
+                        unit.frame, '-' if unit.tile is None else unit.tile, log_name))
+    return "sh -c '%s'" % '; '.join(steps)
+
+
+def parse_timings(text):
+    '''Render times by (frame, tile) from the logs written by render_command'''
+    timings = {}
+    for line in text.splitlines():
+        match = re.match(r'\s*(\d+) (-|\d+) (\d+)\s*$', line)
+        if match:
+            frame, tile, seconds = match.groups()
+            timings[int(frame), None if tile == '-' else int(tile)] = float(seconds)
+    return timings
+
+
+def parse_timings_files(paths):
+    '''Render times by (frame, tile) from all the logs of a run, the tiles of a frame
+    being rendered by different tasks. A unit rendered again keeps its last time'''
+    timings = {}
+    for path in sorted(paths):
+        with open(path) as f:
+            timings.update(parse_timings(f.read()))
+    return timings
+
+
+def missing_units(units, output_dir):
+    '''The units whose image was not produced, to be rendered again'''
+    return [unit for unit in units
+            if not os.path.exists(os.path.join(output_dir, unit_name(unit) + '.png'))]
+
+
+def assemble(frame, tiles, output_dir, keep_tiles=False):
+    '''Stack the tile images of frame into its final image out/f{frame}.png. Needs Pillow'''
+    from PIL import Image
+    names = [os.path.join(output_dir, unit_name(WorkUnit(frame, tile, tiles)) + '.png')
+             for tile in range(tiles[0] * tiles[1])]
+    image = None
+    for name in names:
+        with Image.open(name) as tile_image:
+            tile_image = tile_image.convert('RGBA')
+            image = tile_image if image is None else Image.alpha_composite(image, tile_image)
+    path = os.path.join(output_dir, unit_name(WorkUnit(frame, None, None)) + '.png')
+    image.save(path)
+    if not keep_tiles:
+        for name in names:
+            os.remove(name)
+    return path
+
+
+def estimated_makespan(tasks):
+    return max((load for _, load in tasks), default=0.)
+
+
+def frame_split_makespan(frames, history, instances):
+    '''Estimated makespan of the static split, as many frames per instance, without tiles'''
+    per_instance = math.ceil(len(frames) / instances)
+    shares = [frames[i:i + per_instance] for i in range(0, len(frames), per_instance)]
+    return max(sum(history.cost(f) for f in share) for share in shares)
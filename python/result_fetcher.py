@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from bucket_sync import file_digest
+
+# Size of the pieces a result file is written to disk by
+CHUNK_SIZE = 1024 * 1024
+
+
+class ResultFetcher:
+    '''Download the files of a result bucket, many at a time, each one streamed
+    to disk by chunks of chunk_size bytes so that memory stays bounded.
+
+    Only the files whose name matches whitelist and does not match blacklist
+    are fetched, with the same regular expressions as task.results_whitelist
+    and task.results_blacklist. A file is first written as name.part, next to
+    name.part.etag holding the ETag of the remote version being downloaded: an
+    interrupted download restarts from where it stopped, unless the remote
+    file changed in between. fetch() can be called repeatedly, e.g. on a task
+    taking snapshots, and only downloads the new or updated files.'''
+    def __init__(self, conn, bucket, output_dir, whitelist=None, blacklist=None,
+                 max_workers=8, chunk_size=CHUNK_SIZE):
+        self._s3 = conn.s3client
+        self.bucket = bucket
+        self.output_dir = output_dir
+        self.whitelist = re.compile(whitelist) if whitelist else None
+        self.blacklist = re.compile(blacklist) if blacklist else None
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.fetched = {}  # remote name -> ETag of the downloaded version
+
+    def wanted(self, key):
+        if self.whitelist is not None and not self.whitelist.search(key):
+            return False
+        return self.blacklist is None or not self.blacklist.search(key)
+
+    def local_path(self, key):
+        root = os.path.abspath(self.output_dir)
+        path = os.path.abspath(os.path.join(root, key))
+        if path == root or os.path.commonpath([root, path]) != root:
+            raise ValueError(f'result file {key} would be written outside of {self.output_dir}')
+        return path
+
+    def _up_to_date(self, key, size, e_tag):
+        if self.fetched.get(key) == e_tag:
+            return True
+        path = self.local_path(key)
+        # A file already on disk, e.g. from an earlier run, is only kept if identical
+        if os.path.exists(path) and os.path.getsize(path) == size and file_digest(path) == e_tag:
+            self.fetched[key] = e_tag
+            return True
+        return False
+
+    def download(self, key, e_tag):
+        '''Stream one remote file to disk, resuming a previous partial download'''
+        path = self.local_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        part = path + '.part'
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        if offset and _read(part + '.etag') != e_tag:
+            # The partial file comes from another version of the remote file
+            offset = 0
+        with open(part + '.etag', 'w') as f:
+            f.write(e_tag)
+        request = {'Bucket': self.bucket.uuid, 'Key': key, 'IfMatch': '"%s"' % e_tag}
+        if offset:
+            request['Range'] = 'bytes=%d-' % offset
+        try:
+            response = self._s3.get_object(**request)
+        except ClientError as error:
+            status = error.response['ResponseMetadata']['HTTPStatusCode']
+            if status == 412:
+                # Remote file changed since the listing, it will be fetched next time
+                return False
+            if status != 416:
+                raise
+            # Range not satisfiable: the partial file is stale, start over
+            offset = 0
+            del request['Range']
+            response = self._s3.get_object(**request)
+        with open(part, 'ab' if offset else 'wb') as f:
+            for chunk in response['Body'].iter_chunks(self.chunk_size):
+                f.write(chunk)
+        os.replace(part, path)
+        os.remove(part + '.etag')
+        self.fetched[key] = e_tag
+        return True
+
+    def fetch(self):
+        '''Download the wanted files that are new or changed since the last call.
+        Return the list of the downloaded remote names'''
+        todo = [(obj.key, obj.e_tag.strip('"')) for obj in self.bucket.list_files()
+                if self.wanted(obj.key) and not self._up_to_date(obj.key, obj.size, obj.e_tag.strip('"'))]
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            done = list(executor.map(lambda item: self.download(*item), todo))
+        return [key for (key, _), ok in zip(todo, done) if ok]
+
+    def follow(self, finished, interval=10., on_fetched=None):
+        '''Fetch the results every interval seconds until finished() returns True,
+        then one last time. on_fetched(keys) is called after each fetch that
+        downloaded something'''
+        while True:
+            last = finished()
+            keys = self.fetch()
+            if keys and on_fetched is not None:
+                on_fetched(keys)
+            if last:
+                return
+            time.sleep(interval)
+
+
+def _read(path):
+    '''Content of the text file at path, None if it does not exist'''
+    try:
+        with open(path) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def fetch_results(conn, task, output_dir, **kwargs):
+    '''Download the results of task into output_dir, honoring its results whitelist and blacklist'''
+    fetcher = ResultFetcher(conn, task.results, output_dir, task.results_whitelist,
+                            task.results_blacklist, **kwargs)
+    return fetcher.fetch()
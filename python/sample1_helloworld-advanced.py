@@ -2,6 +2,8 @@
  
 import sys
 import qarnot
+from task_waiter import wait_tasks
+from log_stream import LogStreamer
  
 # Edit 'samples.conf' to provide your own credentials
  
@@ -25,22 +27,15 @@ try:
     task.submit()
  
     # Wait for the task to be finished, and monitor the progress of its
-    # deployment
-    last_state = ''
-    done = False
-    while not done:
-        if task.state != last_state:
-            last_state = task.state
-            print("** {}".format(last_state))
- 
-        # Wait for the task to complete, with a timeout of 5 seconds.
-        # This will return True as soon as the task is complete, or False
-        # after the timeout.
-        done = task.wait(5)
- 
-        # Display fresh stdout / stderr
-        sys.stdout.write(task.fresh_stdout())
-        sys.stderr.write(task.fresh_stderr())
+    # deployment. The waiter polls the task state with an increasing delay,
+    # and calls us back on every state change, while its stdout / stderr are
+    # displayed from a background thread.
+    def print_state(task, state):
+        print("** {}".format(state))
+
+    with LogStreamer(conn) as logs:
+        logs.add(task)
+        wait_tasks(conn, [task], on_state_change=print_state, fail_fast=False)
  
     # Display errors on failure
     if task.state == 'Failure':
@@ -1,7 +1,10 @@
 #!/usr/bin/env python
- 
+
 import sys
+import asyncio
 import qarnot
+from async_tasks import AsyncConnection
+from log_stream import LogStreamer
 import os
 
 # Edit 'samples.conf' to provide your own credentials
@@ -9,67 +12,69 @@ import os
 # display the input file
 with open('input/lorem.txt', 'r') as content_file:
     print(">>> input/lorem.txt:\n----------------------------\n%s\n----------------------------" % content_file.read())
- 
+
 # Create a connection, from which all other objects will be derived
 conn = qarnot.Connection('samples.conf')
- 
-# Create a task. The 'with' statement ensures that the task will be
-# deleted in the end, to prevent tasks from continuing to run after
-# a Ctrl-C for instance
+
+# Create a task. It is deleted in the 'finally' block at the end, to
+# prevent tasks from continuing to run after a Ctrl-C for instance
 task = conn.create_task('sample2-files', 'docker-batch', 1)
 
-# Store if an error happened during the process
-error_happened = False
-try:
-    # Create a resource bucket and add an input file
-    input_bucket = conn.create_bucket('sample2-files-input-resource')
-    input_bucket.add_file('input/lorem.txt')
-    
-    # Attach the bucket to the task
+
+def print_state(task, state):
+    print("** {}".format(state))
+
+
+async def run(aconn):
+    # Create the resource and result buckets at the same time
+    input_bucket, output_bucket = await asyncio.gather(
+        aconn.create_bucket('sample2-files-input-resource'),
+        aconn.create_bucket('sample2-files-output'))
+
+    # Add an input file and attach the bucket to the task
+    await aconn.upload(input_bucket, 'input/lorem.txt')
     task.resources.append(input_bucket)
 
-    # Create a result bucket and attach it to the task
-    output_bucket = conn.create_bucket('sample2-files-output')
+    # Attach the result bucket to the task
     task.results = output_bucket
 
     # Set the command to run when launching the container, by overriding a
     # constant.
     # Task constants are the main way of controlling a task's behaviour
     task.constants['DOCKER_CMD'] = 'sh -c "cat lorem.txt | tr [:lower:] [:upper:] > LOREM.TXT"'
- 
-    # Submit the task to the Api, that will launch it on the cluster
-    task.submit()
- 
-    # Wait for the task to be finished, and monitor the progress of its
-    # deployment
-    last_state = ''
-    done = False
-    while not done:
-        if task.state != last_state:
-            last_state = task.state
-            print("** {}".format(last_state))
- 
-        # Wait for the task to complete, with a timeout of 5 seconds.
-        # This will return True as soon as the task is complete, or False
-        # after the timeout.
-        done = task.wait(5)
- 
-        # Display fresh stdout / stderr
-        sys.stdout.write(task.fresh_stdout())
-        sys.stderr.write(task.fresh_stderr())
- 
-    # Display errors on failure
-    if task.state == 'Failure':
-        print("** Errors: %s" % task.errors[0])
-        error_happened = True
 
-    else:
-        task.download_results('output')
+    # Submit the task to the Api, that will launch it on the cluster, wait for
+    # it to be finished while monitoring its state, and download its results
+    # on success
+    return await aconn.run_task(task, 'output', on_state_change=print_state)
+
+
+async def main():
+    # Display the output of the task from a background thread
+    async with AsyncConnection(conn) as aconn:
+        with LogStreamer(conn) as logs:
+            logs.add(task)
+            return await run(aconn)
 
+
+# Store if an error happened during the process
+error_happened = False
+try:
+    state = asyncio.run(main())
+
+    if state == 'Success':
         # display the output file
         with open('output/LOREM.TXT', 'r') as content_file:
             print("<<< output/LOREM.TXT:\n----------------------------\n%s\n----------------------------" % content_file.read())
 
+    else:
+        # Display errors on failure, the state otherwise (cancelled or deleted)
+        if state == 'Failure' and task.errors:
+            print("** Errors: %s" % task.errors[0])
+        else:
+            print("** Task ended in state %s" % state)
+        error_happened = True
+
 finally:
     task.delete(purge_resources=True, purge_results=True)
     # Exit code in case of error
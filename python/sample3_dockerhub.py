@@ -1,7 +1,11 @@
 #!/usr/bin/env python
 
 import sys
+import asyncio
 import qarnot
+from async_tasks import AsyncConnection
+from log_stream import LogStreamer
+from batch_submit import submit_tasks
 import os
 import operator
 
@@ -20,8 +24,28 @@ linux_versions = ["library/centos:5",      \
                   "opensuse/leap:42.3", \
                   "archlinux:latest"]
 
-# Create the tasks
+# Create the tasks, tagged so that their states can be listed at once
+task_tag = 'sample3-dockerhub'
 tasks = {i: conn.create_task('sample3-dockerhub-%s' % i, 'docker-batch', 1) for i in linux_versions}
+for task in tasks.values():
+    task.tags = [task_tag]
+
+
+def print_state(task, state):
+    print("** {} >>> {}".format(task.name, state))
+
+
+async def main(submitted):
+    # All the tasks are monitored concurrently. The states of all the tasks
+    # are fetched at once on each poll, and their output is displayed from a
+    # background thread, each line prefixed with the name of its task.
+    async with AsyncConnection(conn, tags=[task_tag]) as aconn:
+        with LogStreamer(conn, tags=[task_tag]) as logs:
+            for task in submitted:
+                logs.add(task)
+            return await asyncio.gather(*[aconn.monitor(task, on_state_change=print_state)
+                                          for task in submitted])
+
 
 # Store if an error happened during the process
 error_happened = False
@@ -34,29 +58,21 @@ try:
         task.constants['DOCKER_REPO'] = repo
         task.constants['DOCKER_TAG'] = tag
         task.constants['DOCKER_CMD'] = 'sh -c "cat /etc/issue | head -n 1"'
-        print("** Submitting %s..." % task.name)
-
-        # Submit the task to the Api, that will launch it on the cluster
-        task.submit()
-
-    # Wait for the task to be finished, and monitor the progress of its
-    # deployment
-    last_state = {task.name: '' for task in tasks.values()}
-    done = False
-    while not done:
-        for task in tasks.values():
-            if task.state != last_state[task.name]:
-                last_state[task.name] = task.state
-                print("** {} >>> {}".format(task.name, last_state[task.name]))
-
-        # Wait for the task to complete, with a timeout of 2 seconds.
-        # This will return True as soon as the task is complete, or False
-        # after the timeout.
-        done = all([task.wait(2) for task in tasks.values()])
-
-        # Display fresh stdout / stderr
-        map(sys.stdout.write, [task.fresh_stdout() for task in tasks.values()])
-        map(sys.stderr.write, [task.fresh_stderr() for task in tasks.values()])
+
+    # Submit the tasks to the Api, that will launch them on the cluster.
+    # They are sent by batches to the bulk endpoint, one request per batch plus one
+    # per task, with which the SDK refreshes it.
+    print("** Submitting %d tasks..." % len(tasks))
+    submitted = []
+    for result in submit_tasks(conn, tasks.values()):
+        if result.error is not None:
+            print("** %s >>> Submission failed: %s" % (result.task.name, result.error))
+            error_happened = True
+        else:
+            submitted.append(result.task)
+
+    # Wait for the tasks to be finished, and monitor their state and output
+    asyncio.run(main(submitted))
 
     # Display errors on failure
     for task in tasks.values():
@@ -1,92 +1,178 @@
 #!/usr/bin/env python
 import argparse
+import asyncio
+import os
+import subprocess
 import sys
 import qarnot
+from async_tasks import AsyncConnection
+from batch_submit import submit_tasks
+from bucket_sync import upload_files
+from log_stream import LogStreamer
+from result_fetcher import fetch_results
 
 # Parse ffmpeg command line
 
-# Create a argument parser to parse input files
-parser = argparse.ArgumentParser()
+# Create a argument parser to parse input files, and the number of segments
+# the input is split into, each one transcoded by a different task
+parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
 parser.add_argument('-i', action='append', required=True)
+parser.add_argument('--segments', type=int, default=1)
 
 # Get arguments
 args = sys.argv[1:]
 
 # Parse input files and store them as a list
-input_files = parser.parse_known_args(args)[0].i
+known = parser.parse_known_args(args)[0]
+input_files = known.i
+segments = known.segments
 
-# Build the full command line
-ffmpeg_cmd = ' '.join(args)
+# Build the full command line, without our own options
+ffmpeg_args = list(args)
+for option in [a for a in args if a.startswith('--segments')]:
+    index = ffmpeg_args.index(option)
+    del ffmpeg_args[index:index + (1 if '=' in option else 2)]
+ffmpeg_cmd = ' '.join(ffmpeg_args)
+
+if segments > 1 and len(input_files) != 1:
+    parser.error('--segments needs exactly one input file')
 
 # Display that we parsed
 print("** FFMPEG command: %s" % ffmpeg_cmd)
 print("** Input files: %s" % ', '.join(input_files))
 
+
+def probe(*options):
+    return subprocess.run(['ffprobe', '-v', 'error', *options], check=True,
+                          stdout=subprocess.PIPE, universal_newlines=True).stdout
+
+
+def segment_bounds(path, count):
+    '''Split the video path into count segments starting on keyframes, so that
+    each one can be decoded on its own. Returns the list of (start, duration)'''
+    duration = float(probe('-show_entries', 'format=duration', '-of', 'csv=p=0', path))
+    keyframes = sorted(float(t) for t in probe('-select_streams', 'v:0', '-skip_frame', 'nokey',
+                                               '-show_entries', 'frame=best_effort_timestamp_time',
+                                               '-of', 'csv=p=0', path).split()
+                       if t.strip() and t.strip() != 'N/A')
+    # The keyframe closest to each even split point
+    keyframes = keyframes or [0.]
+    starts = sorted({min(keyframes, key=lambda t: abs(t - k * duration / count)) for k in range(1, count)}
+                    | {0.})
+    ends = starts[1:] + [duration]
+    return [(start, end - start) for start, end in zip(starts, ends) if end > start]
+
+
+def segment_command(start, duration, index):
+    '''ffmpeg arguments transcoding one segment of the input with the user's
+    options, to segment_{index} with the extension of the output'''
+    i = ffmpeg_args.index('-i')
+    input_options, output_options = ffmpeg_args[:i], ffmpeg_args[i + 2:-1]
+    extension = os.path.splitext(ffmpeg_args[-1])[1]
+    return ' '.join(input_options + ['-ss', '%.6f' % start, '-t', '%.6f' % duration, '-i', ffmpeg_args[i + 1]]
+                    + output_options + ['segment_%03d%s' % (index, extension)])
+
+
+def concat(segment_files, output):
+    '''Stitch the transcoded segments back together with ffmpeg's concat demuxer, without
+    re-encoding, then remove them'''
+    list_file = output + '.segments.txt'
+    with open(list_file, 'w') as f:
+        for name in segment_files:
+            f.write("file '%s'\n" % os.path.abspath(name).replace("'", "'\\''"))
+    subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'concat', '-safe', '0', '-i', list_file,
+                    '-c', 'copy', output], check=True)
+    os.remove(list_file)
+    for name in segment_files:
+        os.remove(name)
+
+
 # Edit 'samples.conf' to provide your own credentials
 
 # Create a connection, from which all other objects will be derived
 conn = qarnot.Connection('samples.conf')
 
-# Create a task. The 'with' statement ensures that the task will be
-# deleted in the end, to prevent tasks from continuing to run after
-# a Ctrl-C for instance
-task = conn.create_task('sample4-ffmpeg', 'docker-batch', 1)
+# Create the tasks: one for the whole command, or one per segment of the input
+if segments > 1:
+    bounds = segment_bounds(input_files[0], segments)
+    print("** Segments: %s" % ', '.join('%.1fs+%.1fs' % b for b in bounds))
+    commands = [segment_command(start, duration, i) for i, (start, duration) in enumerate(bounds)]
+else:
+    commands = [ffmpeg_cmd]
+tasks = [conn.create_task('sample4-ffmpeg' if len(commands) == 1 else 'sample4-ffmpeg-%03d' % i, 'docker-batch', 1)
+         for i in range(len(commands))]
+# Tagged so that the states of all the segments can be listed at once
+tag = 'sample4-ffmpeg'
+for task in tasks:
+    task.tags = [tag]
+
+
+def print_state(task, state):
+    print("** {} >>> {}".format(task.name, state))
+
+
+async def run(aconn):
+    # Create the resource and result buckets at the same time
+    input_bucket, output_bucket = await asyncio.gather(
+        aconn.create_bucket('sample4-ffmpeg-input-resource'),
+        aconn.create_bucket('sample4-ffmpeg-output'))
+
+    # Upload our input files in parallel. The input bucket is kept between
+    # runs, so that only new or modified files are sent
+    await aconn.call(upload_files, input_bucket, {input_file: input_file for input_file in input_files})
+
+    for task, command in zip(tasks, commands):
+        # Set the command to run when launching the container, by overriding a
+        # constant.
+        # Task constants are the main way of controlling a task's behaviour
+        task.constants['DOCKER_REPO'] = 'jrottenberg/ffmpeg'
+        task.constants['DOCKER_TAG'] = 'ubuntu'
+        task.constants['DOCKER_CMD'] = command
+
+        # Attach the buckets to the task
+        task.resources.append(input_bucket)
+        task.results = output_bucket
+
+    # Submit the tasks to the Api, that will launch them on the cluster, and wait
+    # for them to be finished while monitoring their state and output
+    for result in await aconn.call(submit_tasks, conn, tasks):
+        if result.error is not None:
+            raise result.error
+    with LogStreamer(conn, tags=[tag]) as logs:
+        for task in tasks:
+            logs.add(task)
+        states = await asyncio.gather(*[aconn.monitor(task, on_state_change=print_state) for task in tasks])
+
+    # Download the results on success, several files at a time
+    if all(state == 'Success' for state in states):
+        await aconn.call(fetch_results, conn, tasks[0], '.')
+        if len(tasks) > 1:
+            extension = os.path.splitext(ffmpeg_args[-1])[1]
+            concat(['segment_%03d%s' % (i, extension) for i in range(len(tasks))], ffmpeg_args[-1])
+            print("** Segments joined into %s" % ffmpeg_args[-1])
+    return states
+
+
+async def main():
+    async with AsyncConnection(conn, tags=[tag]) as aconn:
+        return await run(aconn)
+
 
 # Store if an error happened during the process
 error_happened = False
 
 try:
-    # Set the command to run when launching the container, by overriding a
-    # constant.
-    # Task constants are the main way of controlling a task's behaviour
-    task.constants['DOCKER_REPO'] = 'jrottenberg/ffmpeg'
-    task.constants['DOCKER_TAG'] = 'ubuntu'
-    task.constants['DOCKER_CMD'] = ffmpeg_cmd
-    # task.constants['DOCKER_CMD'] = "sleep 3600"
-
-    input_bucket = conn.create_bucket('sample4-ffmpeg-input-resource')
-    for input_file in input_files:
-        # Create a resource bucket and add our input file.
-        input_bucket[input_file] = input_file
-
-    # Attach the bucket to the task
-    task.resources.append(input_bucket)
-
-    # Create and attach an output bucket
-    output_bucket = conn.create_bucket('sample4-ffmpeg-output')
-    task.results = output_bucket
-
-    # Submit the task to the Api, that will launch it on the cluster
-    task.submit()
-
-    # Wait for the task to be finished, and monitor the progress of its
-    # deployment
-    last_state = ''
-    done = False
-    while not done:
-        if task.state != last_state:
-            last_state = task.state
-            print("** {}".format(last_state))
-
-        # Wait for the task to complete, with a timeout of 5 seconds.
-        # This will return True as soon as the task is complete, or False
-        # after the timeout.
-        done = task.wait(5)
-
-        # Display fresh stdout / stderr
-        sys.stdout.write(task.fresh_stdout())
-        sys.stderr.write(task.fresh_stderr())
-
-    if task.state == 'Failure':
-        # Display errors on failure
-        print("** Errors: %s" % task.errors[0])
-        error_happened = True
-    else:
-        # Or download the results
-        task.download_results('.')
+    states = asyncio.run(main())
+
+    for task, state in zip(tasks, states):
+        if state == 'Failure':
+            # Display errors on failure
+            print("** Errors of %s: %s" % (task.name, task.errors[0]))
+            error_happened = True
 
 finally:
-    task.delete(purge_resources=True, purge_results=True)
+    for task in tasks:
+        task.delete(purge_resources=False, purge_results=True)
     # Exit code in case of error
     if error_happened:
         sys.exit(1)
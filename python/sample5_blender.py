@@ -1,83 +1,178 @@
 #!/usr/bin/env python
 
+import asyncio
+import glob
 import qarnot
+from async_tasks import AsyncConnection
+from batch_submit import submit_tasks
+from bucket_sync import upload_files
+from log_stream import LogStreamer
+from result_fetcher import ResultFetcher
+import render_scheduler as rs
 import os
 import sys
+import threading
+import time
 
 input_file = 'blender/qarnot.blend'
+settings_file = 'blender/render_settings.py'
+# Render times of the frames in the previous runs, to balance the next ones
+history_file = 'blender/render_times.json'
+
+# Render the frames 115 to 120, on at most 6 tasks
+frames = list(range(115, 121))
+max_tasks = 6
+# Frames that failed are rendered again, at most this many times
+retries = 2
+
+# Results of this run. A directory per run, so that images and timings left by
+# earlier runs are neither taken for rendered units nor recorded again
+output_dir = os.path.join('output', time.strftime('%Y%m%d-%H%M%S'))
+images_dir = os.path.join(output_dir, 'out')
+
+# The blender profile renders a frame range with the settings of its constants, one
+# frame per instance. Here a task renders a list of frames and tiles, each tile region
+# set by render_scheduler.SETTINGS_SCRIPT and each unit timed, so the tasks run the
+# Blender command line of this image on docker-batch instead. The tag pins Blender
+# 2.93, the version whose Python API the settings script uses: check the script
+# before changing it
+blender_repo = 'nytimes/blender'
+blender_tag = '2.93-cpu-ubuntu18.04'
+
+# Render settings, read by render_scheduler.SETTINGS_SCRIPT
+render_environment = {'ENGINE': 'CYCLES',
+                      'RES_X': 1920,
+                      'RES_Y': 1080,
+                      'RES_PERCENT': 50,  # Limit ratio for testing purposes
+                      'CYCLES_SAMPLES': 20}
 
 # Edit 'samples.conf' to provide your own credentials
 
 # Create a connection, from which all other objects will be derived
 conn = qarnot.Connection('samples.conf')
 
-# Create a task.
-# Because we are selecting the frame to render inside the task, put the frame count to 0
-task = conn.create_task('sample5-blender', 'blender', 0)
+history = rs.RenderHistory(history_file)
+tasks = []
+# The render tasks are tagged so that their states can be listed at once
+tag = 'sample5-blender'
+
+
+def print_state(task, state):
+    print("** {} >>> {}".format(task.name, state))
+
+
+def print_frames(keys):
+    for key in keys:
+        if key.endswith('.png'):
+            print("** Downloaded %s" % key)
+
+
+async def render(aconn, logs, input_bucket, output_bucket, planned, attempt):
+    '''Render the planned list of (units, estimated time), one task each, and
+    download the images as soon as they land in the output bucket'''
+    submitted = []
+    for i, (units, estimate) in enumerate(planned):
+        task = conn.create_task('sample5-blender-%d-%d' % (attempt, i), 'docker-batch', 1)
+        task.tags = [tag]
+        task.constants['DOCKER_REPO'] = blender_repo
+        task.constants['DOCKER_TAG'] = blender_tag
+        task.constants['DOCKER_CMD'] = rs.render_command(units, os.path.basename(input_file),
+                                                         os.path.basename(settings_file),
+                                                         'timings_%d_%d.txt' % (attempt, i), render_environment)
+        task.resources.append(input_bucket)
+        task.results = output_bucket
+        # Have the rendered images copied to the output bucket every 30 seconds,
+        # instead of only at the end of the task
+        task.snapshot(30)
+        print("** %s: %s (about %.0fs)" % (task.name, ', '.join(rs.unit_name(u) for u in units), estimate))
+        tasks.append(task)
+        submitted.append(task)
+        logs.add(task)
+
+    for result in await aconn.call(submit_tasks, conn, submitted):
+        if result.error is not None:
+            raise result.error
+
+    # Download each image as soon as it lands in the output bucket, while
+    # waiting for the tasks to be finished and monitoring them.
+    # Succeeded frames are downloaded even on failure.
+    fetcher = ResultFetcher(conn, output_bucket, output_dir, whitelist=r'\.(png|txt)$')
+    finished = threading.Event()
+    follow = asyncio.ensure_future(aconn.call(fetcher.follow, finished.is_set, 10, print_frames))
+    try:
+        return await asyncio.gather(*[aconn.monitor(task, on_state_change=print_state) for task in submitted])
+    finally:
+        finished.set()
+        await follow
+
+
+async def run(aconn, logs):
+    # Create the resource and result buckets at the same time
+    input_bucket, output_bucket = await asyncio.gather(
+        aconn.create_bucket('sample5-blender-input-resource'),
+        aconn.create_bucket('sample5-blender-output'))
+
+    # Add the input files. The input bucket is kept between runs, so that the
+    # files are only sent when modified
+    with open(settings_file, 'w') as f:
+        f.write(rs.SETTINGS_SCRIPT)
+    print("** Uploading %s..." % input_file)
+    await aconn.call(upload_files, input_bucket, {os.path.basename(input_file): input_file,
+                                                  os.path.basename(settings_file): settings_file})
+
+    # Balance the frames between the tasks from their previous render times,
+    # heavy frames being split into tiles
+    planned = rs.plan(frames, history, max_tasks)
+    print("** Estimated render time %.0fs, instead of %.0fs with as many frames per task"
+          % (rs.estimated_makespan(planned), rs.frame_split_makespan(frames, history, max_tasks)))
+    units = [unit for task_units, _ in planned for unit in task_units]
+
+    try:
+        for attempt in range(retries + 1):
+            await render(aconn, logs, input_bucket, output_bucket, planned, attempt)
+            # Render again only the frames or tiles that are missing
+            missing = rs.missing_units(units, images_dir)
+            if not missing:
+                break
+            print("** Missing %s" % ', '.join(rs.unit_name(u) for u in missing))
+            planned = rs.balance([(u, rs.unit_cost(u, history)) for u in missing], max_tasks)
+    finally:
+        # Keep the measured render times for the next runs
+        history.record(rs.parse_timings_files(glob.glob(os.path.join(images_dir, 'timings_*.txt'))))
+        history.save()
+
+    # Stack the tiles of the heavy frames into their final image
+    tiled = {unit.frame: unit.tiles for unit in units if unit.tile is not None}
+    for frame, tiles in sorted(tiled.items()):
+        print("** Assembled %s" % rs.assemble(frame, tiles, images_dir))
+    return missing
+
+
+async def main():
+    # The output of the tasks is displayed from a background thread, each line
+    # prefixed with the name of its task
+    async with AsyncConnection(conn, tags=[tag]) as aconn:
+        with LogStreamer(conn, tags=[tag]) as logs:
+            return await run(aconn, logs)
+
 
 # Store if an error happened during the process
 error_happened = False
 try:
-    # Create a resource bucket and add an input file
-    print("** Uploading %s..." % input_file)
-    input_bucket = conn.create_bucket('sample5-blender-input-resource')
-    input_bucket.add_file(input_file)
-
-    # Attach the bucket to the task
-    task.resources.append(input_bucket)
-
-    # Create and attach an output bucket
-    output_bucket = conn.create_bucket('sample5-blender-output')
-    task.results = output_bucket
-
-    # Render the frame 115 to 120
-    task.advanced_range = '115-120'
-
-    # Task constants are the main way of controlling a task's behaviour
-    task.constants['BLEND_FILE'] = os.path.basename(input_file)
-    task.constants['BLEND_SLICING'] = '1'
-    task.constants['BLEND_ENGINE'] = 'CYCLES'
-    task.constants['BLEND_FORMAT'] = 'PNG'
-    task.constants['BLEND_W'] = '1920'
-    task.constants['BLEND_H'] = '1080'
-    task.constants['BLEND_RATIO'] = '50'  # Limit ratio for testing purposes
-    task.constants['BLEND_CYCLES_SAMPLES'] = '20'
-
-    # Submit the task to the Api, that will launch it on the cluster
-    task.submit()
-
-    # Wait for the task to be finished, and monitor its progress
-    last_state = ''
-    last_execution_progress = 0.0
-    done = False
-    while not done:
-        if task.status is not None and task.status.execution_progress != last_execution_progress:
-            last_execution_progress = task.status.execution_progress
-            print("** Overall progress {}%".format(last_execution_progress))
-
-        if task.state != last_state:
-            last_state = task.state
-            print("** {}".format(last_state))
-
-        # Wait for the task to complete, with a timeout of 5 seconds.
-        # This will return True as soon as the task is complete, or False
-        # after the timeout.
-        done = task.wait(5)
-
-        # Display fresh stdout / stderr
-        sys.stdout.write(task.fresh_stdout())
-        sys.stderr.write(task.fresh_stderr())
+    missing = asyncio.run(main())
 
     # Display errors on failure
-    if task.state == 'Failure':
-        print("** Errors: %s" % task.errors[0])
+    for task in tasks:
+        if task.state == 'Failure':
+            print("** Errors of %s: %s" % (task.name, task.errors[0]))
+    if missing:
+        print("** Failed to render %s" % ', '.join(rs.unit_name(u) for u in missing))
         error_happened = True
 
-    # Download succeeded frames
-    task.download_results('output')
-
 finally:
-    task.delete(purge_resources=True, purge_results=True)
+    for task in tasks:
+        task.delete(purge_resources=False, purge_results=False)
+    conn.create_bucket('sample5-blender-output').delete()
     # Exit code in case of error
     if error_happened:
         sys.exit(1)
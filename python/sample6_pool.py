@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import sys
+import qarnot
+from pool_runner import PoolRunner, elastic_scaling, task_timing, print_timings
+from task_waiter import wait_tasks
+
+# Edit 'samples.conf' to provide your own credentials
+
+# Create a connection, from which all other objects will be derived
+conn = qarnot.Connection('samples.conf')
+
+# A few short stages, each one doing a few seconds of work, run one after the other
+stages = ['sh -c "echo stage %d && sleep 5"' % i for i in range(5)]
+
+
+def run_stages(create_task):
+    '''Run the stages one after the other, each one in the task returned by
+    create_task(name, command), and return their timings'''
+    timings = []
+    for i, command in enumerate(stages):
+        task = create_task('sample6-stage-%d' % i, command)
+        task.submit()
+        wait_tasks(conn, [task], fail_fast=False)
+        timings.append(task_timing(task))
+    return timings
+
+
+# Store if an error happened during the process
+error_happened = False
+tasks = []
+try:
+    # Every stage in its own task: each one waits for a slot and starts its container
+    def standalone_task(name, command):
+        task = conn.create_task(name, 'docker-batch', 1)
+        task.constants['DOCKER_CMD'] = command
+        tasks.append(task)
+        return task
+
+    print("** Standalone tasks")
+    standalone = run_stages(standalone_task)
+    print_timings(standalone)
+
+    # The same stages on a pool: the pool keeps one slot up and ready between
+    # the stages, so they skip most of the queueing and startup
+    print("** Tasks on a pool")
+    with PoolRunner(conn, 'sample6-pool', scaling=elastic_scaling(min_slots=1, max_slots=4)) as runner:
+        pooled = run_stages(runner.create_task)
+        tasks.extend(runner.tasks)
+    print_timings(pooled)
+
+    def overhead(timings):
+        return sum(t.queued + t.startup for t in timings)
+    print("** Queueing and startup: %.0fs standalone, %.0fs on the pool" % (overhead(standalone), overhead(pooled)))
+
+    error_happened = any(task.state != 'Success' for task in tasks)
+
+finally:
+    for task in tasks:
+        task.delete(purge_resources=True, purge_results=True)
+    # Exit code in case of error
+    if error_happened:
+        sys.exit(1)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+import time
+
+from qarnot.exceptions import MissingTaskException
+
+# State of the tasks that no longer exist, e.g. deleted before they finished
+MISSING = 'Missing'
+# States after which a task will not evolve anymore
+FINAL_STATES = ('Success', 'Failure', 'Cancelled', MISSING)
+
+
+class TaskFailedError(RuntimeError):
+    '''Raised by TaskWaiter when a watched task ends in another state than Success'''
+    def __init__(self, task, state='Failure'):
+        self.task = task
+        self.state = state
+        if state == MISSING:
+            message = f'task {task.name} ({task.uuid}) no longer exists'
+        elif state == 'Failure':
+            message = f'task {task.name} failed: {task.errors}'
+        else:
+            message = f'task {task.name} ended in state {state}: {task.errors}'
+        super().__init__(message + '.\nSee https://console.qarnot.com/app/tasks for more info')
+
+
+def fetch_states(conn, uuids, job=None, tags=None):
+    '''Return the current state of the tasks of the given uuids, indexed by uuid.
+
+    With job, they are all listed at once by Job.tasks, and with tags by
+    all_tasks filtered on these tags (tags_intersect), which must be set on all
+    the tasks. Otherwise, or for the tasks missing from these listings, every
+    task is retrieved on its own, one request per task. A task that does not exist anymore gets the
+    MISSING state.'''
+    uuids = set(uuids)
+    states = {}
+    if job is not None:
+        summaries = job.tasks
+    elif tags:
+        summaries = conn.all_tasks(summary=True, tags_intersect=list(tags))
+    else:
+        summaries = []
+    for summary in summaries:
+        if summary.uuid in uuids:
+            # Summaries are only read once, never refresh them one by one
+            summary.auto_update = False
+            states[summary.uuid] = summary.state
+    for uuid in uuids - states.keys():
+        try:
+            task = conn.retrieve_task(uuid)
+        except MissingTaskException:
+            states[uuid] = MISSING
+            continue
+        task.auto_update = False
+        states[uuid] = task.state
+    return states
+
+
+def common_tags(tasks):
+    '''Tags set on all the tasks, with which fetch_states lists them at once'''
+    tags = None
+    for task in tasks:
+        tags = set(task.tags or ()) if tags is None else tags & set(task.tags or ())
+    return sorted(tags or ())
+
+
+class TaskWaiter:
+    '''Wait for a whole set of tasks with a single API call per polling pass.
+
+    Instead of calling task.wait() on every task in turn, the waiter fetches the
+    states of all the unfinished tasks at once, from the tasks of job or from the
+    tasks carrying all the tags (see fetch_states), and only refreshes a task in
+    full when it reaches a final state. Without job nor tags, the tags set on all
+    the watched tasks are used (see common_tags): tag the tasks, or pass their
+    job, since tasks with no tag in common cost one request each per pass. A task
+    deleted before it finished ends in the MISSING state. The polling delay grows
+    from min_delay up to max_delay while nothing changes, and goes back to
+    min_delay as soon as a state changes.
+
+    Callbacks:
+        on_state_change(task, state): called each time the state of a task changes
+        on_finished(task): called once per task when it reaches a final state
+        on_poll(tasks): called after each polling pass, e.g. to display stdout
+
+    dependencies is a list of (task, upstream_tasks) pairs, as given to
+    task.set_task_dependencies_from_tasks(upstream_tasks). With fail_fast, the
+    first task to end in another state than Success (Failure, Cancelled or
+    MISSING) aborts every unfinished task depending on it, directly or not,
+    and raises TaskFailedError.'''
+    def __init__(self, conn, tasks, on_state_change=None, on_finished=None, on_poll=None,
+                 dependencies=None, fail_fast=True, min_delay=1., max_delay=30., backoff=1.5,
+                 job=None, tags=None):
+        self._conn = conn
+        self.tasks = list(tasks)
+        self.job = job
+        self.tags = tags if tags or job is not None else common_tags(self.tasks)
+        self.on_state_change = on_state_change
+        self.on_finished = on_finished
+        self.on_poll = on_poll
+        self.fail_fast = fail_fast
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self._dependents = {}
+        for task, upstreams in (dependencies or []):
+            for upstream in upstreams:
+                self._dependents.setdefault(upstream.uuid, []).append(task)
+        self.states = {t.uuid: None for t in self.tasks}
+        self.finished = []
+
+    def _fetch_states(self):
+        '''Return the current state of the unfinished tasks, indexed by uuid'''
+        pending = [uuid for uuid, state in self.states.items() if state not in FINAL_STATES]
+        return fetch_states(self._conn, pending, self.job, self.tags)
+
+    def _cancel_dependents(self, task):
+        '''Abort every unfinished task that transitively depends on task'''
+        pending = list(self._dependents.get(task.uuid, []))
+        seen = set()
+        while pending:
+            dependent = pending.pop()
+            if dependent.uuid in seen:
+                continue
+            seen.add(dependent.uuid)
+            if self.states.get(dependent.uuid) not in FINAL_STATES:
+                dependent.abort()
+            pending.extend(self._dependents.get(dependent.uuid, []))
+
+    def poll(self):
+        '''Run one polling pass. Return True if at least one state changed'''
+        changed = False
+        by_uuid = {t.uuid: t for t in self.tasks}
+        for uuid, state in self._fetch_states().items():
+            if state == self.states[uuid]:
+                continue
+            changed = True
+            task = by_uuid[uuid]
+            self.states[uuid] = state
+            if self.on_state_change is not None:
+                self.on_state_change(task, state)
+            if state not in FINAL_STATES:
+                continue
+            if state != MISSING:
+                # Refresh the whole task once, to get its errors, times and so on
+                task.update(flushcache=True)
+            self.finished.append(task)
+            if self.on_finished is not None:
+                self.on_finished(task)
+            if state != 'Success' and self.fail_fast:
+                self._cancel_dependents(task)
+                raise TaskFailedError(task, state)
+        if self.on_poll is not None:
+            self.on_poll(self.tasks)
+        return changed
+
+    def done(self):
+        return all(state in FINAL_STATES for state in self.states.values())
+
+    def wait(self, timeout=None):
+        '''Wait for every task to reach a final state.
+        Return True if they all did, False if timeout (in seconds) expired before'''
+        start = time.monotonic()
+        delay = self.min_delay
+        while True:
+            changed = self.poll()
+            if self.done():
+                return True
+            delay = self.min_delay if changed else min(delay * self.backoff, self.max_delay)
+            if timeout is not None:
+                remaining = timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    return False
+                delay = min(delay, remaining)
+            time.sleep(delay)
+
+
+def wait_tasks(conn, tasks, **kwargs):
+    '''Shortcut for TaskWaiter(conn, tasks, **kwargs).wait()'''
+    return TaskWaiter(conn, tasks, **kwargs).wait()
@@ -0,0 +1,170 @@
+import pytest
+from qarnot.exceptions import MissingTaskException
+
+from task_waiter import MISSING, TaskFailedError, TaskWaiter, fetch_states
+
+
+class StubTask:
+    '''Task whose state follows states, one value per listing of the connection'''
+    def __init__(self, conn, name, states, tags=()):
+        self._conn = conn
+        self.name = name
+        self.uuid = f'uuid-{name}'
+        self._states = list(states)
+        self.tags = list(tags)
+        self.auto_update = True
+        self.errors = []
+        self.aborted = False
+        self.updates = 0
+
+    @property
+    def state(self):
+        return self._states[min(self._conn.passes, len(self._states) - 1)]
+
+    def update(self, flushcache=False):
+        self.updates += 1
+
+    def abort(self):
+        self.aborted = True
+
+
+class StubJob:
+    def __init__(self, conn, tasks):
+        self._conn = conn
+        self._tasks = tasks
+
+    @property
+    def tasks(self):
+        self._conn.requests.append('job tasks')
+        return [self._conn.summary(task) for task in self._tasks]
+
+
+class StubSummary:
+    def __init__(self, uuid, state):
+        self.uuid = uuid
+        self.state = state
+        self.auto_update = True
+
+
+class StubConnection:
+    '''qarnot.Connection serving the StubTask of tasks, deleted when in deleted.
+    Every request is recorded in requests'''
+    def __init__(self):
+        self.tasks = []
+        self.deleted = set()
+        self.requests = []
+        self.passes = 0
+
+    def task(self, name, states, tags=()):
+        task = StubTask(self, name, states, tags)
+        self.tasks.append(task)
+        return task
+
+    def summary(self, task):
+        return StubSummary(task.uuid, task.state)
+
+    def all_tasks(self, summary=True, tags=None, tags_intersect=None):
+        self.requests.append('all_tasks')
+        return [self.summary(task) for task in self.tasks
+                if task.uuid not in self.deleted and set(tags_intersect or ()) <= set(task.tags)]
+
+    def retrieve_task(self, uuid):
+        self.requests.append('retrieve_task')
+        for task in self.tasks:
+            if task.uuid == uuid and uuid not in self.deleted:
+                return self.summary(task)
+        raise MissingTaskException(uuid)
+
+
+def wait(conn, tasks, **kwargs):
+    '''Run a TaskWaiter without sleeping, moving the stub tasks to their next state after each pass'''
+    waiter = TaskWaiter(conn, tasks, min_delay=0., max_delay=0., **kwargs)
+    while True:
+        try:
+            waiter.poll()
+        finally:
+            conn.passes += 1
+        if waiter.done():
+            return waiter
+
+
+def test_job_is_listed_in_one_request_per_pass():
+    conn = StubConnection()
+    tasks = [conn.task(f't{i}', ['Submitted'] * i + ['Success']) for i in range(4)]
+    finished = []
+    waiter = wait(conn, tasks, job=StubJob(conn, tasks), on_finished=finished.append)
+    assert conn.requests == ['job tasks'] * 4
+    assert finished == tasks
+    assert all(task.updates == 1 for task in tasks)
+    assert waiter.states == {task.uuid: 'Success' for task in tasks}
+
+
+def test_tags_filter_the_listing():
+    conn = StubConnection()
+    tasks = [conn.task(f't{i}', ['Submitted', 'Success'], tags=['run']) for i in range(3)]
+    conn.task('other', ['Submitted'])
+    wait(conn, tasks, tags=['run'])
+    assert conn.requests == ['all_tasks'] * 2
+
+
+def test_common_tags_are_listed_by_default():
+    conn = StubConnection()
+    tasks = [conn.task(f't{i}', ['Submitted', 'Success'], tags=['run', f't{i}']) for i in range(3)]
+    conn.task('other', ['Submitted'])
+    waiter = wait(conn, tasks)
+    assert waiter.tags == ['run']
+    assert conn.requests == ['all_tasks'] * 2
+
+
+def test_without_job_nor_tags_only_the_watched_tasks_are_retrieved():
+    conn = StubConnection()
+    tasks = [conn.task('fast', ['Success']), conn.task('slow', ['Submitted', 'Success'])]
+    conn.task('other', ['Submitted'])
+    wait(conn, tasks)
+    # The finished task is not retrieved again on the second pass
+    assert conn.requests == ['retrieve_task'] * 3
+
+
+def test_failure_cancels_dependents_and_raises():
+    conn = StubConnection()
+    upstream = conn.task('upstream', ['Submitted', 'Failure'])
+    middle = conn.task('middle', ['Submitted'])
+    downstream = conn.task('downstream', ['Submitted'])
+    unrelated = conn.task('unrelated', ['Submitted'])
+    tasks = [upstream, middle, downstream, unrelated]
+    with pytest.raises(TaskFailedError) as error:
+        wait(conn, tasks, job=StubJob(conn, tasks),
+             dependencies=[(middle, [upstream]), (downstream, [middle])])
+    assert error.value.task is upstream
+    assert middle.aborted and downstream.aborted and not unrelated.aborted
+
+
+def test_cancelled_task_raises():
+    conn = StubConnection()
+    task = conn.task('cancelled', ['Submitted', 'Cancelled'])
+    with pytest.raises(TaskFailedError) as error:
+        wait(conn, [task])
+    assert error.value.state == 'Cancelled'
+
+
+def test_deleted_task_is_missing():
+    conn = StubConnection()
+    task = conn.task('deleted', ['Submitted'])
+    conn.deleted.add(task.uuid)
+    tasks = [task]
+    with pytest.raises(TaskFailedError) as error:
+        wait(conn, tasks, job=StubJob(conn, []))
+    assert error.value.state == MISSING
+    # Without fail_fast, the wait ends instead of waiting for the task forever
+    waiter = wait(conn, tasks, job=StubJob(conn, []), fail_fast=False)
+    assert waiter.states[task.uuid] == MISSING
+    assert task.updates == 0
+
+
+def test_fetch_states_missing_from_listing():
+    conn = StubConnection()
+    listed = conn.task('listed', ['Submitted'], tags=['run'])
+    untagged = conn.task('untagged', ['Submitted'])
+    assert fetch_states(conn, [listed.uuid, untagged.uuid], tags=['run']) == \
+        {listed.uuid: 'Submitted', untagged.uuid: 'Submitted'}
+    assert conn.requests == ['all_tasks', 'retrieve_task']